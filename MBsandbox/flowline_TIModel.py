@@ -7,10 +7,10 @@ from oggm.exceptions import InvalidWorkflowError
 
 # import the MBsandbox modules
 from MBsandbox.mbmod_daily_oneflowline import TIModel, RandomMassBalance_TIModel
+from MBsandbox.mbmod_daily_oneflowline import ConstantMassBalance_TIModel
 from MBsandbox.mbmod_daily_oneflowline import \
     MultipleFlowlineMassBalance_TIModel
 from oggm.core.flowline import flowline_model_run
-from oggm.core.massbalance import ConstantMassBalance
 import logging
 
 log = logging.getLogger(__name__)
@@ -204,6 +204,7 @@ def run_random_climate_TIModel(gdir, nyears=1000, y0=None, halfsize=15,
                        output_filesuffix='', init_model_fls=None,
                        zero_initial_glacier=False,
                        unique_samples=False, #melt_f_file=None,
+                               mb_elev_grid=None,
                                **kwargs):
     """Runs the random mass-balance model for a given number of years.
 
@@ -226,10 +227,12 @@ def run_random_climate_TIModel(gdir, nyears=1000, y0=None, halfsize=15,
         the half-size of the time window (window size = 2 * halfsize + 1)
     bias : float
         equal to the residual in TIModel, best is to leave it at 0 !
-    seed : int
+    seed : int or np.random.SeedSequence
         seed for the random generator. If you ignore this, the runs will be
         different each time. Setting it to a fixed seed across glaciers can
-        be useful if you want to have the same climate years for all of them
+        be useful if you want to have the same climate years for all of them.
+        For several ensemble members, use the independent seeds of
+        `MBsandbox.mbmod_daily_oneflowline.spawn_random_mb_seeds`
     store_monthly_step : bool
         whether to store the diagnostic data at a monthly time step or not
         (default is yearly)
@@ -270,6 +273,11 @@ def run_random_climate_TIModel(gdir, nyears=1000, y0=None, halfsize=15,
         per random climate period-length
         if false, every model year will be chosen from the random climate
         period with the same probability
+    mb_elev_grid : np.array
+        if given, the annual mb of the climate period years is computed
+        once on this elevation grid and interpolated to the flowline
+        heights (see RandomMassBalance_TIModel), default is None. It has
+        to cover all heights of the run (also of the advanced glacier)
     kwargs : dict
         kwargs to pass to the FluxBasedModel instance
     """
@@ -303,7 +311,9 @@ def run_random_climate_TIModel(gdir, nyears=1000, y0=None, halfsize=15,
                                              mb_model_sub_class = mb_model_sub_class,
                                      filename=climate_filename,
                                      input_filesuffix=climate_input_filesuffix,
-                                     unique_samples=unique_samples)
+                                     unique_samples=unique_samples,
+                                     mb_elev_grid=mb_elev_grid,
+                                     nyears=nyears + 1)
 
     if precipitation_factor is not None:
         mb.prcp_fac = precipitation_factor
@@ -323,27 +333,33 @@ def run_random_climate_TIModel(gdir, nyears=1000, y0=None, halfsize=15,
                               **kwargs)
 
 
-# work in Process:
-# problem: don't have a constant mb TIModel, this would be quite a lot of work ...
-# not yet adapted at all, first need a new ConstantMbModel_TIModel!!
 @entity_task(log)
 def run_constant_climate_TIModel(gdir, nyears=1000, y0=None, halfsize=15,
-                         bias=None, temperature_bias=None,
-                         precipitation_factor=None,
-                         store_monthly_step=False,
-                         store_model_geometry=None,
-                         init_model_filesuffix=None,
-                         init_model_yr=None,
-                         output_filesuffix='',
-                         climate_filename='climate_historical',
-                         climate_input_filesuffix='',
-                         init_model_fls=None,
-                         zero_initial_glacier=False, **kwargs):
+                                 mb_model_sub_class=TIModel,
+                                 temperature_bias=None,
+                                 mb_type='mb_monthly', grad_type='cte',
+                                 bias=0, melt_f=None,
+                                 precipitation_factor=None,
+                                 store_monthly_step=False,
+                                 store_model_geometry=None,
+                                 init_model_filesuffix=None,
+                                 init_model_yr=None,
+                                 output_filesuffix='',
+                                 climate_filename='climate_historical',
+                                 climate_input_filesuffix='',
+                                 init_model_fls=None,
+                                 zero_initial_glacier=False,
+                                 hbins_step=10, **kwargs):
     """Runs the constant mass-balance model for a given number of years.
 
+    copy of run_constant_climate adapted for TIModel
+
     This will initialize a
-    :py:class:`oggm.core.massbalance.MultipleFlowlineMassBalance`,
-    and run a :py:func:`oggm.core.flowline.flowline_model_run`.
+    :py:class:`MBsandbox.MultipleFlowlineMassBalance_TIModel` with
+    :py:class:`MBsandbox.ConstantMassBalance_TIModel`,
+    and run a :py:func:`oggm.core.flowline.flowline_model_run`. The mb
+    profile of the climate period is only computed once and then
+    interpolated to the flowline heights at every step.
 
     Parameters
     ----------
@@ -358,15 +374,15 @@ def run_constant_climate_TIModel(gdir, nyears=1000, y0=None, halfsize=15,
     halfsize : int, optional
         the half-size of the time window (window size = 2 * halfsize + 1)
     bias : float
-        bias of the mb model. Default is to use the calibrated one, which
-        is often a better idea. For t* experiments it can be useful to set it
-        to zero
+        equal to the residual in TIModel, best is to leave it at 0 !
+    melt_f:
+        calibrated melt_f (float) or 'from_json', then the saved json
+        file from the right prcp-fac and climate is opened and that melt_f is chosen
     temperature_bias : float
         add a bias to the temperature timeseries
     precipitation_factor: float
         multiply a factor to the precipitation time series
-        default is None and means that the precipitation factor from the
-        calibration is applied which is cfg.PARAMS['prcp_scaling_factor']
+        use the value from the calibration!
     store_monthly_step : bool
         whether to store the diagnostic data at a monthly time step or not
         (default is yearly)
@@ -384,7 +400,7 @@ def run_constant_climate_TIModel(gdir, nyears=1000, y0=None, halfsize=15,
         name of the climate file, e.g. 'climate_historical' (default) or
         'gcm_data'
     climate_input_filesuffix: str
-        filesuffix for the input climate file
+        filesuffix for the input climate file, use e.g. 'W5E5' or 'WFDE5_CRU'
     output_filesuffix : str
         this add a suffix to the output file (useful to avoid overwriting
         previous experiments)
@@ -393,11 +409,24 @@ def run_constant_climate_TIModel(gdir, nyears=1000, y0=None, halfsize=15,
     init_model_fls : []
         list of flowlines to use to initialise the model (the default is the
         present_time_glacier file from the glacier directory)
+    hbins_step : float
+        vertical resolution (in m) of the interpolated mb profile,
+        default is 10 m
     kwargs : dict
         kwargs to pass to the FluxBasedModel instance
     """
-
-    NotImplementedError('work in process...')
+    if melt_f == 'from_json':
+        fs = '_{}_{}_{}'.format(climate_input_filesuffix, mb_type, grad_type)
+        d = gdir.read_json(filename='melt_f_geod', filesuffix=fs)
+        # get the calibrated melt_f that suits to the prcp factor
+        try:
+            melt_f_chosen = d['melt_f_pf_{}'.format(np.round(precipitation_factor, 2))]
+        except:
+            raise InvalidWorkflowError('there is no calibrated melt_f for this precipitation factor, glacier, climate'
+                                       'mb_type and grad_type, need to run first melt_f_calib_geod_prep_inversion'
+                                       'with these options!')
+    else:
+        melt_f_chosen = melt_f
 
     if init_model_filesuffix is not None:
         fp = gdir.get_filepath('model_geometry',
@@ -408,15 +437,26 @@ def run_constant_climate_TIModel(gdir, nyears=1000, y0=None, halfsize=15,
         fmod.run_until(init_model_yr)
         init_model_fls = fmod.fls
 
-    mb = MultipleFlowlineMassBalance_TIModel(gdir, mb_model_class=ConstantMassBalance,
-                                     y0=y0, halfsize=halfsize,
-                                     bias=bias, filename=climate_filename,
-                                     input_filesuffix=climate_input_filesuffix)
+    mb = MultipleFlowlineMassBalance_TIModel(gdir,
+                                             mb_model_class=ConstantMassBalance_TIModel,
+                                             y0=y0, halfsize=halfsize,
+                                             melt_f=melt_f_chosen,
+                                             prcp_fac=precipitation_factor,
+                                             mb_type=mb_type,
+                                             grad_type=grad_type,
+                                             bias=bias,
+                                             mb_model_sub_class=mb_model_sub_class,
+                                             filename=climate_filename,
+                                             input_filesuffix=climate_input_filesuffix,
+                                             hbins_step=hbins_step)
 
-    if temperature_bias is not None:
-        mb.temp_bias = temperature_bias
     if precipitation_factor is not None:
         mb.prcp_fac = precipitation_factor
+    if temperature_bias is not None:
+        mb.temp_bias = temperature_bias
+    else:
+        # do the quality check!
+        mb.flowline_mb_models[-1].historical_climate_qc_mod(gdir)
 
     return flowline_model_run(gdir, output_filesuffix=output_filesuffix,
                               mb_model=mb, ys=0, ye=nyears,
@@ -424,4 +464,4 @@ def run_constant_climate_TIModel(gdir, nyears=1000, y0=None, halfsize=15,
                               store_model_geometry=store_model_geometry,
                               init_model_fls=init_model_fls,
                               zero_initial_glacier=zero_initial_glacier,
-                              **kwargs)
\ No newline at end of file
+                              **kwargs)
@@ -13,13 +13,14 @@ import matplotlib.pyplot as plt
 import numpy as np
 from oggm import entity_task
 from oggm.core import climate
+from oggm.exceptions import MassBalanceCalibrationError
 import pandas as pd
 import logging
 
 log = logging.getLogger(__name__)
 
 # imports from local MBsandbox package modules
-from MBsandbox.mbmod_daily_oneflowline import TIModel
+from MBsandbox.mbmod_daily_oneflowline import TIModel, TIModel_Sfc_Type
 
 # %%
 def minimize_bias(x, gd_mb=None, gdir_min=None,
@@ -144,6 +145,99 @@ def minimize_bias_geodetic(x, gd_mb=None, mb_geodetic=None,
     return bias_calib
 
 
+def calibrate_melt_f_geodetic(gd_mb=None, mb_geodetic=None, h=None, w=None,
+                              pf=2.5, ys=np.arange(2000, 2019, 1),
+                              melt_f_min=1, melt_f_max=1000, xtol=0.01,
+                              oggm_default_mb=False, **kwargs):
+    """ calibrates the melt factor (melt_f) to the geodetic mass balance
+    without iterative root finding
+
+    At a fixed precipitation factor (and temperature bias), the mean
+    specific mass balance of TIModel is affine in the melt_f
+    (mb = prcp_solid - melt_f * temp_for_melt). Hence, the bias of
+    `minimize_bias_geodetic` is only evaluated at melt_f_min and melt_f_max,
+    and the melt_f with zero bias is obtained directly from the slope
+    and the intercept. The solution is verified by a third evaluation.
+    For TIModel_Sfc_Type (or if the verification fails, i.e. the model is
+    not linear in melt_f), scipy.optimize.brentq is used instead.
+    If the bias has the same sign at both bounds, no melt_f within the
+    bounds matches the geodetic mass balance and a
+    MassBalanceCalibrationError is raised.
+
+    Parameters
+    ----------
+    gd_mb: class instance
+        instantiated class of TIModel, this is updated by melt_f
+    mb_geodetic: float
+         geodetic mass balance of the instantiated glacier
+    h: np.array
+        heights of the instantiated glacier
+    w: np.array
+        widths of the instantiated glacier
+    pf: float
+        precipitation scaling factor
+        default is 2.5
+    ys: np.array
+        years for which specific mass balance is computed
+        default is 2000--2019 (when using W5E5)
+    melt_f_min, melt_f_max : float
+        physical bounds of the melt_f, the melt_f has to be in between.
+        Default is 1 and 1000
+    xtol : float
+        tolerance of the melt_f, used to verify the linear solution and
+        for brentq. Default is 0.01
+    oggm_default_mb : bool
+        if default oggm mass balance should be used (default is False)
+    **kwargs :
+        send to get_specific_mb , e.g. spinup=True
+
+    Returns
+    -------
+    float
+        the calibrated melt_f, gd_mb.melt_f and gd_mb.prcp_fac are set
+        to the calibrated values
+    """
+    args = (gd_mb, mb_geodetic, h, w, pf, False, ys, oggm_default_mb)
+
+    def bias(melt_f):
+        return minimize_bias_geodetic(melt_f, *args, **kwargs)
+
+    def brentq():
+        try:
+            melt_f = scipy.optimize.brentq(bias, melt_f_min, melt_f_max,
+                                           xtol=xtol, disp=True)
+        except ValueError:
+            raise MassBalanceCalibrationError('the geodetic mass balance '
+                                              'can not be matched with a '
+                                              'melt_f between {} and '
+                                              '{}'.format(melt_f_min,
+                                                          melt_f_max))
+        # set the model to the calibrated melt_f
+        bias(melt_f)
+        return melt_f
+
+    if isinstance(gd_mb, TIModel_Sfc_Type):
+        # the surface type distinction makes the mb non-linear in melt_f
+        return brentq()
+
+    bias_min = bias(melt_f_min)
+    bias_max = bias(melt_f_max)
+    if bias_min * bias_max > 0:
+        raise MassBalanceCalibrationError('the geodetic mass balance can not '
+                                          'be matched with a melt_f between '
+                                          '{} and {}'.format(melt_f_min,
+                                                             melt_f_max))
+    slope = (bias_max - bias_min) / (melt_f_max - melt_f_min)
+    melt_f = melt_f_min - bias_min / slope
+    # check if the model is really linear in melt_f
+    if (not (melt_f_min <= melt_f <= melt_f_max) or
+            np.abs(bias(melt_f)) > np.abs(slope) * xtol):
+        log.warning('mass balance is not linear in melt_f, '
+                    'use brentq instead')
+        return brentq()
+    return melt_f
+
+
 def optimize_std_quot_brentq_geod(x, gd_mb=None, mb_geodetic=None,
                                   mb_glaciological=None,
                                   h=None, w=None,
@@ -151,10 +245,8 @@ def optimize_std_quot_brentq_geod(x, gd_mb=None, mb_geodetic=None,
                                   ):
     pf = x
     # compute optimal melt_f according to geodetic data
-    melt_f_opt = scipy.optimize.brentq(minimize_bias_geodetic, 1, 10000,
-                                       xtol=0.01,
-                                       args=(gd_mb, mb_geodetic, h, w, pf),
-                                       disp=True)
+    melt_f_opt = calibrate_melt_f_geodetic(gd_mb, mb_geodetic, h, w, pf,
+                                           melt_f_max=10000, xtol=0.01)
 
     gd_mb.melt_f = melt_f_opt
     gd_mb.prcp_fac = pf
@@ -324,12 +416,10 @@ def melt_f_calib_geod_prep_inversion(gdir, mb_type='mb_monthly', grad_type='cte'
     # and get here the right melt_f fitting to that precipitation factor
     h, w = gdir.get_inversion_flowline_hw()
     # find the melt factor that minimises the bias to the geodetic observations
-    melt_f_opt = scipy.optimize.brentq(minimize_bias_geodetic, 1, 1000,
-                                       disp=True, xtol=0.1,
-                                       args=(mb_mod, mb_geodetic, h, w,
-                                             pf, False,
-                                             np.arange(2000, ye, 1)  # time period that we want to calibrate
-                                             ))
+    melt_f_opt = calibrate_melt_f_geodetic(mb_mod, mb_geodetic, h, w, pf,
+                                           # time period that we want to calibrate
+                                           ys=np.arange(2000, ye, 1),
+                                           melt_f_max=1000, xtol=0.1)
     mb_mod.melt_f = melt_f_opt
     mb_mod.prcp_fac = pf
 
@@ -20,18 +20,29 @@ import os
 import netCDF4
 import datetime
 import warnings
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, ExitStack
 import scipy.stats as stats
+from scipy.spatial import cKDTree
+import pickle
+import hashlib
+import uuid
 import logging
+import requests
+from urllib.parse import urlparse
 # import oggm
 
 # imports from oggm
 from oggm import entity_task
+from oggm.utils._workflow import global_task
 from oggm import cfg, utils
 from oggm.cfg import SEC_IN_YEAR, SEC_IN_MONTH, SEC_IN_DAY
 from oggm.utils import (floatyear_to_date, date_to_floatyear, ncDataset,
                         clip_min, clip_array)
 from oggm.utils._funcs import haversine
-from oggm.exceptions import InvalidParamsError, InvalidWorkflowError
+from oggm.exceptions import (InvalidParamsError, InvalidWorkflowError,
+                             DownloadVerificationFailedException)
 from oggm.shop.ecmwf import get_ecmwf_file, BASENAMES
 from oggm.core.massbalance import MassBalanceModel
 
@@ -39,6 +50,7 @@ from oggm.core.massbalance import MassBalanceModel
 log = logging.getLogger(__name__)
 
 ECMWF_SERVER = 'https://cluster.klima.uni-bremen.de/~oggm/climate/'
+W5E5_SERVER = 'https://cluster.klima.uni-bremen.de/~lschuster/'
 # %%
 
 # add era5_daily dataset, this only works with process_era5_daily_data
@@ -61,8 +73,7 @@ BASENAMES['W5E5_daily'] = {
     }
 
 
-def get_w5e5_file(dataset='W5E5_daily', var=None,
-                  server='https://cluster.klima.uni-bremen.de/~lschuster/'):
+def get_w5e5_file(dataset='W5E5_daily', var=None, server=W5E5_SERVER):
     """returns a path to desired WFDE5_CRU or W5E5 baseline climate file.
 
     If the file is not present, downloads it
@@ -82,14 +93,188 @@ def get_w5e5_file(dataset='W5E5_daily', var=None,
 
     # File to look for
     return utils.file_downloader(server + BASENAMES[dataset][var])
+
+
+def _get_dl_cache_path(url):
+    """path of the url in the OGGM download cache (the same path that
+    utils.file_downloader looks for)"""
+    cache_dir = cfg.PATHS['dl_cache_dir']
+    if not cache_dir or cfg.PARAMS['dl_cache_readonly']:
+        raise InvalidWorkflowError('prefetching needs a writable download '
+                                   'cache, set cfg.PATHS["dl_cache_dir"]')
+    url = urlparse(url)
+    return os.path.join(cache_dir, url.netloc + url.path)
+
+
+def _file_sha256(fpath, chunk_size=2**20):
+    """sha256 hex digest of a file"""
+    h = hashlib.sha256()
+    with open(fpath, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _get_remote_sha256(url, timeout=60):
+    """sha256 of the `url.sha256` file on the server (None if there is
+    none)"""
+    try:
+        r = requests.get(url + '.sha256', timeout=timeout)
+    except requests.exceptions.RequestException:
+        return None
+    if r.status_code != 200 or len(r.text.split()) == 0:
+        return None
+    return r.text.split()[0].lower()
+
+
+def _resumable_download(url, fpath, sha256=None, chunk_size=2**20,
+                        retry_max=5, timeout=60):
+    """downloads url in chunks into fpath
+
+    The data is first written to `fpath.part`: an interrupted download is
+    resumed from there (with an HTTP range request) at the next retry or
+    call. The file is only moved to fpath once it is complete and, if
+    sha256 is given, verified.
+    """
+    part = fpath + '.part'
+    utils.mkdir(os.path.dirname(fpath))
+    for retry in range(retry_max):
+        pos = os.path.getsize(part) if os.path.exists(part) else 0
+        headers = {'Range': 'bytes={}-'.format(pos)} if pos > 0 else {}
+        try:
+            with requests.get(url, headers=headers, stream=True,
+                              timeout=timeout) as r:
+                # 416: the part file is already complete
+                if r.status_code != 416:
+                    r.raise_for_status()
+                    # 200: the server does not support ranges, restart
+                    mode = 'ab' if r.status_code == 206 else 'wb'
+                    with open(part, mode) as f:
+                        for chunk in r.iter_content(chunk_size=chunk_size):
+                            f.write(chunk)
+            break
+        except (requests.exceptions.ConnectionError,
+                requests.exceptions.Timeout,
+                requests.exceptions.ChunkedEncodingError) as err:
+            if retry == retry_max - 1:
+                raise
+            log.warning('download of {} interrupted ({}), resuming '
+                        '...'.format(url, err))
+
+    if sha256 is not None and _file_sha256(part) != sha256:
+        os.remove(part)
+        raise DownloadVerificationFailedException(
+            msg='{} does not have the expected sha256'.format(url),
+            path=fpath)
+    os.replace(part, fpath)
+    return fpath
+
+
+def prefetch_climate_files(datasets=('ERA5_daily', 'WFDE5_CRU_daily',
+                                     'W5E5_daily'),
+                           w5e5_server=W5E5_SERVER,
+                           ecmwf_server=ECMWF_SERVER,
+                           checksums=None, n_workers=4, reset=False):
+    """Downloads all files of the daily climate datasets at once.
+
+    get_w5e5_file and get_ecmwf_file download the files when they are first
+    needed, i.e. inside the tasks, where the workers then wait for (or race
+    each other on) the large downloads. Run this once before the tasks
+    instead: the files are downloaded concurrently (in resumable chunks)
+    into the OGGM download cache (cfg.PATHS['dl_cache_dir']), where
+    get_w5e5_file and get_ecmwf_file find them afterwards.
+
+    Parameters
+    ----------
+    datasets : list of str
+        the BASENAMES datasets to download, default are the ones that this
+        module adds (other ones, e.g. 'ERA5dr' for the lapse rates, are
+        downloaded from the ecmwf_server)
+    w5e5_server, ecmwf_server : str
+        the servers of the WFDE5_CRU/W5E5 and of the other datasets (as in
+        get_w5e5_file and get_ecmwf_file, e.g. a local mirror)
+    checksums : dict, optional
+        the sha256 of the files (keys are the BASENAMES paths). Otherwise,
+        the `.sha256` file next to the file on the server is used if there
+        is one. Files that are already in the cache are verified with it
+        and downloaded again if they differ. If there is no checksum, the
+        files are not verified
+    n_workers : int
+        the amount of concurrent downloads, default is 4
+    reset : bool
+        download the files again even if they are already in the cache
+
+    Returns
+    -------
+    dict with the local path of every (dataset, var)
+    """
+    checksums = dict() if checksums is None else checksums
+    files = []
+    for dataset in datasets:
+        if dataset not in BASENAMES.keys():
+            raise InvalidParamsError('dataset {} not in '
+                                     '{}'.format(dataset, BASENAMES.keys()))
+        server = (w5e5_server if dataset in ['WFDE5_CRU_daily', 'W5E5_daily']
+                  else ecmwf_server)
+        for var, basename in BASENAMES[dataset].items():
+            files.append(((dataset, var), basename, server + basename))
+
+    def prefetch(basename, url):
+        fpath = _get_dl_cache_path(url)
+        sha256 = checksums.get(basename, None)
+        if sha256 is None:
+            sha256 = _get_remote_sha256(url)
+        if os.path.exists(fpath) and not reset:
+            if sha256 is None or _file_sha256(fpath) == sha256:
+                return fpath
+            log.warning('{} in the download cache is corrupted, downloading '
+                        'it again'.format(fpath))
+        return _resumable_download(url, fpath, sha256=sha256)
+
+    paths = _map_concurrent(prefetch, [(b, url) for _, b, url in files],
+                            concurrent_reads=n_workers > 1,
+                            max_workers=n_workers)
+    return {key: path for (key, _, _), path in zip(files, paths)}
+
+
 # this could be used in general
+def _date2num(time, time_unit, calendar='standard'):
+    """numeric time values (as netCDF4.date2num)
+
+    For a pd.DatetimeIndex with the usual 'days since ...' units and
+    (proleptic) gregorian calendars, this is computed vectorized from the
+    datetime64 values, otherwise netCDF4.date2num is used.
+    """
+    ref = None
+    if (isinstance(time, pd.DatetimeIndex) and
+            time_unit.startswith('days since ') and
+            calendar in ['standard', 'gregorian', 'proleptic_gregorian']):
+        try:
+            ref = pd.Timestamp(time_unit[len('days since '):])
+        except (ValueError, OverflowError):
+            ref = None
+    # the standard calendar is julian before 1582-10-15
+    if ref is not None and (calendar == 'proleptic_gregorian' or
+                            min(ref, time[0]) >= pd.Timestamp('1582-10-15')):
+        return ((time.values - ref.to_datetime64()) /
+                np.timedelta64(1, 'D'))
+    try:
+        return netCDF4.date2num([t for t in time], time_unit,
+                                calendar=calendar)
+    except TypeError:
+        # numpy's broken datetime only works for us precision
+        time = np.asarray(time).astype('M8[us]').astype(datetime.datetime)
+        return netCDF4.date2num(time, time_unit, calendar=calendar)
+
+
 def write_climate_file(gdir, time, prcp, temp,
                        ref_pix_hgt, ref_pix_lon, ref_pix_lat,
                        gradient=None, temp_std=None,
                        time_unit=None, calendar=None,
                        source=None, file_name='climate_historical',
                        filesuffix='',
-                       temporal_resol='monthly'):
+                       temporal_resol='monthly',
+                       complevel=None, buffered=False):
     """Creates a netCDF4 file with climate data timeseries.
 
     Parameters
@@ -129,6 +314,17 @@ def write_climate_file(gdir, time, prcp, temp,
     temporal_resol : str
         temporal resolution of climate file, either monthly (default) or
         daily
+    complevel : int, optional
+        zlib compression level of the variables (1-9) or 0 for no
+        compression. The default (None) is to compress with the netCDF4
+        default level if cfg.PARAMS['compress_climate_netcdf'] is True.
+        A low level (e.g. 1) is much faster to write than the default and
+        compresses the climate series nearly as well
+    buffered : bool
+        if True, the whole file is built in memory and written to disk in
+        one operation when it is closed (instead of writing every variable
+        on its own), which is faster for many small files or on network
+        file systems. Default is False
     """
 
     if source == 'ERA5_daily' and filesuffix == '':
@@ -155,15 +351,22 @@ def write_climate_file(gdir, time, prcp, temp,
     if source is None:
         raise InvalidParamsError('`source` kwarg is required')
 
-    zlib = cfg.PARAMS['compress_climate_netcdf']
+    if complevel is None:
+        zlib = cfg.PARAMS['compress_climate_netcdf']
+        var_kwargs = dict(zlib=zlib)
+    else:
+        var_kwargs = dict(zlib=complevel > 0)
+        if complevel > 0:
+            var_kwargs['complevel'] = complevel
 
     try:
-        y0 = time[0].year
-        y1 = time[-1].year
-    except AttributeError:
+        # the time encoding is then vectorized (see _date2num)
         time = pd.DatetimeIndex(time)
-        y0 = time[0].year
-        y1 = time[-1].year
+    except (TypeError, ValueError):
+        # e.g. cftime dates of exotic calendars
+        pass
+    y0 = time[0].year
+    y1 = time[-1].year
 
     if time_unit is None:
         # http://pandas.pydata.org/pandas-docs/stable/timeseries.html
@@ -176,7 +379,15 @@ def write_climate_file(gdir, time, prcp, temp,
         else:
             raise InvalidParamsError('Time format not supported')
 
-    with ncDataset(fpath, 'w', format='NETCDF4') as nc:
+    nc_kwargs = dict(format='NETCDF4')
+    if buffered:
+        # diskless and persist: written to fpath when the file is closed
+        nc_kwargs.update(diskless=True, persist=True)
+
+    with ncDataset(fpath, 'w', **nc_kwargs) as nc:
+        if buffered:
+            # all the values are written, no need to prefill
+            nc.set_fill_off()
         nc.ref_hgt = ref_pix_hgt
         nc.ref_pix_lon = ref_pix_lon
         nc.ref_pix_lat = ref_pix_lat
@@ -201,18 +412,12 @@ def write_climate_file(gdir, time, prcp, temp,
             calendar = 'standard'
 
         tatts['calendar'] = calendar
-        try:
-            numdate = netCDF4.date2num([t for t in time], time_unit,
-                                       calendar=calendar)
-        except TypeError:
-            # numpy's broken datetime only works for us precision
-            time = time.astype('M8[us]').astype(datetime.datetime)
-            numdate = netCDF4.date2num(time, time_unit, calendar=calendar)
+        numdate = _date2num(time, time_unit, calendar=calendar)
 
         timev.setncatts(tatts)
         timev[:] = numdate
 
-        v = nc.createVariable('prcp', 'f4', ('time',), zlib=zlib)
+        v = nc.createVariable('prcp', 'f4', ('time',), **var_kwargs)
         v.units = 'kg m-2'
         # this could be made more beautriful
         # just rough estimate
@@ -240,7 +445,7 @@ def write_climate_file(gdir, time, prcp, temp,
         assert prcp.max() > 1
         v[:] = prcp
 
-        v = nc.createVariable('temp', 'f4', ('time',), zlib=zlib)
+        v = nc.createVariable('temp', 'f4', ('time',), **var_kwargs)
         v.units = 'degC'
         if ((source == 'ERA5_daily' or source == 'WFDE5_daily_cru' or source =='W5E5_daily') and
             len(temp) > (y1 - y0) * 28 * 12 and temporal_resol == 'daily'):
@@ -259,56 +464,106 @@ def write_climate_file(gdir, time, prcp, temp,
         v[:] = temp
 
         if gradient is not None:
-            v = nc.createVariable('gradient', 'f4', ('time',), zlib=zlib)
+            v = nc.createVariable('gradient', 'f4', ('time',),
+                                  **var_kwargs)
             v.units = 'degC m-1'
             v.long_name = ('temperature gradient from local regression or'
                            'lapserates')
             v[:] = gradient
 
         if temp_std is not None:
-            v = nc.createVariable('temp_std', 'f4', ('time',), zlib=zlib)
+            v = nc.createVariable('temp_std', 'f4', ('time',),
+                                  **var_kwargs)
             v.units = 'degC'
             v.long_name = 'standard deviation of daily temperatures'
             v[:] = temp_std
 
-@entity_task(log, writes=['climate_historical_daily'])
-def process_w5e5_data(gdir, y0=None, y1=None, temporal_resol='daily',
-                       climate_type='WFDE5_CRU',
-                       output_filesuffix=None,
-                       cluster=False):
-    """
-    Processes and writes the WFDE5_CRU & W5E5 daily baseline climate data for a glacier.
-    Either on daily or on monthly basis
 
-    Extracts the nearest timeseries and writes everything to a NetCDF file.
-    This uses only the WFDE5_CRU / W5E5 daily temperatures. The temperature lapse
-    rate are used from ERA5dr.
-
-    TODO: see _verified_download_helper no known hash for
-    wfde5_daily_t2m_1979-2018_flat.nc and wfde5_glacier_invariant_flat
-    ----------
-    y0 : int
-        the starting year of the timeseries to write. The default is to take
-        the entire time period available in the file, but with this kwarg
-        you can shorten it (to save space or to crop bad data)
-    y1 : int
-        the starting year of the timeseries to write. The default is to take
-        the entire time period available in the file, but with this kwarg
-        you can shorten it (to save space or to crop bad data)
-    temporal_resol : str
-        uses either daily (default) or monthly data
-    climate_type: str
-        either WFDE5_CRU (defualt, v1.1 only till end of 2018) or W5E5
-    output_filesuffix : optional
-         None by default, as the output_filesuffix is automatically chosen
-         from the temporal_resol and climate_type. But you can change the filesuffix here,
-         just make sure that you use then later the right climate file
-    cluster : bool
-        default is False, if this is run on the cluster, set it to True,
-        because we do not need to download the files
+def append_climate_file(gdir, time, prcp, temp,
+                        ref_pix_hgt, ref_pix_lon, ref_pix_lat,
+                        gradient=None, temp_std=None,
+                        source=None, file_name='climate_historical',
+                        filesuffix='', temporal_resol='monthly'):
+    """Appends new climate data to a climate file of write_climate_file.
 
+    The new time series have to start just after the last time step of the
+    file and have to end with a full hydrological year. They are appended
+    along the (unlimited) time dimension with the time units and calendar
+    of the file, and hydro_yr_1 is updated. The parameters are the same as
+    for write_climate_file (so that the same kwargs can be given), the
+    climate source and grid point have to be the same as in the file.
     """
-
+    fpath = gdir.get_filepath(file_name, filesuffix=filesuffix)
+    if not os.path.exists(fpath):
+        raise InvalidWorkflowError('there is no climate file to append to: '
+                                   '{}'.format(fpath))
+    try:
+        time = pd.DatetimeIndex(time)
+    except (TypeError, ValueError):
+        # e.g. cftime dates of GCMs
+        pass
+    em = cfg.PARAMS['hydro_month_{}'.format(gdir.hemisphere)] - 1
+    em = 12 if em == 0 else em
+    if time[-1].month != em:
+        raise InvalidParamsError('the appended climate has to end with a '
+                                 'full hydrological year')
+
+    with ncDataset(fpath, 'a') as nc:
+        if source is not None and nc.climate_source != source:
+            raise InvalidWorkflowError('the climate file has another source: '
+                                       '{}'.format(nc.climate_source))
+        if not (np.isclose(nc.ref_pix_lon, ref_pix_lon) and
+                np.isclose(nc.ref_pix_lat, ref_pix_lat)):
+            raise InvalidWorkflowError('the climate file was written for '
+                                       'another grid point')
+        timev = nc.variables['time']
+        # start of the month after the last time step of the file
+        last = netCDF4.num2date(timev[-1], timev.units,
+                                calendar=timev.calendar)
+        start = (last.year + last.month // 12, last.month % 12 + 1, 1)
+        if (time[0].year, time[0].month, time[0].day) != start:
+            raise InvalidParamsError('the appended climate has to start at '
+                                     '{:04d}-{:02d}-{:02d}, not at '
+                                     '{:04d}-{:02d}-{:02d}'.format(
+                                         *start, time[0].year, time[0].month,
+                                         time[0].day))
+        numdate = _date2num(time, timev.units, calendar=timev.calendar)
+        n0 = len(timev)
+        n1 = n0 + len(time)
+        timev[n0:n1] = numdate
+        for var, values in [('prcp', prcp), ('temp', temp),
+                            ('gradient', gradient), ('temp_std', temp_std)]:
+            if (values is None) != (var not in nc.variables):
+                raise InvalidParamsError('{} has to be given if and only if '
+                                         'it is in the climate '
+                                         'file'.format(var))
+            if values is not None:
+                assert len(values) == len(time)
+                nc.variables[var][n0:n1] = values
+        nc.hydro_yr_1 = time[-1].year
+
+
+def _get_append_y0(gdir, file_name='climate_historical', filesuffix=''):
+    """first (calendar) year of the climate that is not yet in the climate
+    file, i.e. the y0 to use for appending (None if there is no file)"""
+    fpath = gdir.get_filepath(file_name, filesuffix=filesuffix)
+    if not os.path.exists(fpath):
+        return None
+    with xr.open_dataset(fpath) as ds:
+        last = pd.Timestamp(ds.time.values[-1])
+    start = pd.Timestamp(last.year, last.month, 1) + pd.DateOffset(months=1)
+    sm = cfg.PARAMS['hydro_month_{}'.format(gdir.hemisphere)]
+    if start.month != sm:
+        raise InvalidWorkflowError('the climate file {} does not end with a '
+                                   'full hydrological year (hydro_month '
+                                   'changed?)'.format(fpath))
+    return start.year
+
+
+def _get_w5e5_dataset(climate_type='WFDE5_CRU', temporal_resol='daily',
+                      output_filesuffix=None):
+    """basename of the climate dataset and output_filesuffix
+    (see process_w5e5_data)"""
     if climate_type == 'WFDE5_CRU':
         if temporal_resol=='monthly':
             output_filesuffix_def = '_monthly_WFDE5_CRU'
@@ -337,15 +592,43 @@ def process_w5e5_data(gdir, y0=None, y1=None, temporal_resol='daily',
     else:
         # use the user-given output-filesufix
         pass
-
-    # wfde5_daily for temperature and precipitation
-    # but need temperature lapse rates from ERA5
-    dataset_othervars = 'ERA5dr'
-
-    # get the central longitude/latitudes of the glacier
-    lon = gdir.cenlon + 360 if gdir.cenlon < 0 else gdir.cenlon
-    lat = gdir.cenlat
-
+    return dataset, output_filesuffix
+
+
+def _get_temporal_resols(temporal_resol='daily'):
+    """tuple of the temporal resolutions (see process_w5e5_data)"""
+    if isinstance(temporal_resol, str):
+        temporal_resol = [temporal_resol]
+    temporal_resols = tuple(temporal_resol)
+    if (len(temporal_resols) == 0 or
+            not set(temporal_resols) <= {'daily', 'monthly'}):
+        raise InvalidParamsError('temporal_resol can only be monthly'
+                                 'or daily (or both)!')
+    return temporal_resols
+
+
+def _get_w5e5_filesuffixes(climate_type='WFDE5_CRU', temporal_resol='daily',
+                           output_filesuffix=None):
+    """basename of the climate dataset and output_filesuffix of every
+    temporal resolution (see process_w5e5_data)"""
+    temporal_resols = _get_temporal_resols(temporal_resol)
+    if not isinstance(output_filesuffix, dict):
+        if output_filesuffix is not None and len(temporal_resols) > 1:
+            raise InvalidParamsError('if daily and monthly files are '
+                                     'written at once, output_filesuffix has '
+                                     'to be None or a dict with the '
+                                     'filesuffix of each temporal_resol')
+        output_filesuffix = {resol: output_filesuffix
+                             for resol in temporal_resols}
+    filesuffixes = {}
+    for resol in temporal_resols:
+        dataset, filesuffixes[resol] = _get_w5e5_dataset(
+            climate_type, resol, output_filesuffix.get(resol, None))
+    return dataset, filesuffixes
+
+
+def _get_w5e5_paths(dataset, cluster=False):
+    """paths of the tmp, prcp and inv file of the WFDE5_CRU/W5E5 dataset"""
     if cluster:
         cluster_path = '/home/users/lschuster/'
         path_tmp = cluster_path + BASENAMES[dataset]['tmp']
@@ -356,187 +639,854 @@ def process_w5e5_data(gdir, y0=None, y1=None, temporal_resol='daily',
         path_tmp = get_w5e5_file(dataset, 'tmp')
         path_prcp = get_w5e5_file(dataset, 'prcp')
         path_inv = get_w5e5_file(dataset, 'inv')
+    # use the point-major stores if they were created
+    return (get_point_major_store(path_tmp), get_point_major_store(path_prcp),
+            get_point_major_store(path_inv))
+
+
+# KD-trees of the points of flattened datasets (per process),
+# see get_flat_points_kdtree
+_FLAT_POINTS_KDTREES = dict()
+
+
+def _lonlat_to_xyz(lon, lat):
+    """coordinates on the 3D unit sphere (to have the right nearest points
+    also near the dateline and the poles)"""
+    lon = np.deg2rad(np.asarray(lon, dtype=np.float64))
+    lat = np.deg2rad(np.asarray(lat, dtype=np.float64))
+    return np.stack([np.cos(lat) * np.cos(lon),
+                     np.cos(lat) * np.sin(lon),
+                     np.sin(lat)], axis=-1)
+
+
+def _get_path_next_to(source, fname, cache_subdir, check_writable=True):
+    """path of a file that belongs to the dataset file `source`: next to the
+    dataset, or in a subdirectory of the working directory if we can not
+    write there (e.g. on the cluster)"""
+    fpath = os.path.join(os.path.dirname(os.path.abspath(source)), fname)
+    if not check_writable or os.access(os.path.dirname(fpath), os.W_OK):
+        return fpath
+    cache_dir = os.path.join(cfg.PATHS['working_dir'], cache_subdir)
+    utils.mkdir(cache_dir)
+    return os.path.join(cache_dir, fname)
+
+
+def _get_kdtree_cache_path(source):
+    """KD-tree file of the dataset (see get_flat_points_kdtree)"""
+    return _get_path_next_to(source, os.path.basename(source) + '.kdtree.pkl',
+                             'cache_kdtree')
+
+
+def _get_point_major_store_paths(path):
+    """possible paths of the point-major store of a dataset file (next to
+    the dataset and in the working directory)"""
+    fname = os.path.splitext(os.path.basename(path))[0] + '_point_major.nc'
+    paths = [_get_path_next_to(path, fname, 'point_major_stores',
+                               check_writable=False)]
+    if cfg.PATHS.get('working_dir', None):
+        paths.append(os.path.join(cfg.PATHS['working_dir'],
+                                  'point_major_stores', fname))
+    return paths
+
+
+def get_point_major_store(path):
+    """path of the point-major store of a flattened dataset if it exists
+    (and is newer than the dataset), otherwise path itself
+
+    See convert_to_point_major_store. process_w5e5_data and
+    process_era5_daily_data use this to automatically read from the store.
+    """
+    for fpath in _get_point_major_store_paths(path):
+        if (os.path.exists(fpath) and
+                os.path.getmtime(fpath) >= os.path.getmtime(path)):
+            return fpath
+    return path
+
+
+def convert_to_point_major_store(path, out_path=None, block_size=1000,
+                                 complevel=1):
+    """Rewrites a flattened climate dataset into a point-major store.
+
+    The flattened W5E5/WFDE5_CRU/ERA5 daily files are stored in a way that
+    reading the 40 year daily series of one point touches many chunks. The
+    store is a NetCDF4 file with the same content, but every variable with
+    a `points` dimension is chunked with all time steps and one point, so
+    that the series of one point is read from one contiguous chunk.
+    This has to be done only once per file. Afterwards, process_w5e5_data
+    and process_era5_daily_data use the store automatically
+    (see get_point_major_store).
 
-    # Use xarray to read the data
-    # would go faster with netCDF -.-
-    # first temperature dataset
-    with xr.open_dataset(path_tmp) as ds:
-        assert ds.longitude.min() >= 0
-
-        # set temporal subset for the ts data (hydro years)
-        if gdir.hemisphere == 'nh':
-            sm = cfg.PARAMS['hydro_month_nh']
-        elif gdir.hemisphere == 'sh':
-            sm = cfg.PARAMS['hydro_month_sh']
-
-        em = sm - 1 if (sm > 1) else 12
-
-        yrs = ds['time.year'].data
-        y0 = yrs[0] if y0 is None else y0
-        y1 = yrs[-1] if y1 is None else y1
-        if climate_type == 'WFDE5_CRU':
-            # old version of WFDE5_CRU that only goes till 2018
-            if y1 > 2018 or y0 < 1979:
-                text = 'The climate files only go from 1979--2018,\
-                    choose another y0 and y1'
-                raise InvalidParamsError(text)
-        elif climate_type == 'W5E5':
-            if y1 > 2019 or y0 < 1979:
-                text = 'The climate files only go from 1979 --2019, something is wrong'
-        # if default settings: this is the last day in March or September
-        time_f = '{}-{:02d}'.format(y1, em)
-        end_day = int(ds.sel(time=time_f).time.dt.daysinmonth[-1].values)
-
-        #  this was tested also for hydro_month = 1
-        ds = ds.sel(time=slice('{}-{:02d}-01'.format(y0, sm),
-                               '{}-{:02d}-{}'.format(y1, em, end_day)))
+    Parameters
+    ----------
+    path : str
+        path of the flattened dataset
+    out_path : str, optional
+        path of the store. Default is next to the dataset (or in the
+        working directory if we can not write there) with the suffix
+        '_point_major.nc', where it is found automatically.
+    block_size : int
+        amount of points that are copied at once (memory usage:
+        block_size x time steps values)
+    complevel : int
+        zlib compression level of the store, 0 means no compression
 
-        try:
-            # computing all the distances and choose the nearest gridpoint
-            c = (ds.longitude - lon)**2 + (ds.latitude - lat)**2
-            ds = ds.isel(points=c.argmin())
-        # I turned this around
-        except ValueError:
-            ds = ds.sel(longitude=lon, latitude=lat, method='nearest')
-            # normally if I do the flattening, this here should not occur
-
-        # if we want to use monthly mean temperatures and
-        # standard deviation of daily temperature:
-        Tvar = 'Tair'
-        Pvar = 'tp'
-        if climate_type == 'W5E5':
-            Tvar = 'tas'
-            Pvar = 'pr'
-        if temporal_resol == 'monthly':
-            Tair_std = ds.resample(time='MS').std()[Tvar]
-            temp_std = Tair_std.data
-            ds = ds.resample(time='MS').mean()
-            ds['longitude'] = ds.longitude.isel(time=0)
-            ds['latitude'] = ds.latitude.isel(time=0)
-        elif temporal_resol == 'daily':
-            temp_std = None
-        else:
-            raise InvalidParamsError('temporal_resol can only be monthly'
-                                     'or daily!')
+    Returns
+    -------
+    the path of the store
+    """
+    if out_path is None:
+        fname = (os.path.splitext(os.path.basename(path))[0] +
+                 '_point_major.nc')
+        out_path = _get_path_next_to(path, fname, 'point_major_stores')
+    # write to a temporary file first: a half written store should never
+    # be used
+    tmp_path = '{}.{}.tmp'.format(out_path, os.getpid())
+
+    with netCDF4.Dataset(path) as src, \
+            netCDF4.Dataset(tmp_path, 'w', format='NETCDF4') as dst:
+        if 'points' not in src.dimensions:
+            raise InvalidParamsError('{} is not a flattened dataset (no '
+                                     '`points` dimension)'.format(path))
+        dst.setncatts({a: src.getncattr(a) for a in src.ncattrs()})
+        for name, dim in src.dimensions.items():
+            dst.createDimension(name, None if dim.isunlimited()
+                                else len(dim))
+        for name, var in src.variables.items():
+            if 'points' in var.dimensions and var.ndim > 1:
+                # all time steps, one point (longitude, latitude... with
+                # only the points dimension are not chunked per point)
+                chunks = [1 if d == 'points' else
+                          max(len(src.dimensions[d]), 1)
+                          for d in var.dimensions]
+            else:
+                chunks = None
+            atts = {a: var.getncattr(a) for a in var.ncattrs()}
+            fill_value = atts.pop('_FillValue', None)
+            v = dst.createVariable(name, var.dtype, var.dimensions,
+                                   zlib=complevel > 0,
+                                   complevel=max(complevel, 1),
+                                   chunksizes=chunks,
+                                   fill_value=fill_value)
+            v.setncatts(atts)
+
+        # copy the raw values (no masking and scaling)
+        src.set_auto_maskandscale(False)
+        dst.set_auto_maskandscale(False)
+        n_points = len(src.dimensions['points'])
+        for name, var in src.variables.items():
+            if 'points' not in var.dimensions:
+                dst[name][:] = var[:]
+                continue
+            ax = var.dimensions.index('points')
+            for p0 in range(0, n_points, block_size):
+                sl = [slice(None)] * var.ndim
+                sl[ax] = slice(p0, p0 + block_size)
+                dst[name][tuple(sl)] = var[tuple(sl)]
+    os.replace(tmp_path, out_path)
+    return out_path
 
-        # temperature should be in degree Celsius for the glacier climate files
-        temp = ds[Tvar].data - 273.15
-        time = ds.time.data
 
-        ref_lon = float(ds['longitude'])
-        ref_lat = float(ds['latitude'])
+def get_flat_points_kdtree(ds):
+    """KD-tree of the points of a flattened dataset
 
-        ref_lon = ref_lon - 360 if ref_lon > 180 else ref_lon
+    The tree is built on the 3D unit-sphere coordinates of the points. It
+    is kept in memory and stored on disk next to the dataset file (or in
+    the working directory), so that other tasks and processes can reuse
+    it. The stored tree is rebuilt if the dataset file changed.
 
-    # precipitation: similar ar temperature
-    with xr.open_dataset(path_prcp) as ds:
-        assert ds.longitude.min() >= 0
+    Parameters
+    ----------
+    ds : xr.Dataset
+        flattened dataset (with a `points` dimension)
 
-        yrs = ds['time.year'].data
-        y0 = yrs[0] if y0 is None else y0
-        y1 = yrs[-1] if y1 is None else y1
-        # Attention here we take the same y0 and y1 as given from the
-        # daily tmp dataset (goes till end of 2018)
-
-        # attention if daily data, need endday!!!
-        ds = ds.sel(time=slice('{}-{:02d}-01'.format(y0, sm),
-                               '{}-{:02d}-{}'.format(y1, em, end_day)))
-        if sm == 1 and y1 == 2019 and climate_type == 'W5E5':
-            days_in_month = ds['time.daysinmonth'].copy()
+    Returns
+    -------
+    scipy.spatial.cKDTree
+    """
+    source = ds.encoding.get('source', None)
+    if source is None or not os.path.exists(source):
+        # no file to attach the tree to (e.g. merged datasets)
+        return cKDTree(_lonlat_to_xyz(ds.longitude.values,
+                                      ds.latitude.values))
+
+    stat = os.stat(source)
+    key = (os.path.abspath(source), stat.st_size, stat.st_mtime,
+           ds.sizes['points'])
+    if key in _FLAT_POINTS_KDTREES:
+        return _FLAT_POINTS_KDTREES[key]
+
+    fpath = _get_kdtree_cache_path(source)
+    tree = None
+    if os.path.exists(fpath):
         try:
-            # ... prcp is also flattened
-            c = (ds.longitude - lon)**2 + (ds.latitude - lat)**2
-            ds = ds.isel(points=c.argmin())
-        except ValueError:
-            # this should not occur
-            ds = ds.sel(longitude=lon, latitude=lat, method='nearest')
-
-        # if we want to use monthly summed up precipitation:
-        if temporal_resol == 'monthly':
-            ds = ds.resample(time='MS').sum()
-        elif temporal_resol == 'daily':
-            pass
-        if climate_type == 'WFDE5_CRU':
-        # the prcp data of wfde5_CRU  has been converted already into
-        # kg m-2 day-1 ~ mm/day or into kg m-2 month-1 ~ mm/month
-            prcp = ds[Pvar].data  # * 1000
-        elif climate_type == 'W5E5':
-            # if daily convert kg m-2 s-1 into kg m-2 day-1
-            # if monthly convert monthly sum of kg m-2 s-1 into kg m-2 month-1
-            prcp = ds[Pvar].data * SEC_IN_DAY
+            with open(fpath, 'rb') as f:
+                d = pickle.load(f)
+            if d['key'][1:] == key[1:]:
+                tree = d['tree']
+        except Exception:
+            # e.g. written by another process at the same time
+            tree = None
+    if tree is None:
+        tree = cKDTree(_lonlat_to_xyz(ds.longitude.values,
+                                      ds.latitude.values))
+        # write to a temporary file first: other processes should never
+        # read a half written tree
+        tmp_fpath = '{}.{}.tmp'.format(fpath, os.getpid())
+        with open(tmp_fpath, 'wb') as f:
+            pickle.dump({'key': key, 'tree': tree}, f,
+                        protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_fpath, fpath)
+    _FLAT_POINTS_KDTREES[key] = tree
+    return tree
+
+
+def nearest_flat_point_index(ds, lon, lat):
+    """index of the nearest point of a flattened dataset (O(log n) lookup
+    with get_flat_points_kdtree)
+
+    lon and lat can be floats or arrays, longitudes can be given in
+    [-180, 180] or in [0, 360]
+    """
+    if 'points' not in ds.dims:
+        raise ValueError('dataset is not flattened (no `points` dimension)')
+    tree = get_flat_points_kdtree(ds)
+    _, idx = tree.query(_lonlat_to_xyz(lon, lat))
+    return idx
+
+
+def _sel_nearest_point(ds, lon, lat):
+    """nearest grid point of a (flattened) dataset"""
+    if 'points' in ds.dims:
+        # choose the nearest gridpoint
+        ds = ds.isel(points=int(nearest_flat_point_index(ds, lon, lat)))
+    else:
+        ds = ds.sel(longitude=lon, latitude=lat, method='nearest')
+        # normally if I do the flattening, this here should not occur
+    return ds
 
-    # wfde5/w5e5 invariant file
-    with xr.open_dataset(path_inv) as ds:
+
+def _load_nearest_point(path, lon, lat, invariant=False):
+    """loads the time series of the nearest grid point of a climate file
+    (or only the first time step if invariant)"""
+    with xr.open_dataset(path) as ds:
         assert ds.longitude.min() >= 0
-        ds = ds.isel(time=0)
+        if invariant:
+            ds = ds.isel(time=0)
+        return _sel_nearest_point(ds, lon, lat).load()
+
+
+def _nearest_points_index(ds, lons, lats):
+    """nearest grid point of every glacier (found at once), as int for
+    flattened datasets or as (latitude, longitude) indices otherwise"""
+    lons = np.asarray(lons, dtype=np.float64)
+    lats = np.asarray(lats, dtype=np.float64)
+    if 'points' in ds.dims:
+        return [int(i) for i in nearest_flat_point_index(ds, lons, lats)]
+    # e.g. ERA5dr lapse rates (no flattening), same as
+    # ds.sel(longitude=lon, latitude=lat, method='nearest')
+    ilon = ds.indexes['longitude'].get_indexer(lons, method='nearest')
+    ilat = ds.indexes['latitude'].get_indexer(lats, method='nearest')
+    return list(zip(ilat.tolist(), ilon.tolist()))
+
+
+def _read_points(ds, idx):
+    """reads the given grid points (see _nearest_points_index) at once, in
+    sorted order
+
+    Returns
+    -------
+    dict with the grid point index as key and the dataset of this grid
+    point (loaded into memory) as value
+    """
+    points = sorted(set(idx))
+    if 'points' in ds.dims:
+        ds = ds.isel(points=points)
+    else:
+        ilat, ilon = np.array(points).T
+        ds = ds.isel(latitude=xr.DataArray(ilat, dims='points'),
+                     longitude=xr.DataArray(ilon, dims='points'))
+    ds = ds.load()
+    return {i: ds.isel(points=j) for j, i in enumerate(points)}
+
+
+# monthly ERA5dr lapse rates of the grid points that were already read
+# (per process and lapse rate file), see _read_lapserate_points
+_ERA5DR_LAPSERATES = dict()
+
+
+def _get_lapserates_cache_dir(key):
+    """directory of the lapse rate cache files of a lapse rate file (in the
+    working directory, not next to the shared input data), None if there
+    is no working directory"""
+    if not cfg.PATHS.get('working_dir', None):
+        return None
+    name = '{}_{}'.format(os.path.basename(key[0]),
+                          hashlib.sha256(repr(key).encode()).hexdigest()[:16])
+    cache_dir = os.path.join(cfg.PATHS['working_dir'], 'cache_lapserates',
+                             name)
+    utils.mkdir(cache_dir)
+    return cache_dir
+
+
+def _load_lapserates_cache(cache, cache_dir):
+    """adds the grid points of the cache files (also of other processes)
+    that were not yet loaded to cache"""
+    if cache_dir is None:
+        return
+    for fname in sorted(os.listdir(cache_dir)):
+        if not fname.endswith('.pkl') or fname in cache['files']:
+            continue
         try:
-            # Flattened wfde5_inv (only possibility at the moment)
-            c = (ds.longitude - lon)**2 + (ds.latitude - lat)**2
-            ds = ds.isel(points=c.argmin())
-        except ValueError:
-            # this should not occur
-            ds = ds.sel(longitude=lon, latitude=lat, method='nearest')
+            with open(os.path.join(cache_dir, fname), 'rb') as f:
+                points = pickle.load(f)
+        except Exception:
+            # try again next time
+            continue
+        for i, point in points.items():
+            cache['points'].setdefault(i, point)
+        cache['files'].add(fname)
+
+
+def _read_lapserate_points(ds, idx):
+    """same as _read_points, but for the (monthly) lapse rate file, with a
+    cache of the grid points
+
+    Every grid point is only read once from the lapse rate file: the
+    monthly lapse rates are kept in memory and on disk (in the working
+    directory) and reused for all glaciers, temporal resolutions and
+    climate datasets (see also precompute_era5dr_lapserates). Every call
+    that reads new grid points writes only these points into a new cache
+    file (atomically renamed), so that processes never overwrite each
+    other and the existing cache files are not written again.
+    """
+    source = ds.encoding.get('source', None)
+    if source is None or not os.path.exists(source):
+        # no file to attach the cache to
+        return _read_points(ds, idx)
+
+    stat = os.stat(source)
+    key = (os.path.abspath(source), stat.st_size, stat.st_mtime)
+    cache_dir = _get_lapserates_cache_dir(key)
+    if key not in _ERA5DR_LAPSERATES:
+        _ERA5DR_LAPSERATES[key] = {'points': dict(), 'files': set()}
+    cache = _ERA5DR_LAPSERATES[key]
+
+    missing = sorted(set(i for i in idx if i not in cache['points']))
+    if len(missing) > 0:
+        # maybe another process (or a run before) has them already
+        _load_lapserates_cache(cache, cache_dir)
+        missing = [i for i in missing if i not in cache['points']]
+    if len(missing) > 0:
+        new = {}
+        for i, ds_i in _read_points(ds, missing).items():
+            new[i] = (ds_i['lapserate'].values,
+                      float(ds_i['longitude']), float(ds_i['latitude']))
+        cache['points'].update(new)
+        if cache_dir is not None:
+            # write to a temporary file first: other processes should
+            # never read a half written file
+            fname = '{}_{}.pkl'.format(os.getpid(), uuid.uuid4().hex)
+            fpath = os.path.join(cache_dir, fname)
+            with open(fpath + '.tmp', 'wb') as f:
+                pickle.dump(new, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(fpath + '.tmp', fpath)
+            cache['files'].add(fname)
+
+    time = ds.time.values
+    points = {}
+    for i in set(idx):
+        lapserate, lon, lat = cache['points'][i]
+        points[i] = xr.Dataset({'lapserate': ('time', lapserate)},
+                               coords={'time': time, 'longitude': lon,
+                                       'latitude': lat})
+    return points
+
+
+def _load_lapserates_of_point(path, lon, lat):
+    """monthly lapse rates of the nearest grid point of the lapse rate
+    file (see _read_lapserate_points)"""
+    with xr.open_dataset(path) as ds:
+        assert ds.longitude.min() >= 0
+        i = _nearest_points_index(ds, [lon], [lat])[0]
+        return _read_lapserate_points(ds, [i])[i]
+
 
-        # wfde5 inv ASurf/hgt is already in hgt coordinates
-        # G = cfg.G  # 9.80665
-        hgt = ds['ASurf'].data  # / G
+def _map_concurrent(func, args, concurrent_reads=False, max_workers=None):
+    """[func(*a) for a in args], but on a small thread pool (one thread per
+    item, at most max_workers) if concurrent_reads is True.
+
+    Only used for the (I/O bound) downloads of prefetch_climate_files.
+    Not for netCDF files: netCDF-C/HDF5 is not thread-safe (xarray only
+    locks the array reads, not the opening of the files).
+    """
+    args = list(args)
+    if not concurrent_reads or len(args) < 2:
+        return [func(*a) for a in args]
+    n = len(args) if max_workers is None else min(len(args), max_workers)
+    with ThreadPoolExecutor(max_workers=n) as executor:
+        # the results are joined here, in the order of args
+        return list(executor.map(lambda a: func(*a), args))
+
+
+@contextmanager
+def _open_w5e5_datasets(dataset, cluster=False):
+    """opens the tmp, prcp, inv files of the WFDE5_CRU/W5E5 dataset and the
+    ERA5dr lapse rates (there are no lapse rates from wfde5/W5E5), the
+    files are closed at the end"""
+    path_tmp, path_prcp, path_inv = _get_w5e5_paths(dataset, cluster=cluster)
+    path_lapserates = get_ecmwf_file('ERA5dr', 'lapserates')
+    paths = [path_tmp, path_prcp, path_inv, path_lapserates]
+    with ExitStack() as stack:
+        # one after the other, every file is closed even if a later one
+        # can not be opened
+        dss = [stack.enter_context(xr.open_dataset(p)) for p in paths]
+        for ds in dss:
+            assert ds.longitude.min() >= 0
+        ds_tmp, ds_prcp, ds_inv, ds_lr = dss
+        # wfde5/w5e5 invariant file
+        yield ds_tmp, ds_prcp, ds_inv.isel(time=0), ds_lr
+
+
+def _get_month_starts(time):
+    """indices of the first day of every month of a daily time array
+    (to be used with np.add.reduceat)"""
+    months = np.asarray(time).astype('datetime64[M]')
+    return np.flatnonzero(np.concatenate(([True],
+                                          months[1:] != months[:-1])))
+
+
+def _get_w5e5_climate_of_point(hemisphere, ds_tmp, ds_prcp, ds_inv, ds_lr,
+                               y0=None, y1=None, temporal_resol='daily',
+                               climate_type='WFDE5_CRU'):
+    """Climate time series from the WFDE5_CRU/W5E5 and ERA5dr lapse rate
+    time series of one grid point.
+
+    The datasets have to be already reduced to the grid point (see
+    process_w5e5_data for the other parameters). The climate only depends on
+    the grid points and on the hemisphere, so it can be used for all
+    glaciers with the same grid points.
+
+    The daily time series are only read once, the monthly ones are derived
+    from them (mean and std of the temperature, sum of the precipitation
+    over the days of each month), so that asking for both temporal
+    resolutions at once costs hardly more than asking for one.
+
+    Returns
+    -------
+    dict with the kwargs for write_climate_file of every temporal_resol
+    """
+    temporal_resols = _get_temporal_resols(temporal_resol)
+    dataset, _ = _get_w5e5_dataset(climate_type, temporal_resols[0])
+
+    # first temperature dataset
+    ds = ds_tmp
+    # set temporal subset for the ts data (hydro years)
+    if hemisphere == 'nh':
+        sm = cfg.PARAMS['hydro_month_nh']
+    elif hemisphere == 'sh':
+        sm = cfg.PARAMS['hydro_month_sh']
+
+    em = sm - 1 if (sm > 1) else 12
+
+    yrs = ds['time.year'].data
+    y0 = yrs[0] if y0 is None else y0
+    y1 = yrs[-1] if y1 is None else y1
+    if climate_type == 'WFDE5_CRU':
+        # old version of WFDE5_CRU that only goes till 2018
+        if y1 > 2018 or y0 < 1979:
+            text = 'The climate files only go from 1979--2018,\
+                choose another y0 and y1'
+            raise InvalidParamsError(text)
+    elif climate_type == 'W5E5':
+        if y1 > 2019 or y0 < 1979:
+            text = 'The climate files only go from 1979 --2019, something is wrong'
+    # if default settings: this is the last day in March or September
+    time_f = '{}-{:02d}'.format(y1, em)
+    end_day = int(ds.sel(time=time_f).time.dt.daysinmonth[-1].values)
+
+    #  this was tested also for hydro_month = 1
+    ds = ds.sel(time=slice('{}-{:02d}-01'.format(y0, sm),
+                           '{}-{:02d}-{}'.format(y1, em, end_day)))
+
+    Tvar = 'Tair'
+    Pvar = 'tp'
+    if climate_type == 'W5E5':
+        Tvar = 'tas'
+        Pvar = 'pr'
+
+    # temperature should be in degree Celsius for the glacier climate files
+    temp = ds[Tvar].data - 273.15
+    time = ds.time.data
+    # the months are given by the daily time steps, the monthly values
+    # are computed over these days with np.*.reduceat
+    month_starts = _get_month_starts(time)
+    days_in_month = np.diff(np.append(month_starts, len(time)))
+
+    ref_lon = float(ds['longitude'])
+    ref_lat = float(ds['latitude'])
+
+    ref_lon = ref_lon - 360 if ref_lon > 180 else ref_lon
+
+    # precipitation: similar ar temperature
+    # Attention here we take the same y0 and y1 as given from the
+    # daily tmp dataset (goes till end of 2018)
+    # attention if daily data, need endday!!!
+    ds = ds_prcp.sel(time=slice('{}-{:02d}-01'.format(y0, sm),
+                                '{}-{:02d}-{}'.format(y1, em, end_day)))
+    assert len(ds.time) == len(time)
+    if climate_type == 'WFDE5_CRU':
+    # the prcp data of wfde5_CRU  has been converted already into
+    # kg m-2 day-1 ~ mm/day
+        prcp = ds[Pvar].data  # * 1000
+    elif climate_type == 'W5E5':
+        # convert kg m-2 s-1 into kg m-2 day-1
+        prcp = ds[Pvar].data * SEC_IN_DAY
+
+    # wfde5/w5e5 invariant file
+    # wfde5 inv ASurf/hgt is already in hgt coordinates
+    # G = cfg.G  # 9.80665
+    hgt = ds_inv['ASurf'].data  # / G
 
     # here we need to use the ERA5dr data ...
     # there are no lapse rates from wfde5/W5E5 !!!
     # TODO: use updated ERA5dr files that go until end of 2019
-    path_lapserates = get_ecmwf_file(dataset_othervars, 'lapserates')
-    with xr.open_dataset(path_lapserates) as ds:
-        assert ds.longitude.min() >= 0
+    ds = ds_lr.sel(time=slice('{}-{:02d}-01'.format(y0, sm),
+                              '{}-{:02d}-01'.format(y1, em)))
+    if sm == 1 and y1 == 2019 and climate_type == 'W5E5':
+        # missing some months of ERA5dr (which only goes till middle of 2019)
+        # otherwise it will fill it with large numbers ...
+        ds = ds.sel(time=slice('{}-{:02d}-01'.format(y0, sm), '2018'))
+        # the 2019 lapse rates are the climatology of the full ERA5dr
+        # record until 2018 (independent of y0, so that an appended
+        # climate file is the same as a full extraction)
+        ds_clim = ds_lr.sel(time=slice(None, '2018'))
+        # mean lapse rate of every month (as groupby('time.month').mean())
+        months = ds_clim['time.month'].values - 1
+        mean_grad = (np.bincount(months, weights=ds_clim['lapserate'].values,
+                                 minlength=12) /
+                     np.bincount(months, minlength=12))
+        gradient = np.concatenate((ds['lapserate'].data, mean_grad), axis=None)
+    else:
+        # get the monthly gradient values
+        gradient = ds['lapserate'].data
+    assert len(gradient) == len(month_starts)
+
+    kwargs = dict(ref_pix_hgt=hgt, ref_pix_lon=ref_lon, ref_pix_lat=ref_lat,
+                  source=dataset)
+    climates = {}
+    if 'daily' in temporal_resols:
+        # gradient needs to be restructured to have values for each day
+        # when wfde5_daily is applied
+        # assume same gradient for each day
+        climates['daily'] = dict(time=time, prcp=prcp, temp=temp,
+                                 gradient=np.repeat(gradient, days_in_month),
+                                 temp_std=None, **kwargs)
+    if 'monthly' in temporal_resols:
+        # monthly mean temperatures and
+        # standard deviation of daily temperature (ddof=0 as in xarray)
+        temp_d = temp.astype(np.float64)
+        temp_m = np.add.reduceat(temp_d, month_starts) / days_in_month
+        temp_anom = temp_d - np.repeat(temp_m, days_in_month)
+        temp_std = np.sqrt(np.add.reduceat(temp_anom ** 2, month_starts) /
+                           days_in_month)
+        # monthly summed up precipitation: kg m-2 month-1 ~ mm/month
+        prcp_m = np.add.reduceat(prcp.astype(np.float64), month_starts)
+        # time stamp at the start of each month (as resample(time='MS'))
+        time_m = time[month_starts].astype('datetime64[M]')
+        climates['monthly'] = dict(time=time_m.astype('datetime64[ns]'),
+                                   prcp=prcp_m, temp=temp_m,
+                                   gradient=gradient, temp_std=temp_std,
+                                   **kwargs)
 
-        yrs = ds['time.year'].data
-        y0 = yrs[0] if y0 is None else y0
-        y1 = yrs[-1] if y1 is None else y1
-        # Attention here we take the same y0 and y1 as given from the
-        # daily tmp dataset (goes till end of 2018)
+    # OK, ready to write
+    return climates
 
-        ds = ds.sel(time=slice('{}-{:02d}-01'.format(y0, sm),
-                               '{}-{:02d}-01'.format(y1, em)))
 
-        # no flattening done for the ERA5dr gradient dataset
-        ds = ds.sel(longitude=lon, latitude=lat, method='nearest')
-        if sm == 1 and y1 == 2019 and climate_type == 'W5E5':
-            # missing some months of ERA5dr (which only goes till middle of 2019)
-            # otherwise it will fill it with large numbers ...
-            ds = ds.sel(time=slice('{}-{:02d}-01'.format(y0, sm), '2018'))
-            mean_grad = ds.groupby('time.month').mean().lapserate
-            gradient = np.concatenate((ds['lapserate'].data, mean_grad.values), axis=None)
-        else:
-            # get the monthly gradient values
-            gradient = ds['lapserate'].data
-        if temporal_resol == 'monthly':
-            pass
-        elif temporal_resol == 'daily':
-            # gradient needs to be restructured to have values for each day
-            # when wfde5_daily is applied
-            # assume same gradient for each day
-            if sm == 1 and y1 == 2019 and climate_type == 'W5E5':
-                gradient = np.repeat(gradient, days_in_month.resample(time='MS').mean())
-                assert len(gradient) == len(days_in_month)
-            else:
-                gradient = np.repeat(gradient, ds['time.daysinmonth'])
+# climate series of the last processed grid points (per process), glaciers
+# sharing the same grid points reuse them, see _process_w5e5_gdirs
+_W5E5_CLIMATE_MEMO = OrderedDict()
+_W5E5_CLIMATE_MEMO_SIZE = 32
+# amount of processed glaciers and of read climate series (per process)
+_W5E5_CLIMATE_COUNTS = {'glaciers': 0, 'series': 0}
 
 
-    # OK, ready to write
-    write_climate_file(gdir, time, prcp, temp, hgt, ref_lon, ref_lat,
-                       filesuffix=output_filesuffix,
-                       temporal_resol=temporal_resol,
-                       gradient=gradient,
-                       temp_std=temp_std,
-                       source=dataset,
-                       file_name='climate_historical')
+def _w5e5_source_key(ds):
+    """file identity of a dataset for the memo (path, size and mtime), so
+    that replaced files are not taken from the memo"""
+    source = ds.encoding.get('source', None)
+    if source is None or not os.path.exists(source):
+        return source
+    stat = os.stat(source)
+    return os.path.abspath(source), stat.st_size, stat.st_mtime
+
+
+def _process_w5e5_gdirs(gdirs, ds_tmp, ds_prcp, ds_inv, ds_lr, y0=None,
+                        y1=None, temporal_resol='daily',
+                        climate_type='WFDE5_CRU', output_filesuffix=None,
+                        continue_on_error=False, append=False):
+    """Writes the climate files of several glaciers.
+
+    Glaciers are grouped by their nearest grid points (and hemisphere):
+    the climate series of each group is only read, converted and resampled
+    once and then written for every glacier of the group. Series of
+    previous calls (e.g. the glaciers before in process_w5e5_data) are also
+    reused. With append, only the climate after the end of the existing
+    climate files is extracted and appended to them.
+
+    Returns
+    -------
+    set of the unique climate series (keys) of these glaciers
+    """
+    temporal_resols = _get_temporal_resols(temporal_resol)
+    _, output_filesuffixes = _get_w5e5_filesuffixes(climate_type,
+                                                    temporal_resols,
+                                                    output_filesuffix)
+    dss = [ds_tmp, ds_prcp, ds_inv, ds_lr]
+    # get the central longitude/latitudes of the glaciers
+    lons = [gd.cenlon + 360 if gd.cenlon < 0 else gd.cenlon for gd in gdirs]
+    lats = [gd.cenlat for gd in gdirs]
+    idx = [_nearest_points_index(ds, lons, lats) for ds in dss]
+    # start year of each glacier (differs if the climate is appended)
+    y0s = [y0] * len(gdirs)
+    skip = set()
+    appended = set()
+    if append:
+        y1_data = y1 if y1 is not None else int(ds_tmp['time.year'][-1])
+        for k, gdir in enumerate(gdirs):
+            try:
+                y0s_k = {_get_append_y0(gdir, filesuffix=fs)
+                         for fs in output_filesuffixes.values()}
+                if len(y0s_k) > 1:
+                    raise InvalidWorkflowError('the climate files of the '
+                                               'temporal resolutions end at '
+                                               'different times, append '
+                                               'them separately')
+                y0_k = y0s_k.pop()
+            except Exception as err:
+                if not continue_on_error:
+                    raise
+                log.warning('{}: appending the W5E5/WFDE5_CRU climate '
+                            'failed: {}'.format(gdir.rgi_id, err))
+                skip.add(k)
+                continue
+            if y0_k is None:
+                # no climate file yet: write the whole period
+                continue
+            sm = cfg.PARAMS['hydro_month_{}'.format(gdir.hemisphere)]
+            if y0_k + (1 if sm > 1 else 0) > y1_data:
+                log.info('{}: the climate file is already up to '
+                         'date'.format(gdir.rgi_id))
+                skip.add(k)
+            y0s[k] = y0_k
+            appended.add(k)
+
+    settings = (tuple(_w5e5_source_key(ds) for ds in dss),
+                y1, temporal_resols, climate_type)
+    keys = [(settings, y0s[k], gd.hemisphere,
+             cfg.PARAMS['hydro_month_{}'.format(gd.hemisphere)]) +
+            tuple(i[k] for i in idx) for k, gd in enumerate(gdirs)]
+
+    # only read the grid points of the series that we do not have yet
+    climates = {key: _W5E5_CLIMATE_MEMO[key] for key in set(keys)
+                if key in _W5E5_CLIMATE_MEMO}
+    missing = [k for k, key in enumerate(keys)
+               if key not in climates and k not in skip]
+    if len(missing) > 0:
+        # the lapse rates are cached per grid point
+        readers = [_read_points] * 3 + [_read_lapserate_points]
+        points = [read(ds, [i[k] for k in missing])
+                  for read, ds, i in zip(readers, dss, idx)]
+
+    for k, (gdir, key) in enumerate(zip(gdirs, keys)):
+        if k in skip:
+            continue
+        try:
+            if key not in climates:
+                climates[key] = _get_w5e5_climate_of_point(
+                    gdir.hemisphere, *[p[i[k]] for p, i in zip(points, idx)],
+                    y0=y0s[k], y1=y1, temporal_resol=temporal_resols,
+                    climate_type=climate_type)
+            for resol in temporal_resols:
+                write_func = write_climate_file
+                if k in appended:
+                    write_func = append_climate_file
+                write_func(gdir, filesuffix=output_filesuffixes[resol],
+                           temporal_resol=resol,
+                           file_name='climate_historical',
+                           **climates[key][resol])
+        except Exception as err:
+            if not continue_on_error:
+                raise
+            log.warning('{}: writing the W5E5/WFDE5_CRU climate file '
+                        'failed: {}'.format(gdir.rgi_id, err))
+
+    _W5E5_CLIMATE_COUNTS['glaciers'] += len(gdirs) - len(skip)
+    _W5E5_CLIMATE_COUNTS['series'] += len(set(keys[k] for k in missing))
+    for key, climate in climates.items():
+        _W5E5_CLIMATE_MEMO[key] = climate
+        _W5E5_CLIMATE_MEMO.move_to_end(key)
+    while len(_W5E5_CLIMATE_MEMO) > _W5E5_CLIMATE_MEMO_SIZE:
+        _W5E5_CLIMATE_MEMO.popitem(last=False)
+    return set(key for k, key in enumerate(keys) if k not in skip)
+
+
+@entity_task(log, writes=['climate_historical_daily'])
+def process_w5e5_data(gdir, y0=None, y1=None, temporal_resol='daily',
+                       climate_type='WFDE5_CRU',
+                       output_filesuffix=None,
+                       cluster=False, append=False):
+    """
+    Processes and writes the WFDE5_CRU & W5E5 daily baseline climate data for a glacier.
+    Either on daily or on monthly basis
+
+    Extracts the nearest timeseries and writes everything to a NetCDF file.
+    This uses only the WFDE5_CRU / W5E5 daily temperatures. The temperature lapse
+    rate are used from ERA5dr.
+
+    TODO: see _verified_download_helper no known hash for
+    wfde5_daily_t2m_1979-2018_flat.nc and wfde5_glacier_invariant_flat
+    ----------
+    y0 : int
+        the starting year of the timeseries to write. The default is to take
+        the entire time period available in the file, but with this kwarg
+        you can shorten it (to save space or to crop bad data)
+    y1 : int
+        the starting year of the timeseries to write. The default is to take
+        the entire time period available in the file, but with this kwarg
+        you can shorten it (to save space or to crop bad data)
+    temporal_resol : str or list
+        uses either daily (default) or monthly data. With
+        ['daily', 'monthly'] both climate files are written at once: the
+        daily data is only read once and the monthly mean, std and sum are
+        derived from it (cheaper than calling this task twice)
+    climate_type: str
+        either WFDE5_CRU (defualt, v1.1 only till end of 2018) or W5E5
+    output_filesuffix : optional
+         None by default, as the output_filesuffix is automatically chosen
+         from the temporal_resol and climate_type. But you can change the filesuffix here,
+         just make sure that you use then later the right climate file.
+         If both temporal resolutions are written, it has to be a dict
+         with the filesuffix of each one (e.g. {'daily': '_daily_test',
+         'monthly': '_monthly_test'}), the missing ones get the default
+    cluster : bool
+        default is False, if this is run on the cluster, set it to True,
+        because we do not need to download the files
+    append : bool
+        default is False. If True and the climate file already exists,
+        only the hydrological years after its end (up to y1) are
+        extracted and appended to it (hydro_yr_1 is updated), y0 is then
+        ignored. Useful when the climate dataset was extended by a year.
+        If the climate file does not exist, it is written as usual
+
+    """
+
+    dataset, output_filesuffix = _get_w5e5_filesuffixes(climate_type,
+                                                        temporal_resol,
+                                                        output_filesuffix)
+    # wfde5_daily for temperature and precipitation
+    # but need temperature lapse rates from ERA5dr
+
+    # Use xarray to read the data (only the nearest grid point is read,
+    # and not at all if a glacier before had the same grid points)
+    with _open_w5e5_datasets(dataset, cluster=cluster) as dss:
+        _process_w5e5_gdirs([gdir], *dss,
+                            y0=y0, y1=y1, temporal_resol=temporal_resol,
+                            climate_type=climate_type,
+                            output_filesuffix=output_filesuffix,
+                            append=append)
+    n_gdirs = _W5E5_CLIMATE_COUNTS['glaciers']
+    n_series = _W5E5_CLIMATE_COUNTS['series']
+    log.info('{}: process_w5e5_data: {} glaciers share {} read climate '
+             'series in this process (dedup ratio: {:.2f})'
+             .format(gdir.rgi_id, n_gdirs, n_series,
+                     n_gdirs / max(n_series, 1)))
     # This is now a new function, maybe it would better to make a general
     # process_daily_data function where ERA5_daily and WFDE5_daily 
     # but is used, so far, only for ERA5_daily as source dataset ..
 
 
+@global_task(log)
+def process_w5e5_data_regional(gdirs, y0=None, y1=None,
+                               temporal_resol='daily',
+                               climate_type='WFDE5_CRU',
+                               output_filesuffix=None,
+                               cluster=False, batch_size=500,
+                               append=False):
+    """Same as process_w5e5_data, but for many glaciers at once.
+
+    process_w5e5_data opens and scans the global files for every glacier.
+    Here, every file is only opened once, the nearest grid points of all
+    glaciers are found in one vectorized step and the needed points are
+    read in sorted order. Glaciers that share the same grid points (and
+    hemisphere) are grouped: their climate series is only computed once.
+    Then, the climate file of every glacier is written as in
+    process_w5e5_data (with the same output). The ratio of glaciers to
+    unique climate series is written to the log.
+
+    Parameters
+    ----------
+    gdirs : list of :py:class:`oggm.GlacierDirectory` objects
+        the glacier directories to process
+    batch_size : int
+        the grid points of batch_size glaciers are read at once
+        (to limit the memory usage), default is 500
+    others :
+        see process_w5e5_data
+
+    Returns
+    -------
+    the amount of unique climate series
+    """
+    dataset, _ = _get_w5e5_filesuffixes(climate_type, temporal_resol,
+                                        output_filesuffix)
+    with _open_w5e5_datasets(dataset, cluster=cluster) as dss:
+        unique_keys = set()
+        for i0 in range(0, len(gdirs), batch_size):
+            unique_keys |= _process_w5e5_gdirs(
+                gdirs[i0:i0+batch_size], *dss,
+                y0=y0, y1=y1, temporal_resol=temporal_resol,
+                climate_type=climate_type,
+                output_filesuffix=output_filesuffix,
+                continue_on_error=cfg.PARAMS['continue_on_error'],
+                append=append)
+    n_unique = len(unique_keys)
+    log.workflow('process_w5e5_data_regional: {} glaciers share {} unique '
+                 'climate series (dedup ratio: {:.2f})'
+                 .format(len(gdirs), n_unique,
+                         len(gdirs) / max(n_unique, 1)))
+    return n_unique
+
+
+@global_task(log)
+def precompute_era5dr_lapserates(gdirs):
+    """Reads the monthly ERA5dr lapse rates of many glaciers at once.
+
+    The lapse rates of the nearest ERA5dr grid points of all glaciers are
+    read in one step and stored in the lapse rate cache (in memory and on
+    disk, see _read_lapserate_points). process_w5e5_data,
+    process_w5e5_data_regional and process_era5_daily_data then do not
+    need to read them from the file anymore (also not in other processes).
+
+    Parameters
+    ----------
+    gdirs : list of :py:class:`oggm.GlacierDirectory` objects
+        the glacier directories of the region
+
+    Returns
+    -------
+    the amount of ERA5dr grid points
+    """
+    lons = [gd.cenlon + 360 if gd.cenlon < 0 else gd.cenlon for gd in gdirs]
+    lats = [gd.cenlat for gd in gdirs]
+    with xr.open_dataset(get_ecmwf_file('ERA5dr', 'lapserates')) as ds:
+        assert ds.longitude.min() >= 0
+        idx = _nearest_points_index(ds, lons, lats)
+        return len(_read_lapserate_points(ds, idx))
+
+
 @entity_task(log, writes=['climate_historical_daily'])
 def process_era5_daily_data(gdir, y0=None, y1=None, output_filesuffix='_daily_ERA5',
-                            cluster=False):
+                            cluster=False, append=False):
     """Processes and writes the era5 daily baseline climate data for a glacier.
     into climate_historical_daily.nc
 
@@ -561,6 +1511,9 @@ def process_era5_daily_data(gdir, y0=None, y1=None, output_filesuffix='_daily_ER
     cluster : bool
         default is False, if this is run on the cluster, set it to True,
         because we do not need to download the files
+    append : bool
+        default is False. If True, only the climate after the end of the
+        existing climate file is appended to it (see process_w5e5_data)
 
     """
 
@@ -573,139 +1526,112 @@ def process_era5_daily_data(gdir, y0=None, y1=None, output_filesuffix='_daily_ER
     lon = gdir.cenlon + 360 if gdir.cenlon < 0 else gdir.cenlon
     lat = gdir.cenlat
 
+    y0_append = None
+    if append:
+        y0_append = _get_append_y0(gdir, filesuffix=output_filesuffix)
+        y0 = y0 if y0_append is None else y0_append
+
     cluster_path = '/home/www/oggm/climate/'
 
     if cluster:
         path = cluster_path + BASENAMES[dataset]['tmp']
+        path_inv = cluster_path + BASENAMES[dataset]['inv']
     else:
         path = get_ecmwf_file(dataset, 'tmp')
+        path_inv = get_ecmwf_file(dataset, 'inv')
+    # use the point-major store if it was created
+    path = get_point_major_store(path)
+    path_inv = get_point_major_store(path_inv)
 
-    # Use xarray to read the data
-    # would go faster with netCDF -.-
-    with xr.open_dataset(path) as ds:
-        assert ds.longitude.min() >= 0
-
-        # set temporal subset for the ts data (hydro years)
-        if gdir.hemisphere == 'nh':
-            sm = cfg.PARAMS['hydro_month_nh']
-        elif gdir.hemisphere == 'sh':
-            sm = cfg.PARAMS['hydro_month_sh']
-
-        em = sm - 1 if (sm > 1) else 12
-
-        yrs = ds['time.year'].data
-        y0 = yrs[0] if y0 is None else y0
-        y1 = yrs[-1] if y1 is None else y1
-
-        if y1 > 2018 or y0 < 1979:
-            text = 'The climate files only go from 1979--2018,\
-                choose another y0 and y1'
-            raise InvalidParamsError(text)
-        # if default settings: this is the last day in March or September
-        time_f = '{}-{:02d}'.format(y1, em)
-        end_day = int(ds.sel(time=time_f).time.dt.daysinmonth[-1].values)
-
-        #  this was tested also for hydro_month = 1
-        ds = ds.sel(time=slice('{}-{:02d}-01'.format(y0, sm),
-                               '{}-{:02d}-{}'.format(y1, em, end_day)))
-
-        try:
-            # computing all the distances and choose the nearest gridpoint
-            c = (ds.longitude - lon)**2 + (ds.latitude - lat)**2
-            ds = ds.isel(points=c.argmin())
-        # I turned this around
-        except ValueError:
-            ds = ds.sel(longitude=lon, latitude=lat, method='nearest')
-            # normally if I do the flattening, this here should not occur
-
-        # temperature should be in degree Celsius for the glacier climate files
-        temp = ds['t2m'].data - 273.15
-        time = ds.time.data
-
-        ref_lon = float(ds['longitude'])
-        ref_lat = float(ds['latitude'])
-
-        ref_lon = ref_lon - 360 if ref_lon > 180 else ref_lon
-
+    # Use xarray to read the data of the nearest grid points
+    ds_tmp = _load_nearest_point(path, lon, lat)
     # pre should be done as in ERA5dr datasets
-    with xr.open_dataset(get_ecmwf_file(dataset_othervars, 'pre')) as ds:
-        assert ds.longitude.min() >= 0
-
-        yrs = ds['time.year'].data
-        y0 = yrs[0] if y0 is None else y0
-        y1 = yrs[-1] if y1 is None else y1
-        # Attention here we take the same y0 and y1 as given from the
-        # daily tmp dataset (goes till end of 2018)
-
-        ds = ds.sel(time=slice('{}-{:02d}-01'.format(y0, sm),
+    ds_pre = _load_nearest_point(get_ecmwf_file(dataset_othervars, 'pre'),
+                                 lon, lat)
+    # Flattened ERA5_invariant (only possibility at the moment)
+    ds_inv = _load_nearest_point(path_inv, lon, lat, invariant=True)
+    # no flattening done for the ERA5dr gradient dataset,
+    # the lapse rates are cached per grid point
+    ds_lr = _load_lapserates_of_point(
+        get_ecmwf_file(dataset_othervars, 'lapserates'), lon, lat)
+
+    # set temporal subset for the ts data (hydro years)
+    if gdir.hemisphere == 'nh':
+        sm = cfg.PARAMS['hydro_month_nh']
+    elif gdir.hemisphere == 'sh':
+        sm = cfg.PARAMS['hydro_month_sh']
+
+    em = sm - 1 if (sm > 1) else 12
+
+    ds = ds_tmp
+    yrs = ds['time.year'].data
+    y0 = yrs[0] if y0 is None else y0
+    y1 = yrs[-1] if y1 is None else y1
+
+    if y0_append is not None and y0_append + (1 if sm > 1 else 0) > y1:
+        log.info('{}: the climate file is already up to '
+                 'date'.format(gdir.rgi_id))
+        return
+
+    if y1 > 2018 or y0 < 1979:
+        text = 'The climate files only go from 1979--2018,\
+            choose another y0 and y1'
+        raise InvalidParamsError(text)
+    # if default settings: this is the last day in March or September
+    time_f = '{}-{:02d}'.format(y1, em)
+    end_day = int(ds.sel(time=time_f).time.dt.daysinmonth[-1].values)
+
+    #  this was tested also for hydro_month = 1
+    ds = ds.sel(time=slice('{}-{:02d}-01'.format(y0, sm),
+                           '{}-{:02d}-{}'.format(y1, em, end_day)))
+
+    # temperature should be in degree Celsius for the glacier climate files
+    temp = ds['t2m'].data - 273.15
+    time = ds.time.data
+
+    ref_lon = float(ds['longitude'])
+    ref_lat = float(ds['latitude'])
+
+    ref_lon = ref_lon - 360 if ref_lon > 180 else ref_lon
+
+    # Attention here we take the same y0 and y1 as given from the
+    # daily tmp dataset (goes till end of 2018)
+    ds = ds_pre.sel(time=slice('{}-{:02d}-01'.format(y0, sm),
                                '{}-{:02d}-01'.format(y1, em)))
-        try:
-            # prcp is not flattened, so this here should work normally
-            ds = ds.sel(longitude=lon, latitude=lat, method='nearest')
-        except ValueError:
-            # if Flattened ERA5_precipitation?
-            c = (ds.longitude - lon)**2 + (ds.latitude - lat)**2
-            ds = ds.isel(points=c.argmin())
-
-        # the prcp dataset needs to be restructured to have values for each day
-        prcp = ds['tp'].data * 1000
-        # just assume that precipitation is every day the same:
-        prcp = np.repeat(prcp, ds['time.daysinmonth'])
-        # Attention the unit is now prcp per day
-        # (not per month as in OGGM default:
-        # prcp = ds['tp'].data * 1000 * ds['time.daysinmonth']
 
-    if cluster:
-        path_inv = cluster_path + BASENAMES[dataset]['inv']
-    else:
-        path_inv = get_ecmwf_file(dataset, 'inv')
-    with xr.open_dataset(path_inv) as ds:
-        assert ds.longitude.min() >= 0
-        ds = ds.isel(time=0)
-        try:
-            # Flattened ERA5_invariant (only possibility at the moment)
-            c = (ds.longitude - lon)**2 + (ds.latitude - lat)**2
-            ds = ds.isel(points=c.argmin())
-        except ValueError:
-            # this should not occur
-            ds = ds.sel(longitude=lon, latitude=lat, method='nearest')
+    # the prcp dataset needs to be restructured to have values for each day
+    prcp = ds['tp'].data * 1000
+    # just assume that precipitation is every day the same:
+    prcp = np.repeat(prcp, ds['time.daysinmonth'])
+    # Attention the unit is now prcp per day
+    # (not per month as in OGGM default:
+    # prcp = ds['tp'].data * 1000 * ds['time.daysinmonth']
 
-        G = cfg.G  # 9.80665
-        hgt = ds['z'].data / G
+    G = cfg.G  # 9.80665
+    hgt = ds_inv['z'].data / G
 
-    gradient = None
     temp_std = None
-    path_lapserates = get_ecmwf_file(dataset_othervars, 'lapserates')
-    with xr.open_dataset(path_lapserates) as ds:
-        assert ds.longitude.min() >= 0
-
-        yrs = ds['time.year'].data
-        y0 = yrs[0] if y0 is None else y0
-        y1 = yrs[-1] if y1 is None else y1
-        # Attention here we take the same y0 and y1 as given from the
-        # daily tmp dataset (goes till end of 2018)
-
-        ds = ds.sel(time=slice('{}-{:02d}-01'.format(y0, sm),
-                               '{}-{:02d}-01'.format(y1, em)))
-
-        # no flattening done for the ERA5dr gradient dataset
-        ds = ds.sel(longitude=lon, latitude=lat, method='nearest')
-
-        # get the monthly gradient values
-        gradient = ds['lapserate'].data
-
-        # gradient needs to be restructured to have values for each day
-        gradient = np.repeat(gradient, ds['time.daysinmonth'])
-        # assume same gradient for each day
-
-    # OK, ready to write
-    write_climate_file(gdir, time, prcp, temp, hgt, ref_lon, ref_lat,
-                       filesuffix=output_filesuffix,
-                       temporal_resol='daily',
-                       gradient=gradient,
-                       temp_std=temp_std,
-                       source=dataset,
-                       file_name='climate_historical')
+    ds = ds_lr.sel(time=slice('{}-{:02d}-01'.format(y0, sm),
+                              '{}-{:02d}-01'.format(y1, em)))
+
+    # get the monthly gradient values
+    gradient = ds['lapserate'].data
+
+    # gradient needs to be restructured to have values for each day
+    gradient = np.repeat(gradient, ds['time.daysinmonth'])
+    # assume same gradient for each day
+
+    # OK, ready to write (or to append)
+    write_func = write_climate_file
+    if y0_append is not None:
+        write_func = append_climate_file
+    write_func(gdir, time, prcp, temp, hgt, ref_lon, ref_lat,
+               filesuffix=output_filesuffix,
+               temporal_resol='daily',
+               gradient=gradient,
+               temp_std=temp_std,
+               source=dataset,
+               file_name='climate_historical')
     # This is now a new function, which could also work for other climates
     # but is used, so far, only for ERA5_daily as source dataset ..
 
@@ -844,6 +1770,12 @@ class TIModel_Parent(MassBalanceModel):
 
         self.residual = residual
 
+        # validation warnings that were already issued by this model
+        self._warned = set()
+        # monthly mb (and climate) of whole years, see get_monthly_mb
+        self._monthly_mb_memo = OrderedDict()
+        self._monthly_mb_memo_size = 8
+
         # Parameters (from cfg.PARAMS in OGGM default)
         self.t_solid = t_solid
         self.t_liq = t_liq
@@ -1184,6 +2116,18 @@ class TIModel_Parent(MassBalanceModel):
             self.ref_hgt = ref_hgt
             return
 
+    def _warn_once(self, message):
+        """warnings.warn, but only once per model (and message), as some
+        of the validation warnings would be issued at every call otherwise"""
+        if message not in self._warned:
+            self._warned.add(message)
+            warnings.warn(message)
+
+    def _mb_params_key(self):
+        # everything that changes the mb for given heights
+        return (self.melt_f, self.prcp_fac, self.temp_bias, self.residual,
+                self.ref_hgt)
+
     def _get_climate(self, heights, climate_type, year=None):
         """Climate information at given heights.
         year has to be given as float hydro year from what the month is taken,
@@ -1227,10 +2171,16 @@ class TIModel_Parent(MassBalanceModel):
             else:
                 pok = np.where((self.years == y) & (self.months == m))[0]
                 if len(pok) < 28:
-                    warnings.warn('something goes wrong with amount of entries\
-                                  per month for mb_real_daily')
+                    self._warn_once('something goes wrong with amount of '
+                                    'entries per month for mb_real_daily')
         else:
             pok = np.where((self.years == y) & (self.months == m))[0][0]
+        if self.mb_type == 'mb_real_daily' or climate_type == 'annual':
+            if len(pok) != 12 and self.mb_type != 'mb_real_daily':
+                self._warn_once('something goes wrong with amount of entries'
+                                'per year')
+            return self._get_2d_climate_on_pok(heights, pok)
+
         # Read timeseries
         # (already temperature bias and precipitation factor corrected!)
         itemp = self.temp[pok]
@@ -1241,39 +2191,117 @@ class TIModel_Parent(MassBalanceModel):
         # Compute temp and tempformelt (temperature above melting threshold)
         heights = np.asarray(heights)
         npix = len(heights)
-        if self.mb_type == 'mb_real_daily' or climate_type == 'annual':
-            grad_temp = np.atleast_2d(igrad).repeat(npix, 0)
-            if len(pok) != 12 and self.mb_type != 'mb_real_daily':
-                warnings.warn('something goes wrong with amount of entries'
-                              'per year')
+        temp = np.ones(npix) * itemp + igrad * (heights - self.ref_hgt)
+
+        # temp_for_melt is computed separately depending on mb_type
+        tempformelt = self._get_tempformelt(temp, pok)
+        prcp = np.ones(npix) * iprcp
+        fac = 1 - (temp - self.t_solid) / (self.t_liq - self.t_solid)
+        prcpsol = prcp * clip_array(fac, 0, 1)
+
+        return temp, tempformelt, prcp, prcpsol
+
+    def _get_2d_climate_on_pok(self, heights, pok):
+        """2D climate (heights x time steps) for the given indices of the
+        climate time series.
+
+        Parameters
+        -------
+        heights : np.array or list
+            heights along flowline, or a 2D array (heights x time steps)
+            if the heights change for each time step
+        pok : np.array
+            indices of the climate time series (e.g. all months or days of
+            one or several years)
+
+        Returns
+        -------
+        (temp2d, temp2dformelt, prcp, prcpsol)
+        """
+        # Read timeseries
+        # (already temperature bias and precipitation factor corrected!)
+        itemp = self.temp[pok]
+        iprcp = self.prcp[pok]
+        igrad = self.grad[pok]
+
+        # For each height pixel:
+        # Compute temp and tempformelt (temperature above melting threshold)
+        heights = np.asarray(heights)
+        npix = len(heights)
+        grad_temp = np.atleast_2d(igrad).repeat(npix, 0)
+        if heights.ndim == 2:
+            grad_temp *= (heights - self.ref_hgt)
+        else:
             grad_temp *= (heights.repeat(len(pok)).reshape(grad_temp.shape) -
                           self.ref_hgt)
-            temp2d = np.atleast_2d(itemp).repeat(npix, 0) + grad_temp
+        temp2d = np.atleast_2d(itemp).repeat(npix, 0) + grad_temp
 
-            # temp_for_melt is computed separately depending on mb_type
-            temp2dformelt = self._get_tempformelt(temp2d, pok)
+        # temp_for_melt is computed separately depending on mb_type
+        temp2dformelt = self._get_tempformelt(temp2d, pok)
 
-            # Compute solid precipitation from total precipitation
-            prcp = np.atleast_2d(iprcp).repeat(npix, 0)
-            fac = 1 - (temp2d - self.t_solid) / (self.t_liq - self.t_solid)
-            prcpsol = prcp * clip_array(fac, 0, 1)
-            return temp2d, temp2dformelt, prcp, prcpsol
+        # Compute solid precipitation from total precipitation
+        prcp = np.atleast_2d(iprcp).repeat(npix, 0)
+        fac = 1 - (temp2d - self.t_solid) / (self.t_liq - self.t_solid)
+        prcpsol = prcp * clip_array(fac, 0, 1)
+        return temp2d, temp2dformelt, prcp, prcpsol
 
-        else:
-            temp = np.ones(npix) * itemp + igrad * (heights - self.ref_hgt)
+    def _get_multi_year_pok(self, years):
+        """Indices of the climate time series for several (hydro) years
 
-            # temp_for_melt is computed separately depending on mb_type
-            tempformelt = self._get_tempformelt(temp, pok)
-            prcp = np.ones(npix) * iprcp
-            fac = 1 - (temp - self.t_solid) / (self.t_liq - self.t_solid)
-            prcpsol = prcp * clip_array(fac, 0, 1)
+        Returns the concatenated indices of all months (or days if
+        mb_real_daily) of the given years and the position where each year
+        starts inside of these indices (useful for np.add.reduceat).
+        """
+        years = np.atleast_1d(years).astype(int)
+        yrs = years
+        if self.repeat:
+            yrs = self.ys + (yrs - self.ys) % (self.ye - self.ys + 1)
+        if np.any(yrs < self.ys) or np.any(yrs > self.ye):
+            raise ValueError('years {}--{} out of the valid time bounds: '
+                             '[{}, {}]'.format(years[0], years[-1],
+                                               self.ys, self.ye))
+        # self.years is sorted, so each year is a contiguous block
+        i0 = np.searchsorted(self.years, yrs, side='left')
+        i1 = np.searchsorted(self.years, yrs, side='right')
+        if np.any(i1 - i0 < 1):
+            raise ValueError('Year {} not in record'.format(
+                int(years[np.argmin(i1 - i0)])))
+        if self.mb_type != 'mb_real_daily' and np.any(i1 - i0 != 12):
+            self._warn_once('something goes wrong with amount of entries'
+                            'per year')
+        pok = np.concatenate([np.arange(a, b) for a, b in zip(i0, i1)])
+        starts = np.concatenate([[0], np.cumsum(i1 - i0)[:-1]])
+        return pok, starts
+
+    def _get_multi_year_annual_climate(self, heights, years,
+                                       height_per_year=False):
+        """Annual sums of tempformelt and solid prcp for several years
+
+        Instead of calling _get_2d_annual_climate for every year, the
+        climate of all years is computed at once.
+
+        If height_per_year is True, heights has to have the same length as
+        years, and the climate of each year is only computed at its
+        own height (the output has then the shape (years, 1)).
 
-            return temp, tempformelt, prcp, prcpsol
+        Returns
+        -------
+        (tempformelt, prcpsol) each as 2D arrays of shape (years, heights)
+        """
+        pok, starts = self._get_multi_year_pok(years)
+        if height_per_year:
+            n_steps = np.diff(np.append(starts, len(pok)))
+            heights = np.atleast_2d(np.repeat(heights, n_steps))
+        _, temp2dformelt, _, prcpsol = self._get_2d_climate_on_pok(heights,
+                                                                  pok)
+        tfm_yr = np.add.reduceat(temp2dformelt, starts, axis=1).T
+        prcpsol_yr = np.add.reduceat(prcpsol, starts, axis=1).T
+        return tfm_yr, prcpsol_yr
 
     def _get_2d_monthly_climate(self, heights, year=None):
         # first get the climate data
-        warnings.warn('Attention: this has not been tested enough to be sure that '
-                'it works')
+        self._warn_once('Attention: this has not been tested enough to be '
+                        'sure that it works')
         if self.mb_type == 'mb_real_daily':
             return self._get_climate(heights, 'monthly', year=year)
         else:
@@ -1282,8 +2310,8 @@ class TIModel_Parent(MassBalanceModel):
 
     def get_monthly_climate(self, heights, year=None):
         # first get the climate data
-        warnings.warn('Attention: this has not been tested enough to be sure that \
-                it works')
+        self._warn_once('Attention: this has not been tested enough to be '
+                        'sure that it works')
         if self.mb_type == 'mb_real_daily':
             t, tfmelt, prcp, prcpsol = self._get_climate(heights, 'monthly',
                                                          year=year)
@@ -1403,6 +2431,17 @@ class TIModel(TIModel_Parent):
         # get_monthly_mb and get_annual_mb are only different
         # to OGGM default for mb_real_daily
 
+        # the 12 months of a year are mostly asked one after the other with
+        # the same heights and add_climate (e.g. in run_with_hydro): then
+        # the whole year is computed at once and the other months are
+        # taken from the memo
+        y, m = floatyear_to_date(year)
+        memo = self._get_monthly_mb_memo(heights, y, compute=add_climate)
+        if memo is not None:
+            # copies, so that the memo can not be changed by the caller
+            out = tuple(np.array(a) for a in memo[m])
+            return out if add_climate else out[0]
+
         if self.mb_type == 'mb_real_daily':
             # get 2D values, dependencies on height and time (days)
             out = self._get_2d_monthly_climate(heights, year)
@@ -1417,9 +2456,9 @@ class TIModel(TIModel_Parent):
 
             mb_month = np.sum(mb_daily, axis=1)
             # more correct than using a mean value for days in a month
-            warnings.warn('there might be a problem with SEC_IN_MONTH'
-                          'as February changes amount of days inbetween the years'
-                          ' see test_monthly_glacier_massbalance()')
+            self._warn_once('there might be a problem with SEC_IN_MONTH'
+                            'as February changes amount of days inbetween the '
+                            'years see test_monthly_glacier_massbalance()')
 
         else:
             # get 1D values for each height, no dependency on days
@@ -1443,6 +2482,107 @@ class TIModel(TIModel_Parent):
         # instead of SEC_IN_MONTH, use instead len(prcpsol.T)==daysinmonth
         return mb_month / self.SEC_IN_MONTH / self.rho
 
+    def _compute_monthly_mb_of_year(self, heights, year):
+        """ mb and climate of all months of a (hydro) year in one call
+
+        Returns
+        -------
+        dict with the (hydro) month as key and the same output as
+        get_monthly_mb(heights, year, add_climate=True) as value
+        """
+        pok, _ = self._get_multi_year_pok(int(year))
+        t, tfm, prcp, prcpsol = self._get_2d_climate_on_pok(heights, pok)
+        months = self.months[pok]
+        m_starts = np.concatenate([[0], np.nonzero(np.diff(months))[0] + 1])
+        m_ends = np.append(m_starts[1:], len(pok))
+        if self.mb_type == 'mb_real_daily':
+            if np.any(m_ends - m_starts < 28):
+                self._warn_once('something goes wrong with amount of '
+                                'entries per month for mb_real_daily')
+            # same as in get_monthly_mb: sum of the daily mb of each month
+            dom = 365.25/12
+            mb = np.add.reduceat(prcpsol - (self.melt_f/dom) * tfm,
+                                 m_starts, axis=1)
+            prcp_m = np.add.reduceat(prcp, m_starts, axis=1)
+            prcpsol_m = np.add.reduceat(prcpsol, m_starts, axis=1)
+            self._warn_once('there might be a problem with SEC_IN_MONTH'
+                            'as February changes amount of days inbetween the '
+                            'years see test_monthly_glacier_massbalance()')
+        else:
+            mb = prcpsol - self.melt_f * tfm
+            prcp_m, prcpsol_m = prcp, prcpsol
+        mb = mb - self.residual * self.SEC_IN_MONTH / self.SEC_IN_YEAR
+        mb = mb / self.SEC_IN_MONTH / self.rho
+
+        out = dict()
+        for i, (i0, i1) in enumerate(zip(m_starts, m_ends)):
+            if self.mb_type == 'mb_real_daily':
+                # daily temp and tempformelt (as in get_monthly_mb)
+                _t, _tfm = t[:, i0:i1], tfm[:, i0:i1]
+            else:
+                _t, _tfm = t[:, i], tfm[:, i]
+            out[months[i0]] = (mb[:, i], _t, _tfm, prcp_m[:, i],
+                               prcpsol_m[:, i])
+        return out
+
+    def _get_monthly_mb_memo(self, heights, year, compute=True):
+        """ monthly mb (and climate) of all months of a year for the given
+        heights, taken from the memo if it was already computed with the
+        same heights and mb parameters (a few years/heights are kept).
+
+        If compute is False and the year is not in the memo, None is
+        returned.
+        """
+        key = (self._mb_params_key(), int(year),
+               np.asarray(heights, dtype=np.float64).tobytes())
+        if key not in self._monthly_mb_memo:
+            if not compute:
+                return None
+            self._monthly_mb_memo[key] = \
+                self._compute_monthly_mb_of_year(heights, year)
+            while len(self._monthly_mb_memo) > self._monthly_mb_memo_size:
+                self._monthly_mb_memo.popitem(last=False)
+        self._monthly_mb_memo.move_to_end(key)
+        return self._monthly_mb_memo[key]
+
+    def get_monthly_mb_of_year(self, heights, year=None, add_climate=False):
+        """ monthly mass balance (in m of ice per second) of all 12 months of
+        a (hydro) year in one call
+
+        gives the same as get_monthly_mb for each month of the year, and
+        following get_monthly_mb calls of this year are taken from the memo
+
+        Parameters
+        ----------
+        heights : np.array
+            heights along flowline
+        year : int
+            hydro year
+        add_climate : bool
+            if True, also returns the monthly temp (mean), tempformelt,
+            prcp and solid prcp (sums) of each month (for mb_real_daily
+            the sums over the days of each month)
+
+        Returns
+        -------
+        mb (or mb, temp, tempformelt, prcp, prcpsol) as 2D arrays
+        with the shape (months, heights)
+        """
+        memo = self._get_monthly_mb_memo(heights, np.floor(year))
+        out = [memo[m] for m in sorted(memo)]
+        mb = np.array([o[0] for o in out])
+        if not add_climate:
+            return mb
+        if self.mb_type == 'mb_real_daily':
+            t = np.array([o[1].mean(axis=1) for o in out])
+            tfm = np.array([o[2].sum(axis=1) for o in out])
+        else:
+            t = np.array([o[1] for o in out])
+            tfm = np.array([o[2] for o in out])
+        prcp = np.array([o[3] for o in out])
+        prcpsol = np.array([o[4] for o in out])
+        return mb, t, tfm, prcp, prcpsol
+
     def get_annual_mb(self, heights, year=None, add_climate=False,
                       **kwargs):
         """ computes annual mass balance in m of ice per second !"""
@@ -1471,6 +2611,90 @@ class TIModel(TIModel_Parent):
                     prcp.sum(axis=1), prcpsol.sum(axis=1))
         return mb_annual
 
+    def _get_annual_mb_from_climate(self, tfm_yr, prcpsol_yr):
+        # same as in get_annual_mb, but from annual sums (kg m-2)
+        if self.mb_type == 'mb_real_daily':
+            fact = 12/365.25
+        else:
+            fact = 1
+        return prcpsol_yr - self.melt_f * tfm_yr * fact - self.residual
+
+    def get_annual_mb_multi_year(self, heights, years=None):
+        """ computes annual mass balance in m of ice per second of several
+        years at once (gives the same as get_annual_mb for each year)
+
+        Returns
+        -------
+        mb : np.array
+            2D array with shape (years, heights)
+        """
+        tfm_yr, prcpsol_yr = self._get_multi_year_annual_climate(heights,
+                                                                 years)
+        mb = self._get_annual_mb_from_climate(tfm_yr, prcpsol_yr)
+        return mb / self.SEC_IN_YEAR / self.rho
+
+    def get_ela_multi_year(self, years=None, n_grid=51, xtol=0.1):
+        """Equilibrium line altitude of several years at once
+
+        Instead of doing a root finding for every year (as in get_ela),
+        the mass balance of all years is first computed on a coarse
+        elevation grid (in one pass) to bracket the ELA of each year. Then,
+        a bisection is done for all years simultaneously, where each
+        iteration needs only one evaluation of all years.
+
+        Parameters
+        ----------
+        years : np.array
+            (hydro) years
+        n_grid : int
+            amount of grid points inside of valid_bounds used to bracket
+            the ELA (default: 51)
+        xtol : float
+            the ELA is found within this tolerance (in m, default 0.1
+            as in get_ela)
+
+        Returns
+        -------
+        ela : np.array
+            ELA for each year in m, NaN if the mass balance does not
+            change sign inside of valid_bounds
+        """
+        years = np.atleast_1d(years).astype(int)
+        z_grid = np.linspace(*self.valid_bounds, n_grid)
+        tfm_yr, prcpsol_yr = self._get_multi_year_annual_climate(z_grid,
+                                                                 years)
+        mb = self._get_annual_mb_from_climate(tfm_yr, prcpsol_yr)
+
+        # bracket: first grid point where the mb is positive
+        pos = mb >= 0
+        i_hi = np.argmax(pos, axis=1)
+        ok = np.any(pos, axis=1) & ~pos[:, 0]
+        i_hi = np.where(ok, i_hi, 1)
+        z_lo = z_grid[i_hi - 1]
+        z_hi = z_grid[i_hi]
+
+        # bisection for all years at the same time
+        n_iter = int(np.ceil(np.log2((z_grid[1] - z_grid[0]) / xtol)))
+        for _ in range(max(n_iter, 0)):
+            z_mid = (z_lo + z_hi) / 2
+            out = self._get_multi_year_annual_climate(z_mid, years,
+                                                      height_per_year=True)
+            mb_mid = self._get_annual_mb_from_climate(*out)[:, 0]
+            z_hi = np.where(mb_mid >= 0, z_mid, z_hi)
+            z_lo = np.where(mb_mid >= 0, z_lo, z_mid)
+
+        ela = (z_lo + z_hi) / 2
+        # the mass balance does not change sign
+        ela[~ok] = np.NaN
+        return ela
+
+    def get_ela(self, year=None, **kwargs):
+        """ELA of one or several years, uses get_ela_multi_year
+        if several years are given"""
+        if len(np.atleast_1d(year)) > 1:
+            return self.get_ela_multi_year(years=year)
+        return super().get_ela(year=year, **kwargs)
+
     def get_daily_mb(self, heights, year=None,
                      add_climate=False):
         """computes daily mass balance in m of ice per second
@@ -1502,8 +2726,8 @@ class TIModel(TIModel_Parent):
 
             # mb_month = np.sum(mb_daily, axis=1)
             # more correct than using a mean value for days in a month
-            warnings.warn('be cautiuous when using get_daily_mb and test yourself if it does '
-                          'what you expect')
+            self._warn_once('be cautiuous when using get_daily_mb and test '
+                            'yourself if it does what you expect')
 
             # residual is in mm w.e per year, so SEC_IN_MONTH .. but mb_daily
             # is per day!
@@ -1535,7 +2759,8 @@ class TIModel(TIModel_Parent):
 
 class TIModel_Sfc_Type(TIModel_Parent):
 
-    def __init__(self, gdir, melt_f, melt_f_ratio_snow_to_ice=0.5, **kwargs):
+    def __init__(self, gdir, melt_f, melt_f_ratio_snow_to_ice=0.5,
+                 spinup_cache_size=64, **kwargs):
 
         '''
         TIModel with surface type distinction
@@ -1548,6 +2773,9 @@ class TIModel_Sfc_Type(TIModel_Parent):
         melt_f_ratio_snow_to_ice
             ratio of snow melt factor to ice melt factor,
             default is 0.5 same as in GloGEM, PyGEM ...
+        spinup_cache_size : int
+            amount of spun-up bucket states that are kept in memory
+            (least recently used ones are removed first), default is 64
         kwargs
         '''
         super().__init__(gdir, melt_f, **kwargs)
@@ -1555,6 +2783,10 @@ class TIModel_Sfc_Type(TIModel_Parent):
         # ratio of snow melt_f to ice melt_f
         self.melt_f_ratio_snow_to_ice = melt_f_ratio_snow_to_ice
 
+        # spun-up bucket states, key is given by _spinup_key
+        self.spinup_cache_size = spinup_cache_size
+        self._spinup_cache = OrderedDict()
+
         self.buckets = ['snow', 'firn_yr_1', 'firn_yr_2', 'firn_yr_3',
                         'firn_yr_4', 'firn_yr_5']
         columns = self.buckets + ['delta_kg/m2']
@@ -1700,6 +2932,12 @@ class TIModel_Sfc_Type(TIModel_Parent):
         unit
         bucket_output: if True, also returns pd.Dataframe with the buckets
         (they are not yet updated for the next year!)
+        spinup: if True and year is 2000, the buckets are spun-up over
+        1995--1999 before (see spinup). The spin-up starts from empty
+        buckets, the current bucket state is discarded. With these 5
+        spin-up years, this gives the same as continuing from the current
+        buckets (as in older versions), because the firn is removed after
+        5 years and the younger buckets melt first
         kwargs
 
         Returns
@@ -1714,9 +2952,8 @@ class TIModel_Sfc_Type(TIModel_Parent):
         # like: snow_delta_kg/m2 ... and so on
         # **kwargs necessary to take stuff we don't use (like fls...)
         if year == 2000 and spinup:
-        #    # do a spin-up
-            for yr in np.arange(1995, 2000):
-                self.get_annual_mb(heights, year=yr, unit=unit, bucket_output=False)
+            # do a spin-up (over 1995--1999, cached for the same parameters)
+            self.spinup(heights, ys=2000, n_years=5)
         self.pd_bucket = self._add_delta_mb_vary_melt_f(heights, year=year)
         mb_annual = self.pd_bucket['delta_kg/m2'].copy().values
         mb_annual = (mb_annual - self.residual) / self.SEC_IN_YEAR / self.rho
@@ -1732,6 +2969,161 @@ class TIModel_Sfc_Type(TIModel_Parent):
         #            prcp.sum(axis=1), prcpsol.sum(axis=1))
         return mb_annual
 
+    def get_annual_mb_multi_year(self, heights, years=None, spinup=False):
+        '''computes the annual mass balance of several consecutive years at once
+
+        Gives the same as calling get_annual_mb for each year one after the
+        other, but the climate of all years is fetched in one go and the
+        bucket recursion is done on numpy arrays instead of pd_bucket.
+        Afterwards, pd_bucket is in the same state as if get_annual_mb
+        had been called for every year.
+
+        Parameters
+        ----------
+        heights : np.array
+            heights along the flowline (same length as pd_bucket)
+        years : np.array
+            consecutive (hydro) years
+        spinup : bool
+            if True and the first year is 2000, the buckets are spun-up
+            over 1995--1999 before (same as in get_annual_mb)
+
+        Returns
+        -------
+        mb : np.array
+            annual mass balance in m of ice per second,
+            2D array with shape (years, heights)
+        '''
+        if len(heights) != len(self.fl.dis_on_line):
+            raise InvalidParamsError('length of the heights should be the same as '
+                                     'distance along flowline of pd_bucket dataframe,'
+                                     'use for heights e.g. ...fl.surface_h()')
+        years = np.atleast_1d(years).astype(int)
+        if np.any(np.diff(years) != 1):
+            raise InvalidParamsError('years have to be consecutive, because '
+                                     'the buckets are updated every year')
+        if years[0] == 2000 and spinup:
+            self.spinup(heights, ys=2000, n_years=5)
+
+        # (years, heights) annual sums of the climate
+        tfm_yr, prcpsol_yr = self._get_multi_year_annual_climate(heights,
+                                                                 years)
+
+        melt_f_buckets = np.linspace(self.melt_f * self.melt_f_ratio_snow_to_ice,
+                                     self.melt_f, 7)
+        # buckets x heights
+        bucket = self.pd_bucket[self.buckets].values.T.astype(np.float64)
+        delta = np.zeros((len(years), len(heights)))
+        for j in range(len(years)):
+            # snow bucket gets the solid prcp of this year
+            bucket[0] = prcpsol_yr[j]
+            remaining_tfm = tfm_yr[j].copy()
+            delta[j] = prcpsol_yr[j]
+            for e in range(len(self.buckets)):
+                tfm_to_melt_b = bucket[e] / melt_f_buckets[e]  # in K
+                not_lost_bucket = clip_min(tfm_to_melt_b - remaining_tfm,
+                                           0) * melt_f_buckets[e]
+                delta[j] += not_lost_bucket - bucket[e]
+                bucket[e] = not_lost_bucket
+                remaining_tfm = clip_min(remaining_tfm - tfm_to_melt_b, 0)
+            # the ice bucket is infinite
+            delta[j] += -remaining_tfm * melt_f_buckets[-1]
+            # same as in _update: buckets get one year older
+            bucket[1:] = bucket[:-1].copy()
+            bucket[0] = 0
+
+        self.pd_bucket[self.buckets] = bucket.T
+        self.pd_bucket['delta_kg/m2'] = np.NaN
+
+        mb = (delta - self.residual) / self.SEC_IN_YEAR / self.rho
+        return mb
+
+    def get_bucket_state(self):
+        '''returns a snapshot (copy) of the current buckets
+
+        can be given back to set_bucket_state to restore it later on
+        '''
+        return self.pd_bucket.copy()
+
+    def set_bucket_state(self, pd_bucket):
+        '''restores the buckets from a snapshot of get_bucket_state'''
+        if not np.all(pd_bucket.index == self.pd_bucket.index):
+            raise InvalidParamsError('the bucket snapshot does not fit to the '
+                                     'flowline of this mass balance model')
+        self.pd_bucket = pd_bucket.copy()
+
+    def _spinup_key(self, heights, ys, n_years):
+        # everything that changes the spun-up buckets
+        return (self.melt_f, self.prcp_fac, self.temp_bias,
+                self.melt_f_ratio_snow_to_ice,
+                np.asarray(heights, dtype=np.float64).tobytes(),
+                int(ys), int(n_years))
+
+    def spinup(self, heights, ys=2000, n_years=5):
+        '''spins up the buckets over the n_years before ys
+
+        The buckets are emptied and then updated over the years
+        ys-n_years to ys-1, i.e. the result does not depend on the bucket
+        state before the call. For n_years >= 5 (the amount of firn
+        buckets), this is the same as continuing from the current buckets
+        (as the spin-up in get_annual_mb did in older versions), for
+        fewer years it is not.
+        The spun-up state is cached for the current
+        melt_f, prcp_fac, temp_bias, heights and ys, so that repeated
+        calls (e.g. during the calibration) do not recompute it.
+
+        Parameters
+        ----------
+        heights : np.array
+            heights along the flowline
+        ys : int
+            year that comes after the spin-up period (default 2000)
+        n_years : int
+            amount of spin-up years (default 5)
+
+        Returns
+        -------
+        pd_bucket : the spun-up buckets (copy)
+        '''
+        key = self._spinup_key(heights, ys, n_years)
+        if key in self._spinup_cache:
+            self._spinup_cache.move_to_end(key)
+            self.set_bucket_state(self._spinup_cache[key])
+            return self.get_bucket_state()
+
+        self.reset_pd_bucket()
+        self.get_annual_mb_multi_year(heights,
+                                      years=np.arange(ys - n_years, ys))
+        self._spinup_cache[key] = self.get_bucket_state()
+        while len(self._spinup_cache) > self.spinup_cache_size:
+            # remove the least recently used state
+            self._spinup_cache.popitem(last=False)
+        return self.get_bucket_state()
+
+    def get_specific_mb(self, heights=None, widths=None, fls=None,
+                        year=None, **kwargs):
+        """ specific mass balance in kg m-2 per year
+
+        if several consecutive years are asked, this uses
+        get_annual_mb_multi_year (one call for all years), otherwise
+        get_annual_mb is called year after year. The kwargs (e.g.
+        spinup=True) are given to these methods.
+        """
+        if fls is not None:
+            # the buckets are only defined on the flowline of the model
+            heights = np.concatenate([fl.surface_h for fl in fls])
+            widths = np.concatenate([fl.widths for fl in fls])
+        years = np.atleast_1d(year)
+        if len(years) > 1 and np.all(np.diff(years) == 1):
+            mbs = self.get_annual_mb_multi_year(
+                heights, years=years, spinup=kwargs.get('spinup', False))
+        else:
+            mbs = np.array([self.get_annual_mb(heights, year=yr, **kwargs)
+                            for yr in years])
+        out = (np.average(mbs, weights=widths, axis=1) *
+               self.SEC_IN_YEAR * self.rho)
+        return out[0] if np.ndim(year) == 0 else out
+
     def get_monthly_mb(self):
         raise NotImplementedError('this has to be implemented ... ')
 
@@ -1807,6 +3199,7 @@ class MultipleFlowlineMassBalance_TIModel(MassBalanceModel):
 
         # Initialise the mb models
         self.flowline_mb_models = []
+        shared_mb_models = dict()
         for fl in self.fls:
             # Merged glaciers will need different climate files, use filesuffix
             if (fl.rgi_id is not None) and (fl.rgi_id != gdir.rgi_id):
@@ -1830,20 +3223,79 @@ class MultipleFlowlineMassBalance_TIModel(MassBalanceModel):
             #    df = gdir.read_json('local_mustar', filesuffix='_' + fl.rgi_id)
             #    kwargs['y0'] = df['t_star']
 
-            if (issubclass(mb_model_class, TIModel_Parent)) \
-                    or (issubclass(mb_model_class, RandomMassBalance_TIModel)):
+            if (issubclass(mb_model_class, TIModel) and
+                    (rgi_filesuffix, fl_bias) in shared_mb_models):
+                # TIModel has no state and gives the mb for any heights:
+                # flowlines with the same climate share one instance, and
+                # can then be computed in one call
+                self.flowline_mb_models.append(
+                    shared_mb_models[(rgi_filesuffix, fl_bias)])
+            elif issubclass(mb_model_class, (TIModel_Parent,
+                                             RandomMassBalance_TIModel,
+                                             ConstantMassBalance_TIModel)):
                 self.flowline_mb_models.append(
                     mb_model_class(gdir, melt_f, prcp_fac = prcp_fac,
                                    residual=fl_bias, baseline_climate=rgi_filesuffix,
                                     **kwargs))
+                if issubclass(mb_model_class, TIModel):
+                    shared_mb_models[(rgi_filesuffix, fl_bias)] = \
+                        self.flowline_mb_models[-1]
             else:
                 self.flowline_mb_models.append(
                     mb_model_class(gdir, mu_star=fl.mu_star, bias=fl_bias,
                                    input_filesuffix=rgi_filesuffix, **kwargs))
 
+        # flowline ids that share the same mb model instance
+        # (in order of the first flowline of each group)
+        self._fl_groups = []
+        for fl_id, mb_mod in enumerate(self.flowline_mb_models):
+            for mod, fl_ids in self._fl_groups:
+                if mod is mb_mod:
+                    fl_ids.append(fl_id)
+                    break
+            else:
+                self._fl_groups.append((mb_mod, [fl_id]))
+        # concatenated geometry, is set by _get_fls_offsets
+        self._fls_nx = None
+
         self.valid_bounds = self.flowline_mb_models[-1].valid_bounds
         self.hemisphere = gdir.hemisphere
 
+    def _get_fls_offsets(self, fls):
+        """Offsets of each flowline in the concatenated flowline arrays.
+
+        Computed only once per geometry (i.e. amount of grid points of
+        each flowline), together with the indices of the concatenated
+        points that belong to each group of flowlines sharing a mb model.
+        """
+        nxs = tuple(fl.nx for fl in fls)
+        if nxs != self._fls_nx:
+            offsets = np.concatenate([[0], np.cumsum(nxs)]).astype(int)
+            self._fls_offsets = offsets
+            self._fls_group_idx = [np.concatenate(
+                [np.arange(offsets[i], offsets[i + 1]) for i in fl_ids])
+                for _, fl_ids in self._fl_groups]
+            self._fls_nx = nxs
+        return self._fls_offsets
+
+    def _get_annual_mb_concat(self, heights, fls=None, year=None,
+                              **kwargs):
+        """Annual mb on the concatenated heights of all flowlines.
+
+        All flowlines that share a mb model are computed in one call.
+        """
+        mbs = np.empty(len(heights))
+        for (mb_mod, fl_ids), idx in zip(self._fl_groups,
+                                         self._fls_group_idx):
+            if len(fl_ids) == 1:
+                mbs[idx] = mb_mod.get_annual_mb(heights[idx], year=year,
+                                                fls=fls, fl_id=fl_ids[0],
+                                                **kwargs)
+            else:
+                mbs[idx] = mb_mod.get_annual_mb(heights[idx], year=year,
+                                                **kwargs)
+        return mbs
+
     @property
     def temp_bias(self):
         """Temperature bias to add to the original series."""
@@ -1915,14 +3367,13 @@ class MultipleFlowlineMassBalance_TIModel(MassBalanceModel):
         if fls is None:
             fls = self.fls
 
-        heights = []
-        widths = []
-        mbs = []
+        offsets = self._get_fls_offsets(fls)
+        heights = np.empty(offsets[-1])
+        widths = np.empty(offsets[-1])
         for i, fl in enumerate(fls):
-            h = fl.surface_h
-            heights = np.append(heights, h)
-            widths = np.append(widths, fl.widths)
-            mbs = np.append(mbs, self.get_annual_mb(h, year=year, fl_id=i))
+            heights[offsets[i]:offsets[i + 1]] = fl.surface_h
+            widths[offsets[i]:offsets[i + 1]] = fl.widths
+        mbs = self._get_annual_mb_concat(heights, year=year)
 
         return heights, widths, mbs
 
@@ -1942,20 +3393,22 @@ class MultipleFlowlineMassBalance_TIModel(MassBalanceModel):
             out = [self.get_specific_mb(fls=fls, year=yr, **kwargs) for yr in year]
             return np.asarray(out)
 
-        mbs = []
-        widths = []
-        for i, (fl, mb_mod) in enumerate(zip(self.fls, self.flowline_mb_models)):
+        offsets = self._get_fls_offsets(self.fls)
+        heights = np.empty(offsets[-1])
+        widths = np.empty(offsets[-1])
+        for i, fl in enumerate(self.fls):
             _widths = fl.widths
             try:
                 # For rect and parabola don't compute spec mb
                 _widths = np.where(fl.thick > 0, _widths, 0)
             except AttributeError:
                 pass
-            widths = np.append(widths, _widths)
-            mb = mb_mod.get_annual_mb(fl.surface_h, year=year, fls=fls,
-                                      fl_id=i, **kwargs)
-            mbs = np.append(mbs, mb * SEC_IN_YEAR * mb_mod.rho)
-        return np.average(mbs, weights=widths)
+            heights[offsets[i]:offsets[i + 1]] = fl.surface_h
+            widths[offsets[i]:offsets[i + 1]] = _widths
+        mbs = self._get_annual_mb_concat(heights, fls=fls, year=year,
+                                         **kwargs)
+        rho = self.flowline_mb_models[0].rho
+        return np.average(mbs * SEC_IN_YEAR * rho, weights=widths)
 
     def get_ela(self, year=None, **kwargs):
 
@@ -1963,15 +3416,24 @@ class MultipleFlowlineMassBalance_TIModel(MassBalanceModel):
         # We compute a mean weighted by area.
 
         if len(np.atleast_1d(year)) > 1:
+            if all(hasattr(mb_mod, 'get_ela_multi_year')
+                   for mb_mod, _ in self._fl_groups):
+                # all years at once for each group of flowlines
+                elas = np.stack([mb_mod.get_ela_multi_year(years=year)
+                                 for mb_mod, _ in self._fl_groups], axis=1)
+                areas = [np.sum([np.sum(self.fls[i].widths) for i in fl_ids])
+                         for _, fl_ids in self._fl_groups]
+                return np.average(elas, weights=areas, axis=1)
             return np.asarray([self.get_ela(year=yr) for yr in year])
 
-        elas = []
-        areas = []
-        for fl_id, (fl, mb_mod) in enumerate(zip(self.fls,
-                                                 self.flowline_mb_models)):
-            elas = np.append(elas, mb_mod.get_ela(year=year, fl_id=fl_id,
-                                                  fls=self.fls))
-            areas = np.append(areas, np.sum(fl.widths))
+        # flowlines that share a mb model have the same ELA,
+        # so it is computed only once for each group
+        elas = np.empty(len(self._fl_groups))
+        areas = np.empty(len(self._fl_groups))
+        for j, (mb_mod, fl_ids) in enumerate(self._fl_groups):
+            elas[j] = mb_mod.get_ela(year=year, fl_id=fl_ids[0],
+                                     fls=self.fls)
+            areas[j] = np.sum([np.sum(self.fls[i].widths) for i in fl_ids])
 
         return np.average(elas, weights=areas)
 
@@ -2044,7 +3506,6 @@ def fixed_geometry_mass_balance_TIModel(gdir, ys=None, ye=None, years=None,
     return odf
 
 
-from oggm.utils._workflow import global_task
 @global_task(log)
 def compile_fixed_geometry_mass_balance_TIModel(gdirs, filesuffix='',
                                         path=True, csv=False,
@@ -2294,6 +3755,221 @@ def extend_past_climate_run_TIModel(past_run_file=None,
 
 
 
+class ConstantMassBalance_TIModel(MassBalanceModel):
+    """Constant mass-balance during a chosen period (for TIModel).
+
+    (similar to ConstantMassBalance of OGGM, adapted for TIModel)
+
+    The mb of the climate period is averaged once on an elevation grid
+    (`hbins`), and the mb of any heights is then linearly interpolated from
+    this mb profile. As the mb profile is the same every year, equilibrium
+    runs over 1000+ years do not need to evaluate the climate period
+    again for each step. The profile is only recomputed if the mb parameters
+    change (e.g. if temp_bias is set).
+    """
+
+    def __init__(self, gdir, melt_f=None, residual=0,
+                 y0=None, halfsize=15,
+                 mb_model_sub_class=TIModel, baseline_climate=None,
+                 filename='climate_historical', input_filesuffix='default',
+                 hbins_step=10,
+                 **kwargs):
+        """Initialize.
+
+        Parameters
+        ----------
+        gdir : GlacierDirectory
+            the glacier directory
+        melt_f : float
+            melt factor of the TIModel
+        residual : float, optional
+            residual of the TIModel [mm we yr-1], best is to leave it at 0
+        y0 : int, optional, default: tstar
+            the year at the center of the period of interest. The default
+            is to use tstar as center.
+        halfsize : int, optional
+            the half-size of the time window (window size = 2 * halfsize + 1)
+        mb_model_sub_class : class
+            the mb model that is averaged, default is TIModel. Has to be
+            TIModel or a subclass of it (TIModel_Sfc_Type does not work)
+        filename : str, optional
+            set to a different BASENAME if you want to use alternative climate
+            data.
+        input_filesuffix : str
+            the file suffix of the input climate file
+        hbins_step : float
+            vertical resolution (in m) of the elevation grid on which the
+            mb profile is computed, default is 10 m
+        **kwargs:
+            kyeword arguments to pass to the mb_model_sub_class
+        """
+
+        super(ConstantMassBalance_TIModel, self).__init__()
+        if not issubclass(mb_model_sub_class, TIModel):
+            # e.g. TIModel_Sfc_Type: the buckets depend on the previous
+            # years and only work on the flowline heights
+            raise InvalidParamsError('ConstantMassBalance_TIModel only works '
+                                     'with TIModel (or subclasses of it) as '
+                                     'mb_model_sub_class')
+        self.mbmod = mb_model_sub_class(gdir, melt_f=melt_f, residual=residual,
+                                        filename=filename,
+                                        input_filesuffix=input_filesuffix,
+                                        baseline_climate=baseline_climate,
+                                        **kwargs)
+
+        if y0 is None:
+            df = gdir.read_json('local_mustar')
+            y0 = df['t_star']
+
+        # elevation grid of the mb profile (as in OGGM's ConstantMassBalance)
+        try:
+            fls = gdir.read_pickle('model_flowlines')
+            # We use bed because of overdeepenings
+            h = np.concatenate([np.append(fl.bed_h, fl.surface_h)
+                                for fl in fls])
+        except FileNotFoundError:
+            # in case we don't have them
+            fls = gdir.read_pickle('inversion_flowlines')
+            h = np.concatenate([fl.surface_h for fl in fls])
+        zminmax = np.round([np.min(h)-50, np.max(h)+2000])
+        self.hbins = np.arange(*zminmax, step=hbins_step)
+        self.valid_bounds = self.hbins[[0, -1]]
+
+        self.y0 = y0
+        self.halfsize = halfsize
+        self.years = np.arange(y0-halfsize, y0+halfsize+1)
+        self.hemisphere = gdir.hemisphere
+
+        # mb profiles on hbins, with the mb params they were computed with
+        self._profiles = dict()
+
+    def historical_climate_qc_mod(self, gdir):
+        return self.mbmod.historical_climate_qc_mod(gdir)
+
+    @property
+    def temp_bias(self):
+        """Temperature bias to add to the original series."""
+        return self.mbmod.temp_bias
+
+    @temp_bias.setter
+    def temp_bias(self, value):
+        """Temperature bias to add to the original series."""
+        self.mbmod.temp_bias = value
+
+    @property
+    def prcp_fac(self):
+        """Precipitation factor to apply to the original series."""
+        return self.mbmod.prcp_fac
+
+    @prcp_fac.setter
+    def prcp_fac(self, value):
+        """Precipitation factor to apply to the original series."""
+        self.mbmod.prcp_fac = value
+
+    @property
+    def residual(self):
+        """Residual bias to apply to the original series."""
+        return self.mbmod.residual
+
+    @residual.setter
+    def residual(self, value):
+        """Residual bias to apply to the original series."""
+        self.mbmod.residual = value
+
+    def _mb_params_key(self):
+        # everything that changes the mb for given heights
+        return self.mbmod._mb_params_key()
+
+    def _compute_profile(self, kind):
+        if kind == 'annual':
+            # mbmod is a TIModel (checked in __init__)
+            mb = self.mbmod.get_annual_mb_multi_year(self.hbins,
+                                                     years=self.years)
+            return np.mean(mb, axis=0)
+        elif kind == 'annual_climate':
+            # mb, temp, tempformelt, prcp, prcpsol
+            out = [self.mbmod.get_annual_mb(self.hbins, year=yr,
+                                            add_climate=True)
+                   for yr in self.years]
+            return np.mean(out, axis=0)
+        elif kind == 'monthly_climate':
+            # months x (mb, temp, tempformelt, prcp, prcpsol) x hbins
+            out = np.zeros((12, 5, len(self.hbins)))
+            for m in np.arange(1, 13):
+                for yr in self.years:
+                    _out = self.mbmod.get_monthly_mb(
+                        self.hbins, year=date_to_floatyear(yr, m),
+                        add_climate=True)
+                    # with mb_real_daily, temp and tempformelt are daily
+                    mb, t, tfm, prcp, prcpsol = _out
+                    if np.ndim(t) == 2:
+                        t = t.mean(axis=1)
+                    if np.ndim(tfm) == 2:
+                        tfm = tfm.sum(axis=1)
+                    _out = [mb, t, tfm, prcp, prcpsol]
+                    out[m-1] += np.array(_out)
+            return out / len(self.years)
+        raise ValueError('unknown mb profile: {}'.format(kind))
+
+    def get_mb_profile(self, kind='annual'):
+        """ mb profile (and climate) of the climate period on hbins
+
+        it is only computed once (or again if the mb parameters change)
+
+        Parameters
+        ----------
+        kind : str
+            'annual' (annual mb), 'annual_climate' (annual mb, temp,
+            tempformelt, prcp, prcpsol) or 'monthly_climate' (the same for
+            each month)
+        """
+        key = self._mb_params_key()
+        if self._profiles.get('key') != key:
+            self._profiles = {'key': key}
+        if kind not in self._profiles:
+            self._profiles[kind] = self._compute_profile(kind)
+        return self._profiles[kind]
+
+    def get_monthly_mb(self, heights, year=None, add_climate=False,
+                       **kwargs):
+        _, m = floatyear_to_date(year)
+        profile = self.get_mb_profile('monthly_climate')[m-1]
+        out = [np.interp(heights, self.hbins, p) for p in profile]
+        if add_climate:
+            return tuple(out)
+        return out[0]
+
+    def get_annual_mb(self, heights, year=None, add_climate=False,
+                      **kwargs):
+        if add_climate:
+            profile = self.get_mb_profile('annual_climate')
+            return tuple(np.interp(heights, self.hbins, p) for p in profile)
+        return np.interp(heights, self.hbins, self.get_mb_profile('annual'))
+
+
+def spawn_random_mb_seeds(seed=None, n_members=1):
+    """independent seeds for the random climate of several ensemble members
+
+    uses np.random.SeedSequence.spawn, so that each member gets its own
+    reproducible random stream (also when run in parallel).
+
+    Parameters
+    ----------
+    seed : int or np.random.SeedSequence, optional
+        seed of the whole ensemble. Default is None (different each time).
+    n_members : int
+        amount of ensemble members
+
+    Returns
+    -------
+    list of np.random.SeedSequence that can be given as `seed` to
+    RandomMassBalance_TIModel or run_random_climate_TIModel
+    """
+    if not isinstance(seed, np.random.SeedSequence):
+        seed = np.random.SeedSequence(seed)
+    return seed.spawn(n_members)
+
+
 class RandomMassBalance_TIModel(MassBalanceModel):
     """Random shuffle of all MB years within a given time period.
 
@@ -2312,7 +3988,9 @@ class RandomMassBalance_TIModel(MassBalanceModel):
                  y0=None, halfsize=15, seed=None,
                  mb_model_sub_class = TIModel, baseline_climate=None,
                  filename='climate_historical', input_filesuffix='default',
-                 all_years=False, unique_samples=False, **kwargs):
+                 all_years=False, unique_samples=False, mb_elev_grid=None,
+                 nyears=None, ys=0,
+                 **kwargs):
         """Initialize.
 
         Parameters
@@ -2332,8 +4010,10 @@ class RandomMassBalance_TIModel(MassBalanceModel):
             is to use tstar as center.
         halfsize : int, optional
             the half-size of the time window (window size = 2 * halfsize + 1)
-        seed : int, optional
-            Random seed used to initialize the pseudo-random number generator.
+        seed : int or np.random.SeedSequence, optional
+            Random seed used to initialize the pseudo-random number generator
+            (np.random.Generator). For parallel ensemble members, use
+            the independent streams of `spawn_random_mb_seeds`.
         filename : str, optional
             set to a different BASENAME if you want to use alternative climate
             data.
@@ -2347,6 +4027,26 @@ class RandomMassBalance_TIModel(MassBalanceModel):
             once per random climate period-length
             if false, every model year will be chosen from the random climate
             period with the same probability
+        mb_elev_grid : np.array, optional
+            only used if mb_model_sub_class is TIModel. If given (increasing
+            elevations in m), the annual mb of all years of the climate
+            period is computed once on this grid and then linearly
+            interpolated to the asked heights. This is useful for dynamic
+            runs, where the heights change every year. The grid has to
+            cover all heights of the run (with some margin for advancing
+            glaciers), heights outside of the grid raise an error (they are
+            not extrapolated). If None (default),
+            the annual mb of each climate year is only stored for the exact
+            same heights (i.e., for a fixed geometry).
+        nyears : int, optional
+            number of model years for which the random years are drawn
+            at initialisation (starting at model year `ys`). The sequence
+            is extended if later model years are asked.
+            Default is None, then 1000 years are drawn.
+        ys : int
+            first model year of the random year sequence, default is 0.
+            If earlier model years are asked, the sequence is extended
+            backwards.
         **kwargs:
             kyeword arguments to pass to the PastMassBalance model
         """
@@ -2372,14 +4072,36 @@ class RandomMassBalance_TIModel(MassBalanceModel):
         self.ny = len(self.years)
         self.hemisphere = gdir.hemisphere
 
-        # RandomState
-        self.rng = np.random.RandomState(seed)
-        self._state_yr = dict()
+        # Generator (independent streams for ensemble members can be
+        # obtained by SeedSequence.spawn, see spawn_random_mb_seeds)
+        if not isinstance(seed, np.random.SeedSequence):
+            seed = np.random.SeedSequence(seed)
+        self.seed_seq = seed
+        self.rng = np.random.default_rng(seed)
 
         # Sampling without replacement
         self.unique_samples = unique_samples
-        if self.unique_samples:
-            self.sampling_years = self.years
+        self.sampling_years = np.unique(self.years)
+
+        # random year of every model year, drawn at once
+        self.ys = int(ys)
+        self.state_yrs = np.array([], dtype=int)
+        self._draw_state_yrs(1000 if nyears is None else int(nyears))
+
+        # annual mb of the climate period years, only for TIModel
+        # (TIModel_Sfc_Type has a state that changes every year)
+        self._use_mb_pool = isinstance(self.mbmod, TIModel)
+        if mb_elev_grid is not None:
+            mb_elev_grid = np.asarray(mb_elev_grid, dtype=np.float64)
+            if len(mb_elev_grid) < 2 or np.any(np.diff(mb_elev_grid) <= 0):
+                raise InvalidParamsError('mb_elev_grid has to be strictly '
+                                         'increasing')
+        self.mb_elev_grid = mb_elev_grid
+        # (mb params, heights) -> {climate year: annual mb}
+        self._mb_pool = OrderedDict()
+        self._mb_pool_size = 8
+        # (mb params, annual mb on mb_elev_grid of all climate years)
+        self._mb_pool_grid = (None, None)
 
     def historical_climate_qc_mod(self, gdir):
         return self.mbmod.historical_climate_qc_mod(gdir)
@@ -2420,27 +4142,59 @@ class RandomMassBalance_TIModel(MassBalanceModel):
         """Residual bias to apply to the original series."""
         self.mbmod.residual = value
 
+    def _draw_state_yrs(self, n):
+        """append n random years to the random year sequence"""
+        if n <= 0:
+            return
+        if self.unique_samples:
+            # --- Sampling without replacement ---
+            # every climate year is chosen once per climate period-length,
+            # i.e. the sequence is made of random permutations of the
+            # sampling years. The last period is maybe not yet complete.
+            n_sampling = len(self.sampling_years)
+            n_done = len(self.state_yrs) % n_sampling
+            new = [np.array([], dtype=int)]
+            if n_done > 0:
+                used = self.state_yrs[-n_done:]
+                rest = self.sampling_years[~np.isin(self.sampling_years,
+                                                    used)]
+                new.append(self.rng.permutation(rest))
+            n_periods = int(np.ceil(max(n - len(new[-1]), 0) / n_sampling))
+            new += [self.rng.permutation(self.sampling_years)
+                    for _ in range(n_periods)]
+            new = np.concatenate(new)[:n]
+        else:
+            # --- Sampling with replacement ---
+            new = self.rng.integers(*self.yr_range, size=n)
+        self.state_yrs = np.concatenate([self.state_yrs,
+                                         new.astype(int)])
+
+    def _draw_state_yrs_before(self, n):
+        """prepend (at least) n random years to the random year sequence,
+        ys is moved back accordingly"""
+        if self.unique_samples:
+            # whole climate periods, so that the periods stay aligned
+            n_sampling = len(self.sampling_years)
+            n_periods = int(np.ceil(n / n_sampling))
+            new = np.concatenate([self.rng.permutation(self.sampling_years)
+                                  for _ in range(n_periods)])
+        else:
+            new = self.rng.integers(*self.yr_range, size=n)
+        self.state_yrs = np.concatenate([new.astype(int), self.state_yrs])
+        self.ys -= len(new)
+
     def get_state_yr(self, year=None):
         """For a given year, get the random year associated to it."""
-        year = int(year)
-        if year not in self._state_yr:
-            if self.unique_samples:
-                # --- Sampling without replacement ---
-                if self.sampling_years.size == 0:
-                    # refill sample pool when all years were picked once
-                    self.sampling_years = self.years
-                # choose one year which was not used in the current period
-                _sample = self.rng.choice(self.sampling_years)
-                # write chosen year to dictionary
-                self._state_yr[year] = _sample
-                # update sample pool: remove the chosen year from it
-                self.sampling_years = np.delete(
-                    self.sampling_years,
-                    np.where(self.sampling_years == _sample))
-            else:
-                # --- Sampling with replacement ---
-                self._state_yr[year] = self.rng.randint(*self.yr_range)
-        return self._state_yr[year]
+        i_yr = int(year) - self.ys
+        if i_yr < 0:
+            # years before ys (e.g. negative start years of spin-up runs)
+            self._draw_state_yrs_before(-i_yr)
+            i_yr = int(year) - self.ys
+        if i_yr >= len(self.state_yrs):
+            # extend the sequence (with the same generator)
+            self._draw_state_yrs(max(i_yr + 1 - len(self.state_yrs),
+                                     len(self.state_yrs)))
+        return self.state_yrs[i_yr]
 
     def get_monthly_mb(self, heights, year=None, **kwargs):
         ryr, m = floatyear_to_date(year)
@@ -2452,6 +4206,53 @@ class RandomMassBalance_TIModel(MassBalanceModel):
         ryr = date_to_floatyear(self.get_state_yr(ryr), m)
         return self.mbmod.get_daily_mb(heights, year=ryr, **kwargs)
 
-    def get_annual_mb(self, heights, year=None, **kwargs):
+    def _mb_params_key(self):
+        # everything that changes the annual mb for given heights
+        return self.mbmod._mb_params_key()
+
+    def _get_annual_mb_pool_on_grid(self):
+        """annual mb of all climate period years on mb_elev_grid
+        (years x grid), only recomputed if the mb parameters change"""
+        key = self._mb_params_key()
+        if self._mb_pool_grid[0] != key:
+            pool_years = np.unique(self.years)
+            pool = self.mbmod.get_annual_mb_multi_year(self.mb_elev_grid,
+                                                       years=pool_years)
+            self._mb_pool_grid = (key, pool)
+        return self._mb_pool_grid[1]
+
+    def get_annual_mb(self, heights, year=None, add_climate=False,
+                      **kwargs):
         ryr = self.get_state_yr(int(year))
-        return self.mbmod.get_annual_mb(heights, year=ryr, **kwargs)
+        if add_climate or not self._use_mb_pool:
+            return self.mbmod.get_annual_mb(heights, year=ryr,
+                                            add_climate=add_climate,
+                                            **kwargs)
+        if self.mb_elev_grid is not None:
+            heights = np.asarray(heights)
+            if (np.min(heights) < self.mb_elev_grid[0] or
+                    np.max(heights) > self.mb_elev_grid[-1]):
+                # np.interp would use the mb of the grid edges
+                raise InvalidParamsError('heights between {:.1f} and {:.1f} m'
+                                         ' are outside of mb_elev_grid ({} to '
+                                         '{} m), use a larger grid'
+                                         ''.format(np.min(heights),
+                                                   np.max(heights),
+                                                   self.mb_elev_grid[0],
+                                                   self.mb_elev_grid[-1]))
+            pool = self._get_annual_mb_pool_on_grid()
+            i_yr = ryr - int(np.min(self.years))
+            return np.interp(heights, self.mb_elev_grid, pool[i_yr])
+
+        # for a fixed geometry: reuse the mb of the same heights
+        key = (self._mb_params_key(),
+               np.asarray(heights, dtype=np.float64).tobytes())
+        if key not in self._mb_pool:
+            self._mb_pool[key] = dict()
+            while len(self._mb_pool) > self._mb_pool_size:
+                self._mb_pool.popitem(last=False)
+        self._mb_pool.move_to_end(key)
+        pool = self._mb_pool[key]
+        if ryr not in pool:
+            pool[ryr] = self.mbmod.get_annual_mb(heights, year=ryr, **kwargs)
+        return pool[ryr].copy()
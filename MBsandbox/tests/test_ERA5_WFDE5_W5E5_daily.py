@@ -5,23 +5,79 @@ Created on Thu Dec 17 18:34:35 2020
 
 @author: lilianschuster
 """
+import os
+import functools
+import hashlib
+import threading
 import warnings
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
 import numpy as np
 import pandas as pd
 import pytest
 import xarray as xr
+import netCDF4
 from numpy.testing import assert_allclose
 import oggm
 
 # imports from oggm
-from oggm.exceptions import InvalidParamsError
+from oggm.exceptions import (InvalidParamsError, InvalidWorkflowError,
+                             DownloadVerificationFailedException)
 from oggm.shop.ecmwf import get_ecmwf_file
 from oggm import tasks, cfg
 # imports from MBsandbox package modules
 from MBsandbox.mbmod_daily_oneflowline import (process_era5_daily_data,
-                                               process_w5e5_data, get_w5e5_file)
+                                               process_w5e5_data, get_w5e5_file,
+                                               process_w5e5_data_regional,
+                                               nearest_flat_point_index,
+                                               get_flat_points_kdtree,
+                                               convert_to_point_major_store,
+                                               get_point_major_store,
+                                               write_climate_file,
+                                               precompute_era5dr_lapserates,
+                                               prefetch_climate_files,
+                                               BASENAMES)
+from MBsandbox.mbmod_daily_oneflowline import (_FLAT_POINTS_KDTREES, _date2num,
+                                               _ERA5DR_LAPSERATES,
+                                               _get_lapserates_cache_dir,
+                                               _load_lapserates_of_point,
+                                               _get_dl_cache_path,
+                                               _W5E5_CLIMATE_COUNTS,
+                                               _w5e5_source_key)
 
 warnings.filterwarnings("once", category=DeprecationWarning)
+
+
+class _RangeRequestHandler(SimpleHTTPRequestHandler):
+    """ local stand-in of the climate server: static files, with HTTP range
+    requests (to resume downloads) """
+    ranges = []
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        path = self.translate_path(self.path)
+        if not os.path.isfile(path):
+            self.send_error(404)
+            return
+        with open(path, 'rb') as f:
+            data = f.read()
+        start = 0
+        if self.headers.get('Range') is not None:
+            start = int(self.headers['Range'].split('=')[1].split('-')[0])
+            self.ranges.append((self.path, start))
+            if start >= len(data):
+                self.send_response(416)
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes {}-{}/{}'.format(
+                start, len(data) - 1, len(data)))
+        else:
+            self.send_response(200)
+        self.send_header('Content-Length', str(len(data) - start))
+        self.end_headers()
+        self.wfile.write(data[start:])
 # %%
 
 class Test_climate_daily_datasets:
@@ -171,6 +227,118 @@ class Test_climate_daily_datasets:
 
 
 
+    def test_flat_points_kdtree(self):
+        path = get_w5e5_file('W5E5_daily', 'inv')
+        with xr.open_dataset(path) as ds:
+            _FLAT_POINTS_KDTREES.clear()
+            tree = get_flat_points_kdtree(ds)
+            assert tree.n == ds.sizes['points']
+            # the tree is reused from memory ...
+            assert get_flat_points_kdtree(ds) is tree
+            # ... and from disk
+            _FLAT_POINTS_KDTREES.clear()
+            tree_disk = get_flat_points_kdtree(ds)
+            assert tree_disk.n == tree.n
+
+            # the same nearest point as with the great circle distances
+            p_lon = np.deg2rad(ds.longitude.values)
+            p_lat = np.deg2rad(ds.latitude.values)
+            for lon, lat in [(10.7584, 46.8003), (-179.9, 65.5),
+                             (179.9, -77.), (-70.3, -33.2)]:
+                _lon, _lat = np.deg2rad(lon), np.deg2rad(lat)
+                cos_dis = (np.sin(p_lat) * np.sin(_lat) + np.cos(p_lat) *
+                           np.cos(_lat) * np.cos(p_lon - _lon))
+                idx = nearest_flat_point_index(ds, lon, lat)
+                assert_allclose(cos_dis[idx], cos_dis.max())
+                # longitudes can be in [0, 360]
+                assert idx == nearest_flat_point_index(ds, lon % 360, lat)
+
+
+    def test_prefetch_climate_files(self, tmp_path):
+        cfg.initialize(logging_level='WARNING')
+        cfg.PATHS['dl_cache_dir'] = str(tmp_path / 'dl_cache')
+        cfg.PARAMS['dl_cache_readonly'] = False
+
+        # fake W5E5 files on a local server
+        server_dir = tmp_path / 'server'
+        rng = np.random.default_rng(0)
+        data = {}
+        for var, basename in BASENAMES['W5E5_daily'].items():
+            data[var] = rng.bytes(200000)
+            fpath = server_dir / basename
+            fpath.parent.mkdir(parents=True, exist_ok=True)
+            fpath.write_bytes(data[var])
+        sha256 = {var: hashlib.sha256(d).hexdigest()
+                  for var, d in data.items()}
+        # one checksum on the server, one given, one without checksum
+        basenames = BASENAMES['W5E5_daily']
+        (server_dir / (basenames['tmp'] + '.sha256')).write_text(
+            '{}  {}\n'.format(sha256['tmp'], basenames['tmp']))
+        checksums = {basenames['prcp']: sha256['prcp']}
+
+        handler = functools.partial(_RangeRequestHandler,
+                                    directory=str(server_dir))
+        server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = 'http://127.0.0.1:{}/'.format(server.server_address[1])
+        try:
+            # an interrupted download of the temperature file
+            part = _get_dl_cache_path(url + basenames['tmp']) + '.part'
+            os.makedirs(os.path.dirname(part), exist_ok=True)
+            with open(part, 'wb') as f:
+                f.write(data['tmp'][:50000])
+            _RangeRequestHandler.ranges.clear()
+
+            prefetch_paths = prefetch_climate_files(datasets=['W5E5_daily'],
+                                                    w5e5_server=url,
+                                                    checksums=checksums,
+                                                    n_workers=3)
+            # the download was resumed
+            assert ('/' + basenames['tmp'], 50000) in _RangeRequestHandler.ranges
+            for var, d in data.items():
+                with open(prefetch_paths[('W5E5_daily', var)], 'rb') as f:
+                    assert f.read() == d
+                assert not os.path.exists(
+                    prefetch_paths[('W5E5_daily', var)] + '.part')
+
+            # a corrupted file is detected
+            with pytest.raises(DownloadVerificationFailedException):
+                prefetch_climate_files(
+                    datasets=['W5E5_daily'], w5e5_server=url,
+                    checksums={basenames['inv']: '0' * 64}, reset=True)
+        finally:
+            server.shutdown()
+            server.server_close()
+
+        # the tasks then find the files without the network
+        for var in data.keys():
+            assert (get_w5e5_file('W5E5_daily', var, server=url) ==
+                    prefetch_paths[('W5E5_daily', var)])
+
+    def test_point_major_store(self, tmp_path):
+        # small flattened dataset
+        time = pd.date_range('2000-01-01', '2001-12-31', freq='D')
+        n_points = 25
+        rng = np.random.default_rng(0)
+        ds = xr.Dataset({'tas': (('time', 'points'),
+                                 rng.random((len(time), n_points)) + 273),
+                         'longitude': (('points',),
+                                       np.linspace(0, 359, n_points)),
+                         'latitude': (('points',),
+                                      np.linspace(-80, 80, n_points))},
+                        coords={'time': time})
+        path = str(tmp_path / 'tas_flat.nc')
+        ds.to_netcdf(path, unlimited_dims=['time'])
+        # no store yet
+        assert get_point_major_store(path) == path
+
+        store = convert_to_point_major_store(path, block_size=7)
+        assert get_point_major_store(path) == store
+        with xr.open_dataset(path) as ds_o, xr.open_dataset(store) as ds_s:
+            xr.testing.assert_identical(ds_o, ds_s)
+            assert ds_s.tas.encoding['chunksizes'] == (len(time), 1)
+
+
 class Test_process_era5_daily_wfde5_w5e5_hef:
 
     def test_process_era5_daily_data(self, gdir):
@@ -360,6 +528,221 @@ class Test_process_era5_daily_wfde5_w5e5_hef:
             # cfg.PARAMS[hydro_month_nh = 1], this is in conflict with 8
             process_era5_daily_data(gdir, y0=1979, y1=2018, hydro_month_nh=8)
 
+    def test_append_climate(self, gdir):
+        # appending the missing years gives the same as processing all
+        cfg.PARAMS['hydro_month_nh'] = 1
+        filename = 'climate_historical'
+        fs_full = {'daily': '_daily_full', 'monthly': '_monthly_full'}
+        fs_app = {'daily': '_daily_app', 'monthly': '_monthly_app'}
+        process_w5e5_data(gdir, temporal_resol=['daily', 'monthly'],
+                          climate_type='W5E5', output_filesuffix=fs_full)
+        process_w5e5_data(gdir, y1=2010, temporal_resol=['daily', 'monthly'],
+                          climate_type='W5E5', output_filesuffix=fs_app)
+        for _ in range(2):
+            # the second time, the files are already up to date
+            process_w5e5_data(gdir, temporal_resol=['daily', 'monthly'],
+                              climate_type='W5E5', output_filesuffix=fs_app,
+                              append=True)
+        process_era5_daily_data(gdir, output_filesuffix='_ERA5_full')
+        process_era5_daily_data(gdir, y1=2010, output_filesuffix='_ERA5_app')
+        process_era5_daily_data(gdir, output_filesuffix='_ERA5_app',
+                                append=True)
+        fs_full = list(fs_full.values()) + ['_ERA5_full']
+        fs_app = list(fs_app.values()) + ['_ERA5_app']
+        for f_full, f_app in zip(fs_full, fs_app):
+            with xr.open_dataset(gdir.get_filepath(
+                    filename, filesuffix=f_full)) as ds_f, \
+                    xr.open_dataset(gdir.get_filepath(
+                        filename, filesuffix=f_app)) as ds_a:
+                np.testing.assert_array_equal(ds_f.time, ds_a.time)
+                for var in ['temp', 'prcp', 'gradient']:
+                    np.testing.assert_allclose(ds_f[var], ds_a[var])
+                assert ds_f.hydro_yr_0 == ds_a.hydro_yr_0
+                assert ds_f.hydro_yr_1 == ds_a.hydro_yr_1
+            if f_full == fs_full[1]:
+                # the 2019 W5E5 lapse rates are the ERA5dr climatology of
+                # 1979-2018 (also when only 2011-2019 are appended)
+                with xr.open_dataset(get_ecmwf_file('ERA5dr',
+                                                    'lapserates')) as ds:
+                    lon = gdir.cenlon + 360 if gdir.cenlon < 0 \
+                        else gdir.cenlon
+                    lr = ds.lapserate.sel(longitude=lon,
+                                          latitude=gdir.cenlat,
+                                          method='nearest')
+                    lr = lr.sel(time=slice('1979', '2018')).load()
+                lr_clim = lr.groupby('time.month').mean().values
+                with xr.open_dataset(gdir.get_filepath(
+                        filename, filesuffix=f_app)) as ds_a:
+                    np.testing.assert_allclose(
+                        ds_a.gradient.sel(time='2019').values, lr_clim)
+
+        # the hydrological year has to be the same as in the file
+        cfg.PARAMS['hydro_month_nh'] = 10
+        with pytest.raises(InvalidWorkflowError):
+            process_era5_daily_data(gdir, output_filesuffix='_ERA5_app',
+                                    append=True)
+        cfg.PARAMS['hydro_month_nh'] = 1
+
+    def test_era5dr_lapserates_cache(self, gdir):
+        path = get_ecmwf_file('ERA5dr', 'lapserates')
+        _ERA5DR_LAPSERATES.clear()
+        # all glaciers share the same grid point
+        assert precompute_era5dr_lapserates([gdir, gdir]) == 1
+        assert len(_ERA5DR_LAPSERATES) == 1
+        # the cache files are in the working directory
+        cache_dir = _get_lapserates_cache_dir(
+            list(_ERA5DR_LAPSERATES.keys())[0])
+        assert cache_dir.startswith(cfg.PATHS['working_dir'])
+        n_files = len(os.listdir(cache_dir))
+        assert n_files >= 1
+        # known points are not written again (also not in a new process)
+        precompute_era5dr_lapserates([gdir])
+        _ERA5DR_LAPSERATES.clear()
+        precompute_era5dr_lapserates([gdir])
+        assert len(os.listdir(cache_dir)) == n_files
+        lon = gdir.cenlon + 360 if gdir.cenlon < 0 else gdir.cenlon
+        with xr.open_dataset(path) as ds:
+            lr = ds.sel(longitude=lon, latitude=gdir.cenlat,
+                        method='nearest').lapserate.load()
+        # from memory and from disk (as in a new process)
+        for clear in [False, True]:
+            if clear:
+                _ERA5DR_LAPSERATES.clear()
+            ds_lr = _load_lapserates_of_point(path, lon, gdir.cenlat)
+            np.testing.assert_array_equal(ds_lr.lapserate, lr)
+            np.testing.assert_array_equal(ds_lr.time, lr.time)
+            assert float(ds_lr.longitude) == float(lr.longitude)
+            assert float(ds_lr.latitude) == float(lr.latitude)
+
+    def test_write_climate_file_options(self, gdir):
+        # the vectorized time encoding is the same as netCDF4.date2num
+        time = pd.date_range('1979-01-01', '2019-12-31', freq='D')
+        for time_unit in ['days since 1801-01-01 00:00:00',
+                          'days since 1979-01-01 00:00:00']:
+            np.testing.assert_allclose(
+                _date2num(time, time_unit),
+                netCDF4.date2num(time.to_pydatetime(), time_unit,
+                                 calendar='standard'))
+
+        # faster writing options give the same climate file
+        cfg.PARAMS['hydro_month_nh'] = 1
+        filename = 'climate_historical'
+        process_w5e5_data(gdir, temporal_resol='daily', climate_type='W5E5',
+                          output_filesuffix='_write')
+        with xr.open_dataset(gdir.get_filepath(
+                filename, filesuffix='_write')) as ds:
+            ds = ds.load()
+        for kwargs in [dict(complevel=0), dict(complevel=1),
+                       dict(buffered=True, complevel=1)]:
+            write_climate_file(gdir, ds.time.values, ds.prcp.values,
+                               ds.temp.values, ds.ref_hgt, ds.ref_pix_lon,
+                               ds.ref_pix_lat, gradient=ds.gradient.values,
+                               source=ds.climate_source,
+                               file_name=filename,
+                               filesuffix='_write_opt',
+                               temporal_resol='daily', **kwargs)
+            with xr.open_dataset(gdir.get_filepath(
+                    filename, filesuffix='_write_opt')) as ds_opt:
+                np.testing.assert_array_equal(ds.time, ds_opt.time)
+                for var in ['temp', 'prcp', 'gradient']:
+                    np.testing.assert_array_equal(ds[var], ds_opt[var])
+                assert ds.hydro_yr_0 == ds_opt.hydro_yr_0
+                assert ds.hydro_yr_1 == ds_opt.hydro_yr_1
+
+    def test_process_w5e5_data_daily_and_monthly(self, gdir):
+        # the monthly files (of one call with both temporal resolutions
+        # and of a call for monthly only) are the monthly aggregation of
+        # the daily files
+        cfg.PARAMS['hydro_month_nh'] = 1
+        filename = 'climate_historical'
+        for temporal_resol in ['daily', 'monthly']:
+            process_w5e5_data(gdir, temporal_resol=temporal_resol,
+                              climate_type='W5E5',
+                              output_filesuffix='_{}_single'.format(
+                                  temporal_resol))
+        process_w5e5_data(gdir, temporal_resol=['daily', 'monthly'],
+                          climate_type='W5E5',
+                          output_filesuffix={'daily': '_daily_both',
+                                             'monthly': '_monthly_both'})
+        for suffix in ['_single', '_both']:
+            # the monthly values are the same as an independent aggregation
+            # of the daily ones with xarray
+            with xr.open_dataset(gdir.get_filepath(
+                    filename, filesuffix='_daily' + suffix)) as ds_d, \
+                    xr.open_dataset(gdir.get_filepath(
+                        filename, filesuffix='_monthly' + suffix)) as ds_m:
+                ds_r = ds_d.resample(time='MS')
+                np.testing.assert_array_equal(ds_r.mean().time, ds_m.time)
+                np.testing.assert_allclose(ds_r.mean().temp, ds_m.temp,
+                                           rtol=1e-5, atol=1e-5)
+                np.testing.assert_allclose(ds_d.temp.resample(time='MS').std(),
+                                           ds_m.temp_std, rtol=1e-4,
+                                           atol=1e-5)
+                np.testing.assert_allclose(ds_r.sum().prcp, ds_m.prcp,
+                                           rtol=1e-4)
+                # the same gradient for every day of a month
+                np.testing.assert_allclose(ds_r.min().gradient,
+                                           ds_r.max().gradient)
+                np.testing.assert_allclose(ds_r.mean().gradient,
+                                           ds_m.gradient, rtol=1e-5)
+                assert ds_d.ref_hgt == ds_m.ref_hgt
+
+        with pytest.raises(InvalidParamsError):
+            # one filesuffix for two files
+            process_w5e5_data(gdir, temporal_resol=['daily', 'monthly'],
+                              climate_type='W5E5',
+                              output_filesuffix='_both')
+
+    def test_process_w5e5_data_regional(self, gdir):
+        # the global task gives the same climate files as the entity task
+        cfg.PARAMS['hydro_month_nh'] = 1
+        filename = 'climate_historical'
+        for temporal_resol in ['daily', 'monthly']:
+            process_w5e5_data(gdir, temporal_resol=temporal_resol,
+                              climate_type='W5E5',
+                              output_filesuffix='_entity')
+            process_w5e5_data_regional([gdir], temporal_resol=temporal_resol,
+                                       climate_type='W5E5',
+                                       output_filesuffix='_regional')
+            with xr.open_dataset(gdir.get_filepath(
+                    filename, filesuffix='_entity')) as ds_e, \
+                    xr.open_dataset(gdir.get_filepath(
+                        filename, filesuffix='_regional')) as ds_r:
+                for var in ['temp', 'prcp', 'gradient']:
+                    np.testing.assert_allclose(ds_e[var], ds_r[var])
+                if temporal_resol == 'monthly':
+                    np.testing.assert_allclose(ds_e.temp_std, ds_r.temp_std)
+                assert ds_e.ref_hgt == ds_r.ref_hgt
+                assert ds_e.ref_pix_lon == ds_r.ref_pix_lon
+                assert ds_e.ref_pix_lat == ds_r.ref_pix_lat
+
+        # glaciers with the same grid points share one climate series
+        n_unique = process_w5e5_data_regional([gdir, gdir],
+                                              temporal_resol='monthly',
+                                              climate_type='W5E5',
+                                              output_filesuffix='_regional')
+        assert n_unique == 1
+
+        # the entity task also reuses the series of the glacier before
+        counts = dict(_W5E5_CLIMATE_COUNTS)
+        process_w5e5_data(gdir, temporal_resol='monthly',
+                          climate_type='W5E5', output_filesuffix='_entity')
+        assert _W5E5_CLIMATE_COUNTS['glaciers'] == counts['glaciers'] + 1
+        assert _W5E5_CLIMATE_COUNTS['series'] == counts['series']
+
+    def test_w5e5_source_key(self, tmp_path):
+        # a replaced file has another key in the climate memo
+        fpath = str(tmp_path / 'test.nc')
+        xr.Dataset({'a': ('x', np.arange(3))}).to_netcdf(fpath)
+        with xr.open_dataset(fpath) as ds:
+            key = _w5e5_source_key(ds)
+        assert key[0] == os.path.abspath(fpath)
+        xr.Dataset({'a': ('x', np.arange(300))}).to_netcdf(fpath)
+        with xr.open_dataset(fpath) as ds:
+            assert _w5e5_source_key(ds) != key
+        # datasets without file
+        assert _w5e5_source_key(xr.Dataset()) is None
+
     # this could be replaced in OGGM base code test_shop.py when merged
     def test_all_at_once(self, gdir):
 
@@ -19,8 +19,15 @@ import logging
 #log = logging.getLogger(__name__)
 #import aesara.tensor as aet
 import oggm
+from oggm.exceptions import InvalidParamsError, InvalidWorkflowError
 from MBsandbox.mbmod_daily_oneflowline import process_w5e5_data
 from MBsandbox.wip.projections_bayescalibration import process_isimip_data, run_from_climate_data_TIModel, MultipleFlowlineMassBalance_TIModel
+from MBsandbox.wip.projections_bayescalibration import (running_mean_of_months,
+                                                        _scale_stddev_rolling,
+                                                        process_isimip_data_regional,
+                                                        _get_climobs_stats,
+                                                        _running_mean,
+                                                        extract_isimip_regional_store)
 ensemble = 'mri-esm2-0_r1i1p1f1'
 
 base_url = ('https://cluster.klima.uni-bremen.de/~oggm/gdirs/oggm_v1.4/'
@@ -101,6 +108,68 @@ def test_ssp585_problem():
 #@pytest.mark.usefixtures('get_hef_gcms')
 class TestProcessIsimipData:
 
+    def test_running_mean_of_months(self):
+        rng = np.random.default_rng(0)
+        n_years = 40
+        x = rng.normal(270, 5, (n_years, 12))
+        x[3, 5] = np.NaN
+        for half_window in [0, 3, 18, 50]:
+            xm = running_mean_of_months(x, half_window)
+            for j in range(n_years):
+                lo, hi = max(0, j - half_window), j + half_window + 1
+                assert_allclose(xm[j], np.nanmean(x[lo:hi], axis=0))
+
+        # centered rolling windows of any length (as pandas and xarray)
+        for window in [1, 4, 5, 36]:
+            xm = _running_mean(x, window // 2, window - window // 2 - 1)
+            xm_pd = pd.DataFrame(x).rolling(window, center=True,
+                                            min_periods=1).mean()
+            assert_allclose(xm, xm_pd.values)
+
+        # same as the xarray rolling window (checked with validate=True)
+        time = pd.date_range('1850-01-01', periods=n_years * 12, freq='MS')
+        ts = xr.DataArray(x.ravel(), dims='time', coords={'time': time})
+        std_fac = np.tile(rng.uniform(0.5, 1.5, 12), n_years)
+        out = _scale_stddev_rolling(ts, std_fac, 10, validate=True)
+        assert out.shape == ts.shape
+
+    def test_climobs_stats(self, gdir):
+        cfg.PARAMS['hydro_month_nh'] = 1
+        fh_suffix = '_monthly_WFDE5_CRU'
+        process_w5e5_data(gdir, temporal_resol='monthly',
+                          climate_type='WFDE5_CRU')
+        stats = _get_climobs_stats(gdir, climate_historical_filesuffix=fh_suffix)
+        assert gdir.has_file('climate_historical_stats',
+                             filesuffix=fh_suffix + '_month_1979_2014')
+        assert len(stats) == 12
+        assert stats['n'].sum() == 36 * 12
+
+        fh = gdir.get_filepath('climate_historical', filesuffix=fh_suffix)
+        with xr.open_dataset(fh) as clim:
+            sclim = clim.sel(time=slice('1979', '2014'))
+            for var in ['temp', 'temp_std', 'prcp', 'gradient']:
+                grouped = sclim[var].groupby('time.month')
+                assert_allclose(stats[var + '_mean'], grouped.mean(),
+                                rtol=1e-6)
+                assert_allclose(stats[var + '_stddev'], grouped.std(),
+                                rtol=1e-5)
+            assert_allclose(stats['ref_hgt'], clim.ref_hgt)
+
+        # the second time, the stored statistics are read
+        stats_stored = _get_climobs_stats(gdir,
+                                          climate_historical_filesuffix=fh_suffix)
+        pd.testing.assert_frame_equal(stats, stats_stored, check_dtype=False)
+
+        # they are recomputed if the climate file changes
+        fs = fh_suffix + '_month_1979_2014'
+        d = gdir.read_json('climate_historical_stats', filesuffix=fs)
+        d['stats']['temp_mean'] = [0.] * 12
+        d['source'][0] = -1
+        gdir.write_json(d, 'climate_historical_stats', filesuffix=fs)
+        stats_new = _get_climobs_stats(gdir,
+                                       climate_historical_filesuffix=fh_suffix)
+        pd.testing.assert_frame_equal(stats, stats_new, check_dtype=False)
+
     def test_process_isimip_data_monthly(self, gdir):
         cfg.PARAMS['hydro_month_nh'] = 1
         ssp ='ssp126'
@@ -108,8 +177,10 @@ class TestProcessIsimipData:
         process_w5e5_data(gdir, temporal_resol='monthly',
                            climate_type='WFDE5_CRU')
 
+        # the scaling of the std is checked against the rolling window
         process_isimip_data(gdir, ensemble=ensemble, ssp=ssp,
-                            climate_historical_filesuffix='_monthly_WFDE5_CRU')
+                            climate_historical_filesuffix='_monthly_WFDE5_CRU',
+                            validate_stddev_scaling=True)
         process_isimip_data(gdir, ensemble=ensemble, ssp=ssp, correct=False,
                             climate_historical_filesuffix='_monthly_WFDE5_CRU')
 
@@ -194,6 +265,146 @@ class TestProcessIsimipData:
             assert utils.corrcoef(ss1, ss2) > 0.9
 
 
+    @pytest.mark.parametrize('temporal_resol', ['monthly', 'daily'])
+    def test_process_isimip_data_regional(self, gdir, temporal_resol):
+        ssp = 'ssp126'
+        hydro_months = [1, 10] if temporal_resol == 'monthly' else [1]
+        fh_suffix = '_{}_WFDE5_CRU'.format(temporal_resol)
+        for sm in hydro_months:
+            cfg.PARAMS['hydro_month_nh'] = sm
+            process_w5e5_data(gdir, temporal_resol=temporal_resol,
+                              climate_type='WFDE5_CRU')
+            process_isimip_data(gdir, ensemble=ensemble, ssp=ssp,
+                                temporal_resol=temporal_resol,
+                                climate_historical_filesuffix=fh_suffix)
+            # same output if processed for all glaciers at once
+            process_isimip_data_regional([gdir], ensemble=ensemble, ssp=ssp,
+                                         temporal_resol=temporal_resol,
+                                         climate_historical_filesuffix=fh_suffix,
+                                         output_filesuffix='_regional')
+            fgcm = gdir.get_filepath('gcm_data', filesuffix='_{}_ISIMIP3b_{}_{}'
+                                     .format(temporal_resol, ensemble, ssp))
+            fgcm_r = gdir.get_filepath('gcm_data', filesuffix='_regional')
+            with xr.open_dataset(fgcm) as gcm, \
+                    xr.open_dataset(fgcm_r) as gcm_r:
+                assert gcm.ref_hgt == gcm_r.ref_hgt
+                assert_allclose(gcm.ref_pix_lon, gcm_r.ref_pix_lon)
+                assert_allclose(gcm.ref_pix_lat, gcm_r.ref_pix_lat)
+                assert np.all(gcm.time == gcm_r.time)
+                for var in ['temp', 'prcp', 'gradient', 'temp_std']:
+                    if var in gcm:
+                        assert_allclose(gcm[var], gcm_r[var], rtol=1e-4,
+                                        atol=1e-6)
+        cfg.PARAMS['hydro_month_nh'] = 1
+
+    def test_process_isimip_data_several_ssps(self, gdir):
+        cfg.PARAMS['hydro_month_nh'] = 1
+        ssps = ['ssp126', 'ssp370']
+        fh_suffix = '_monthly_WFDE5_CRU'
+        process_w5e5_data(gdir, temporal_resol='monthly',
+                          climate_type='WFDE5_CRU')
+        for ssp in ssps:
+            process_isimip_data(gdir, ensemble=ensemble, ssp=ssp,
+                                climate_historical_filesuffix=fh_suffix)
+        # all ssps at once (with the historical data read once)
+        suffixes = {(ensemble, ssp): '_several_{}'.format(ssp)
+                    for ssp in ssps}
+        process_isimip_data(gdir, ensemble=ensemble, ssp=ssps,
+                            climate_historical_filesuffix=fh_suffix,
+                            output_filesuffix=suffixes)
+        for ssp in ssps:
+            fgcm = gdir.get_filepath('gcm_data',
+                                     filesuffix='_monthly_ISIMIP3b_{}_{}'
+                                     .format(ensemble, ssp))
+            fgcm_s = gdir.get_filepath('gcm_data',
+                                       filesuffix='_several_{}'.format(ssp))
+            with xr.open_dataset(fgcm) as gcm, \
+                    xr.open_dataset(fgcm_s) as gcm_s:
+                for var in ['temp', 'prcp', 'gradient', 'temp_std']:
+                    assert_allclose(gcm[var], gcm_s[var], rtol=1e-4,
+                                    atol=1e-6)
+
+        # a single filesuffix is ambiguous for several ssps
+        with pytest.raises(InvalidParamsError):
+            process_isimip_data_regional([gdir], ensemble=ensemble, ssp=ssps,
+                                         climate_historical_filesuffix=fh_suffix,
+                                         output_filesuffix='_several')
+
+    def test_process_isimip_data_daily_chunked(self, gdir):
+        ssp = 'ssp126'
+        cfg.PARAMS['hydro_month_nh'] = 1
+        fh_suffix = '_daily_WFDE5_CRU'
+        process_w5e5_data(gdir, temporal_resol='daily',
+                          climate_type='WFDE5_CRU')
+        process_isimip_data(gdir, ensemble=ensemble, ssp=ssp,
+                            temporal_resol='daily',
+                            climate_historical_filesuffix=fh_suffix)
+        # streamed in chunks of years, directly from the GCM files
+        process_isimip_data(gdir, ensemble=ensemble, ssp=ssp,
+                            temporal_resol='daily',
+                            climate_historical_filesuffix=fh_suffix,
+                            output_filesuffix='_chunked', chunk_years=7)
+
+        fgcm = gdir.get_filepath('gcm_data',
+                                 filesuffix='_daily_ISIMIP3b_{}_{}'.format(
+                                     ensemble, ssp))
+        fgcm_c = gdir.get_filepath('gcm_data', filesuffix='_chunked')
+        with xr.open_dataset(fgcm) as gcm, xr.open_dataset(fgcm_c) as gcm_c:
+            assert np.all(gcm.time == gcm_c.time)
+            assert gcm.hydro_yr_0 == gcm_c.hydro_yr_0
+            assert gcm.hydro_yr_1 == gcm_c.hydro_yr_1
+            assert gcm.ref_hgt == gcm_c.ref_hgt
+            for var in ['temp', 'prcp', 'gradient']:
+                assert_allclose(gcm[var], gcm_c[var], rtol=1e-5, atol=1e-4)
+
+    def test_isimip_regional_store(self, gdir, tmp_path):
+        ssp = 'ssp126'
+        cfg.PARAMS['hydro_month_nh'] = 1
+        fh_suffix = '_monthly_WFDE5_CRU'
+        process_w5e5_data(gdir, temporal_resol='monthly',
+                          climate_type='WFDE5_CRU')
+        process_isimip_data(gdir, ensemble=ensemble, ssp=ssp,
+                            climate_historical_filesuffix=fh_suffix)
+
+        store = str(tmp_path / 'isimip3b_store_monthly.nc')
+        n_points = extract_isimip_regional_store([gdir], store,
+                                                 ensemble=ensemble, ssp=[ssp])
+        assert n_points == 1
+        with xr.open_dataset(store) as ds:
+            assert ds.rgi_id.values[0] == gdir.rgi_id
+        with xr.open_dataset(store, group='{}_{}'.format(ensemble, ssp),
+                             use_cftime=True) as ds:
+            assert ds.attrs['experiment'] == ssp
+            assert ds.tasAdjust.dims == ('points', 'time')
+
+        # same output when reading from the store
+        process_isimip_data(gdir, ensemble=ensemble, ssp=ssp,
+                            climate_historical_filesuffix=fh_suffix,
+                            output_filesuffix='_store',
+                            regional_store=store)
+        process_isimip_data_regional([gdir], ensemble=ensemble, ssp=ssp,
+                                     climate_historical_filesuffix=fh_suffix,
+                                     output_filesuffix='_store_regional',
+                                     regional_store=store)
+        fgcm = gdir.get_filepath('gcm_data',
+                                 filesuffix='_monthly_ISIMIP3b_{}_{}'.format(
+                                     ensemble, ssp))
+        for fs in ['_store', '_store_regional']:
+            fgcm_s = gdir.get_filepath('gcm_data', filesuffix=fs)
+            with xr.open_dataset(fgcm) as gcm, \
+                    xr.open_dataset(fgcm_s) as gcm_s:
+                assert_allclose(gcm.ref_pix_lon, gcm_s.ref_pix_lon)
+                assert_allclose(gcm.ref_pix_lat, gcm_s.ref_pix_lat)
+                for var in ['temp', 'prcp', 'gradient', 'temp_std']:
+                    assert_allclose(gcm[var], gcm_s[var], rtol=1e-4,
+                                    atol=1e-6)
+
+        # the store has no ssp370 data
+        with pytest.raises(InvalidWorkflowError):
+            process_isimip_data(gdir, ensemble=ensemble, ssp='ssp370',
+                                climate_historical_filesuffix=fh_suffix,
+                                regional_store=store)
+
     def test_process_isimip_data_daily(self, gdir):
         ssp ='ssp126'
 
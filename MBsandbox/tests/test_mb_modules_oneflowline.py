@@ -26,17 +26,22 @@ import oggm
 from oggm.core import massbalance
 from oggm import utils, workflow, tasks, cfg
 from oggm.cfg import SEC_IN_DAY, SEC_IN_YEAR
-from oggm.exceptions import InvalidParamsError
+from oggm.exceptions import InvalidParamsError, MassBalanceCalibrationError
 from oggm.utils import date_to_floatyear
 
 from MBsandbox.wip.help_func_geodetic import minimize_bias_geodetic
 # imports from MBsandbox package modules
 from MBsandbox.help_func import (compute_stat, minimize_bias,
-                                 optimize_std_quot_brentq)
+                                 optimize_std_quot_brentq,
+                                 calibrate_melt_f_geodetic)
 
 from MBsandbox.mbmod_daily_oneflowline import (process_era5_daily_data,
                                                process_w5e5_data,
-                                               TIModel, TIModel_Sfc_Type)
+                                               TIModel, TIModel_Sfc_Type,
+                                               MultipleFlowlineMassBalance_TIModel,
+                                               RandomMassBalance_TIModel,
+                                               spawn_random_mb_seeds,
+                                               ConstantMassBalance_TIModel)
 
 # optimal values for HEF of mu_star for cte lapse rates (for wgms direct MB)
 mu_star_opt_cte = {'mb_monthly': 213.561413,
@@ -164,6 +169,192 @@ class Test_geodetic_sfc_type:
 
         assert mb_gradient_0_5 > mb_gradient_1
 
+    def test_calibrate_melt_f_geodetic(self, gdir):
+        cfg.PARAMS['hydro_month_nh'] = 1
+        melt_f = 200
+        pf = 2.5
+        cfg.PARAMS['baseline_climate'] = 'ERA5dr'
+        oggm.shop.ecmwf.process_ecmwf_data(gdir, dataset='ERA5dr',
+                                           output_filesuffix='_monthly_ERA5dr',
+                                           )
+        url = 'https://cluster.klima.uni-bremen.de/~oggm/geodetic_ref_mb/hugonnet_2021_ds_rgi60_pergla_rates_10_20_worldwide.csv'
+        path = utils.file_downloader(url)
+        pd_geodetic = pd.read_csv(path, index_col='rgiid')
+        pd_geodetic = pd_geodetic.loc[pd_geodetic.period == '2000-01-01_2020-01-01']
+        mb_geodetic = pd_geodetic.loc[gdir.rgi_id].dmdtda * 1000
+
+        h, w = gdir.get_inversion_flowline_hw()
+        years = np.arange(2000, 2019)
+        for mb_type in ['mb_monthly', 'mb_pseudo_daily']:
+            mb_mod = TIModel(gdir, melt_f, mb_type=mb_type, prcp_fac=pf)
+            # direct linear solution is the same as with brentq
+            melt_f_lin = calibrate_melt_f_geodetic(mb_mod, mb_geodetic, h, w,
+                                                   pf, ys=years)
+            melt_f_brentq = scipy.optimize.brentq(minimize_bias_geodetic, 1,
+                                                  1000, xtol=0.01,
+                                                  args=(mb_mod, mb_geodetic,
+                                                        h, w, pf),
+                                                  disp=True)
+            assert_allclose(melt_f_lin, melt_f_brentq, atol=0.01)
+            # the model is set to the calibrated melt_f
+            assert mb_mod.melt_f == melt_f_lin
+            mb_mod.melt_f = melt_f_lin
+            spec_mb = mb_mod.get_specific_mb(heights=h, widths=w, year=years)
+            assert_allclose(spec_mb.mean(), mb_geodetic, rtol=1e-4)
+
+            # no melt_f within the physical bounds matches
+            with pytest.raises(MassBalanceCalibrationError):
+                calibrate_melt_f_geodetic(mb_mod, mb_geodetic, h, w, pf,
+                                          ys=years, melt_f_min=1,
+                                          melt_f_max=melt_f_lin / 2)
+
+        # with surface type distinction, brentq is used
+        mb_mod_sfc = TIModel_Sfc_Type(gdir, melt_f, mb_type='mb_monthly',
+                                      melt_f_ratio_snow_to_ice=0.5,
+                                      prcp_fac=pf)
+        melt_f_sfc = calibrate_melt_f_geodetic(mb_mod_sfc, mb_geodetic, h, w,
+                                               pf, ys=years)
+        melt_f_sfc_brentq = scipy.optimize.brentq(minimize_bias_geodetic, 1,
+                                                  1000, xtol=0.01,
+                                                  args=(mb_mod_sfc,
+                                                        mb_geodetic, h, w, pf),
+                                                  disp=True)
+        assert_allclose(melt_f_sfc, melt_f_sfc_brentq)
+
+    def test_sfc_type_multi_year(self, gdir):
+        cfg.PARAMS['hydro_month_nh'] = 1
+        melt_f = 200
+        pf = 2.5
+        cfg.PARAMS['baseline_climate'] = 'ERA5dr'
+        oggm.shop.ecmwf.process_ecmwf_data(gdir, dataset='ERA5dr',
+                                           output_filesuffix='_monthly_ERA5dr',
+                                           )
+        h, w = gdir.get_inversion_flowline_hw()
+        years = np.arange(2000, 2019)
+        for mb_type in ['mb_monthly', 'mb_pseudo_daily']:
+            mb_mod_seq = TIModel_Sfc_Type(gdir, melt_f, mb_type=mb_type,
+                                          melt_f_ratio_snow_to_ice=0.5,
+                                          prcp_fac=pf)
+            mb_mod_multi = TIModel_Sfc_Type(gdir, melt_f, mb_type=mb_type,
+                                            melt_f_ratio_snow_to_ice=0.5,
+                                            prcp_fac=pf)
+            # year by year
+            mb_seq = np.array([mb_mod_seq.get_annual_mb(h, year=yr)
+                               for yr in years])
+            # all years at once
+            mb_multi = mb_mod_multi.get_annual_mb_multi_year(h, years=years)
+            assert mb_multi.shape == (len(years), len(h))
+            assert_allclose(mb_multi, mb_seq)
+            # buckets should be in the same state afterwards
+            assert_allclose(mb_mod_multi.pd_bucket[mb_mod_multi.buckets],
+                            mb_mod_seq.pd_bucket[mb_mod_seq.buckets])
+
+            # specific mb uses the multi-year method
+            mb_mod_multi.reset_pd_bucket()
+            spec_multi = mb_mod_multi.get_specific_mb(heights=h, widths=w,
+                                                      year=years)
+            assert_allclose(spec_multi,
+                            np.average(mb_seq, weights=w, axis=1) *
+                            SEC_IN_YEAR * mb_mod_seq.rho)
+
+        with pytest.raises(InvalidParamsError):
+            mb_mod_multi.get_annual_mb_multi_year(h, years=[2000, 2002])
+
+        # single years (and non-consecutive years) with kwargs
+        mb_mod = TIModel_Sfc_Type(gdir, melt_f, mb_type='mb_monthly',
+                                  melt_f_ratio_snow_to_ice=0.5, prcp_fac=pf)
+        mb_mod_ref = TIModel_Sfc_Type(gdir, melt_f, mb_type='mb_monthly',
+                                      melt_f_ratio_snow_to_ice=0.5,
+                                      prcp_fac=pf)
+        spec = mb_mod.get_specific_mb(heights=h, widths=w, year=2000,
+                                      spinup=True)
+        assert np.ndim(spec) == 0
+        mb_ref = mb_mod_ref.get_annual_mb(h, year=2000, spinup=True)
+        assert_allclose(spec, np.average(mb_ref, weights=w) *
+                        SEC_IN_YEAR * mb_mod_ref.rho)
+        spec = mb_mod.get_specific_mb(heights=h, widths=w,
+                                      year=[2001, 2003], spinup=True)
+        mb_ref = [mb_mod_ref.get_annual_mb(h, year=yr) for yr in [2001, 2003]]
+        assert_allclose(spec, np.average(mb_ref, weights=w, axis=1) *
+                        SEC_IN_YEAR * mb_mod_ref.rho)
+        # same with the flowlines
+        fls = gdir.read_pickle('inversion_flowlines')
+        mb_mod.reset_pd_bucket()
+        spec = mb_mod.get_specific_mb(fls=fls, year=2000, spinup=True)
+        assert_allclose(spec, mb_mod.get_specific_mb(heights=h, widths=w,
+                                                     year=2000, spinup=True))
+
+    def test_sfc_type_spinup_cache(self, gdir):
+        cfg.PARAMS['hydro_month_nh'] = 1
+        melt_f = 200
+        pf = 2.5
+        cfg.PARAMS['baseline_climate'] = 'ERA5dr'
+        oggm.shop.ecmwf.process_ecmwf_data(gdir, dataset='ERA5dr',
+                                           output_filesuffix='_monthly_ERA5dr',
+                                           )
+        h, w = gdir.get_inversion_flowline_hw()
+        mb_mod = TIModel_Sfc_Type(gdir, melt_f, mb_type='mb_monthly',
+                                  prcp_fac=pf, spinup_cache_size=2)
+
+        # spin-up by hand, year by year
+        for yr in np.arange(1995, 2000):
+            mb_mod.get_annual_mb(h, year=yr)
+        bucket_by_hand = mb_mod.get_bucket_state()
+        mb_2000_by_hand = mb_mod.get_annual_mb(h, year=2000)
+
+        mb_2000 = mb_mod.get_annual_mb(h, year=2000, spinup=True)
+        assert_allclose(mb_2000, mb_2000_by_hand)
+        assert len(mb_mod._spinup_cache) == 1
+        # now it comes from the cache
+        mb_2000 = mb_mod.get_annual_mb(h, year=2000, spinup=True)
+        assert_allclose(mb_2000, mb_2000_by_hand)
+        assert len(mb_mod._spinup_cache) == 1
+
+        # snapshot and restore
+        bucket = mb_mod.spinup(h, ys=2000, n_years=5)
+        assert_allclose(bucket[mb_mod.buckets],
+                        bucket_by_hand[mb_mod.buckets])
+        mb_mod.get_annual_mb(h, year=2000)
+        mb_mod.set_bucket_state(bucket)
+        assert_allclose(mb_mod.get_annual_mb(h, year=2000), mb_2000_by_hand)
+
+        # the spin-up starts from empty buckets: the mb is the same after
+        # other years filled the buckets
+        for yr in np.arange(2005, 2010):
+            mb_mod.get_annual_mb(h, year=yr)
+        assert np.any(mb_mod.get_bucket_state()[mb_mod.buckets].values > 0)
+        assert_allclose(mb_mod.get_annual_mb(h, year=2000, spinup=True),
+                        mb_2000_by_hand)
+        mb_mod._spinup_cache.clear()
+        for yr in np.arange(2005, 2010):
+            mb_mod.get_annual_mb(h, year=yr)
+        assert_allclose(mb_mod.get_annual_mb(h, year=2000, spinup=True),
+                        mb_2000_by_hand)
+        # the same as continuing the year by year spin-up from filled
+        # buckets (as done in older versions): after 5 years, the
+        # firn of the years before is removed
+        for yr in np.arange(2005, 2010):
+            mb_mod.get_annual_mb(h, year=yr)
+        for yr in np.arange(1995, 2000):
+            mb_mod.get_annual_mb(h, year=yr)
+        assert_allclose(mb_mod.get_annual_mb(h, year=2000), mb_2000_by_hand)
+        # with a shorter spin-up, the buckets before would matter, this is
+        # why they are emptied first
+        for yr in np.arange(2005, 2010):
+            mb_mod.get_annual_mb(h, year=yr)
+        mb_mod.spinup(h, ys=2000, n_years=2)
+        mb_2000_n2 = mb_mod.get_annual_mb(h, year=2000)
+        mb_mod.reset_pd_bucket()
+        for yr in [1998, 1999]:
+            mb_mod.get_annual_mb(h, year=yr)
+        assert_allclose(mb_mod.get_annual_mb(h, year=2000), mb_2000_n2)
+
+        # other melt_f -> new entry, the oldest is removed after the size
+        for melt_f in [150, 250]:
+            mb_mod.melt_f = melt_f
+            mb_mod.spinup(h, ys=2000, n_years=5)
+        assert len(mb_mod._spinup_cache) == 2
+
 
 class Test_geodetic_hydro1:
     # classes have to be upper case in order that they
@@ -1031,3 +1222,308 @@ class Test_directobs_hydro10:
     #     yrs = np.arange(100) + 1901
     #     mb = mb_mod.get_specific_mb(h, w, year=yrs)
     #     assert_allclose(mb[50], mb[-50])
+
+
+class Test_multiple_flowline_TIModel:
+    def test_concatenated_flowlines(self, gdir):
+        cfg.PARAMS['hydro_month_nh'] = 1
+        cfg.PARAMS['baseline_climate'] = 'ERA5dr'
+        oggm.shop.ecmwf.process_ecmwf_data(gdir, dataset='ERA5dr',
+                                           output_filesuffix='_monthly_ERA5dr',
+                                           )
+        melt_f = 200
+        fls = gdir.read_pickle('inversion_flowlines')
+        h, w = gdir.get_inversion_flowline_hw()
+        mb_mod = TIModel(gdir, melt_f, mb_type='mb_monthly', prcp_fac=pf,
+                         baseline_climate='ERA5dr')
+        for n_fls in [1, 3]:
+            # repeat the same flowline to get several flowlines
+            # that share the same climate
+            mb = MultipleFlowlineMassBalance_TIModel(gdir, fls=fls * n_fls,
+                                                     melt_f=melt_f,
+                                                     prcp_fac=pf,
+                                                     input_filesuffix='ERA5dr',
+                                                     mb_type='mb_monthly')
+            # only one mb model for all flowlines
+            assert len(mb._fl_groups) == 1
+            heights, widths, mbs = mb.get_annual_mb_on_flowlines(year=2000)
+            assert_allclose(heights, np.tile(h, n_fls))
+            assert_allclose(mbs, np.tile(mb_mod.get_annual_mb(h, year=2000),
+                                         n_fls))
+            years = np.arange(2000, 2010)
+            assert_allclose(mb.get_specific_mb(year=years),
+                            mb_mod.get_specific_mb(heights=h, widths=w,
+                                                   year=years))
+            # temp_bias is only applied once on the shared mb model
+            mb.temp_bias = 1
+            mb.temp_bias = 1
+            assert mb.flowline_mb_models[0].temp_bias == 1
+            mb_mod.temp_bias = 1
+            assert_allclose(mb.get_ela(year=2000),
+                            mb_mod.get_ela(year=2000))
+            mb_mod.temp_bias = 0
+
+    def test_ela_multi_year(self, gdir):
+        cfg.PARAMS['hydro_month_nh'] = 1
+        cfg.PARAMS['baseline_climate'] = 'ERA5dr'
+        oggm.shop.ecmwf.process_ecmwf_data(gdir, dataset='ERA5dr',
+                                           output_filesuffix='_monthly_ERA5dr',
+                                           )
+        years = np.arange(1980, 2019)
+        for mb_type in ['mb_monthly', 'mb_pseudo_daily']:
+            mb_mod = TIModel(gdir, 200, mb_type=mb_type, prcp_fac=pf,
+                             baseline_climate='ERA5dr')
+            elas = mb_mod.get_ela_multi_year(years=years)
+            # same as root finding for each year (with xtol=0.1)
+            elas_brentq = [massbalance.MassBalanceModel.get_ela(mb_mod,
+                                                                year=yr)
+                           for yr in years]
+            assert_allclose(elas, elas_brentq, atol=0.2)
+            assert_allclose(mb_mod.get_ela(year=years), elas)
+
+            h, w = gdir.get_inversion_flowline_hw()
+            mb_multi = mb_mod.get_annual_mb_multi_year(h, years=years)
+            assert_allclose(mb_multi[5], mb_mod.get_annual_mb(h, year=1985))
+
+            fls = gdir.read_pickle('inversion_flowlines')
+            mb = MultipleFlowlineMassBalance_TIModel(gdir, fls=fls,
+                                                     melt_f=200,
+                                                     prcp_fac=pf,
+                                                     input_filesuffix='ERA5dr',
+                                                     mb_type=mb_type)
+            assert_allclose(mb.get_ela(year=years), elas)
+
+
+class Test_random_TIModel:
+    def test_random_mb_pool(self, gdir):
+        cfg.PARAMS['hydro_month_nh'] = 1
+        cfg.PARAMS['baseline_climate'] = 'ERA5dr'
+        oggm.shop.ecmwf.process_ecmwf_data(gdir, dataset='ERA5dr',
+                                           output_filesuffix='_monthly_ERA5dr',
+                                           )
+        h, w = gdir.get_inversion_flowline_hw()
+        mb_mod = TIModel(gdir, 200, mb_type='mb_monthly', prcp_fac=pf,
+                         baseline_climate='ERA5dr')
+        grid = np.arange(1000, 4500, 10)
+        for mb_elev_grid in [None, grid]:
+            rand_mod = RandomMassBalance_TIModel(gdir, melt_f=200,
+                                                 prcp_fac=pf,
+                                                 y0=2000, halfsize=5, seed=0,
+                                                 baseline_climate='ERA5dr',
+                                                 mb_type='mb_monthly',
+                                                 mb_elev_grid=mb_elev_grid)
+            for yr in np.arange(0, 50):
+                ryr = rand_mod.get_state_yr(yr)
+                mb_ref = mb_mod.get_annual_mb(h, year=ryr)
+                if mb_elev_grid is None:
+                    assert_allclose(rand_mod.get_annual_mb(h, year=yr),
+                                    mb_ref)
+                else:
+                    # linear interpolation of the mb on the grid
+                    mb_grid = mb_mod.get_annual_mb(grid, year=ryr)
+                    assert_allclose(rand_mod.get_annual_mb(h, year=yr),
+                                    np.interp(h, grid, mb_grid),
+                                    rtol=1e-10, atol=1e-20)
+                    assert_allclose(rand_mod.get_annual_mb(h, year=yr),
+                                    mb_ref, rtol=1e-2, atol=1e-10)
+                    # exact on (and near) the grid edges
+                    h_edge = np.array([grid[0], grid[0] + 2.5, grid[1],
+                                       grid[-2], grid[-1] - 2.5, grid[-1]])
+                    mb_edge = mb_mod.get_annual_mb(h_edge, year=ryr)
+                    assert_allclose(rand_mod.get_annual_mb(h_edge[[0, 2, 3,
+                                                                   5]],
+                                                           year=yr),
+                                    mb_edge[[0, 2, 3, 5]], rtol=1e-10)
+                    assert_allclose(rand_mod.get_annual_mb(h_edge, year=yr),
+                                    np.interp(h_edge, grid, mb_grid),
+                                    rtol=1e-10)
+            if mb_elev_grid is None:
+                # only the 11 climate years had to be computed
+                assert len(list(rand_mod._mb_pool.values())[0]) <= 11
+            else:
+                # heights outside of the grid are not extrapolated
+                for h_out in [[grid[0] - 1, 2000], [3000, grid[-1] + 1]]:
+                    with pytest.raises(InvalidParamsError):
+                        rand_mod.get_annual_mb(np.array(h_out), year=0)
+            # the pool is recomputed if parameters change
+            rand_mod.temp_bias = 1
+            mb_mod.temp_bias = 1
+            ryr = rand_mod.get_state_yr(0)
+            assert_allclose(rand_mod.get_annual_mb(h, year=0),
+                            mb_mod.get_annual_mb(h, year=ryr), atol=1e-9)
+            mb_mod.temp_bias = 0
+
+    def test_random_state_yrs(self, gdir):
+        cfg.PARAMS['hydro_month_nh'] = 1
+        oggm.shop.ecmwf.process_ecmwf_data(gdir, dataset='ERA5dr',
+                                           output_filesuffix='_monthly_ERA5dr',
+                                           )
+        kwargs = dict(melt_f=200, prcp_fac=pf, y0=2000, halfsize=5,
+                      baseline_climate='ERA5dr', mb_type='mb_monthly')
+        for unique_samples in [False, True]:
+            rand_mod = RandomMassBalance_TIModel(gdir, seed=0, nyears=100,
+                                                 unique_samples=unique_samples,
+                                                 **kwargs)
+            assert len(rand_mod.state_yrs) == 100
+            assert rand_mod.state_yrs.min() >= 1995
+            assert rand_mod.state_yrs.max() <= 2005
+            # same seed gives the same sequence
+            rand_mod2 = RandomMassBalance_TIModel(gdir, seed=0, nyears=100,
+                                                  unique_samples=unique_samples,
+                                                  **kwargs)
+            np.testing.assert_array_equal(rand_mod.state_yrs,
+                                          rand_mod2.state_yrs)
+            # the sequence is extended if needed
+            assert rand_mod.get_state_yr(150) >= 1995
+            assert len(rand_mod.state_yrs) >= 151
+            if unique_samples:
+                # every year once per climate period-length
+                for p in np.arange(0, 143, 11):
+                    _yrs = rand_mod.state_yrs[p:p+11]
+                    np.testing.assert_array_equal(np.sort(_yrs),
+                                                  np.arange(1995, 2006))
+
+            # a sequence starting at another model year
+            rand_mod = RandomMassBalance_TIModel(gdir, seed=0, nyears=100,
+                                                 ys=1000,
+                                                 unique_samples=unique_samples,
+                                                 **kwargs)
+            np.testing.assert_array_equal(rand_mod.state_yrs,
+                                          rand_mod2.state_yrs)
+            assert rand_mod.get_state_yr(1000) == rand_mod2.get_state_yr(0)
+            assert rand_mod.get_state_yr(1099) == rand_mod2.get_state_yr(99)
+            # years before ys (e.g. negative spin-up years) are still valid
+            ryr = rand_mod.get_state_yr(990)
+            assert 1995 <= ryr <= 2005
+            assert rand_mod.ys <= 990
+            # the already drawn years do not change
+            assert rand_mod.get_state_yr(1000) == rand_mod2.get_state_yr(0)
+            assert rand_mod.get_state_yr(990) == ryr
+            ryr = rand_mod2.get_state_yr(-30)
+            assert 1995 <= ryr <= 2005
+            if unique_samples:
+                # the climate periods stay aligned
+                i0 = -rand_mod2.ys
+                for p in np.arange(i0 % 11, i0 + 100 - 11, 11):
+                    _yrs = rand_mod2.state_yrs[p:p+11]
+                    np.testing.assert_array_equal(np.sort(_yrs),
+                                                  np.arange(1995, 2006))
+
+        # spawned seeds give independent and reproducible sequences
+        seeds = spawn_random_mb_seeds(seed=0, n_members=2)
+        seqs = [RandomMassBalance_TIModel(gdir, seed=s, nyears=100,
+                                          **kwargs).state_yrs for s in seeds]
+        assert np.any(seqs[0] != seqs[1])
+        seeds = spawn_random_mb_seeds(seed=0, n_members=2)
+        np.testing.assert_array_equal(
+            seqs[1], RandomMassBalance_TIModel(gdir, seed=seeds[1],
+                                               nyears=100,
+                                               **kwargs).state_yrs)
+
+
+class Test_constant_TIModel:
+    def test_constant_mb_profile(self, gdir):
+        cfg.PARAMS['hydro_month_nh'] = 1
+        oggm.shop.ecmwf.process_ecmwf_data(gdir, dataset='ERA5dr',
+                                           output_filesuffix='_monthly_ERA5dr',
+                                           )
+        h, w = gdir.get_inversion_flowline_hw()
+        mb_mod = TIModel(gdir, 200, mb_type='mb_monthly', prcp_fac=pf,
+                         baseline_climate='ERA5dr')
+        cmb_mod = ConstantMassBalance_TIModel(gdir, melt_f=200, prcp_fac=pf,
+                                              y0=2000, halfsize=5,
+                                              baseline_climate='ERA5dr',
+                                              mb_type='mb_monthly',
+                                              hbins_step=1)
+        years = np.arange(1995, 2006)
+        mb_ref = np.mean([mb_mod.get_annual_mb(h, year=yr) for yr in years],
+                         axis=0)
+        # the same for every year
+        for yr in [0, 1000]:
+            assert_allclose(cmb_mod.get_annual_mb(h, year=yr), mb_ref,
+                            atol=1e-10)
+        # monthly mb sums up to the annual mb
+        mb_m = np.sum([cmb_mod.get_monthly_mb(h, year=date_to_floatyear(0, m))
+                       * mb_mod.SEC_IN_MONTH for m in np.arange(1, 13)],
+                      axis=0)
+        assert_allclose(mb_m, mb_ref * mb_mod.SEC_IN_YEAR, rtol=1e-5)
+        # climate is also averaged
+        out = cmb_mod.get_annual_mb(h, year=0, add_climate=True)
+        assert len(out) == 5
+        assert_allclose(out[0], mb_ref, atol=1e-10)
+        # the profile is recomputed if the mb parameters change
+        cmb_mod.temp_bias = 1
+        mb_mod.temp_bias = 1
+        mb_ref = np.mean([mb_mod.get_annual_mb(h, year=yr) for yr in years],
+                         axis=0)
+        assert_allclose(cmb_mod.get_annual_mb(h, year=0), mb_ref, atol=1e-10)
+
+        # the surface type model can not be averaged to a constant profile
+        with pytest.raises(InvalidParamsError):
+            ConstantMassBalance_TIModel(gdir, melt_f=200, prcp_fac=pf,
+                                        y0=2000, halfsize=5,
+                                        baseline_climate='ERA5dr',
+                                        mb_type='mb_monthly',
+                                        mb_model_sub_class=TIModel_Sfc_Type)
+
+
+class Test_monthly_mb_of_year:
+    def test_monthly_mb_of_year(self, gdir):
+        cfg.PARAMS['hydro_month_nh'] = 1
+        oggm.shop.ecmwf.process_ecmwf_data(gdir, dataset='ERA5dr',
+                                           output_filesuffix='_monthly_ERA5dr',
+                                           )
+        process_era5_daily_data(gdir, output_filesuffix='_daily_ERA5_daily')
+        h, w = gdir.get_inversion_flowline_hw()
+        for mb_type in ['mb_monthly', 'mb_pseudo_daily', 'mb_real_daily']:
+            climate = 'ERA5_daily' if mb_type == 'mb_real_daily' else 'ERA5dr'
+            mb_mod = TIModel(gdir, 200, mb_type=mb_type, prcp_fac=pf,
+                             baseline_climate=climate)
+            out = mb_mod.get_monthly_mb_of_year(h, year=2000,
+                                                add_climate=True)
+            assert out[0].shape == (12, len(h))
+            # the same as calling get_monthly_mb without the memo
+            mb_mod_ref = TIModel(gdir, 200, mb_type=mb_type, prcp_fac=pf,
+                                 baseline_climate=climate)
+            for m in np.arange(1, 13):
+                yrm = date_to_floatyear(2000, m)
+                mb_ref = mb_mod_ref.get_monthly_mb(h, year=yrm)
+                assert_allclose(out[0][m-1], mb_ref, rtol=1e-10, atol=1e-16)
+                # following monthly calls are taken from the memo
+                mb_out = mb_mod.get_monthly_mb(h, year=yrm, add_climate=True)
+                assert_allclose(mb_out[0], mb_ref, rtol=1e-10, atol=1e-16)
+                assert_allclose(mb_out[3], out[3][m-1])
+                assert_allclose(mb_out[4], out[4][m-1])
+            assert len(mb_mod._monthly_mb_memo) == 1
+            # sum of the months is similar to the annual mb
+            assert_allclose(np.sum(out[4], axis=0),
+                            mb_mod.get_annual_climate(h, year=2000)[3])
+            # the memo is not used anymore if the mb params change
+            mb_mod.temp_bias = 1
+            mb_mod_ref.temp_bias = 1
+            yrm = date_to_floatyear(2000, 7)
+            assert_allclose(mb_mod.get_monthly_mb(h, year=yrm,
+                                                  add_climate=True)[0],
+                            mb_mod_ref.get_monthly_mb(h, year=yrm),
+                            rtol=1e-10, atol=1e-16)
+
+    def test_monthly_mb_memo_not_changed(self, gdir):
+        cfg.PARAMS['hydro_month_nh'] = 1
+        oggm.shop.ecmwf.process_ecmwf_data(gdir, dataset='ERA5dr',
+                                           output_filesuffix='_monthly_ERA5dr',
+                                           )
+        h, w = gdir.get_inversion_flowline_hw()
+        mb_mod = TIModel(gdir, 200, mb_type='mb_monthly', prcp_fac=pf)
+        yrm = date_to_floatyear(2000, 7)
+        out = mb_mod.get_monthly_mb(h, year=yrm, add_climate=True)
+        mb_ref, prcp_ref = out[0].copy(), out[3].copy()
+        # changing the returned arrays in place ...
+        out[0][:] = 0
+        out[3] *= 2
+        # ... does not change the values from the memo
+        out = mb_mod.get_monthly_mb(h, year=yrm, add_climate=True)
+        assert_allclose(out[0], mb_ref)
+        assert_allclose(out[3], prcp_ref)
+        mb = mb_mod.get_monthly_mb(h, year=yrm)
+        mb[:] = 0
+        assert_allclose(mb_mod.get_monthly_mb(h, year=yrm), mb_ref)
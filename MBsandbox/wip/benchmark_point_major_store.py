@@ -0,0 +1,59 @@
+# Benchmark of the per-glacier extraction of the flattened daily climate
+# data, once from the original file and once from the point-major store
+# (see convert_to_point_major_store)
+#
+# usage: python benchmark_point_major_store.py n_glaciers dataset var
+# e.g. python benchmark_point_major_store.py 100 W5E5_daily tmp
+
+import sys
+import time
+import numpy as np
+import xarray as xr
+
+from oggm import cfg, utils
+
+from MBsandbox.mbmod_daily_oneflowline import (get_w5e5_file,
+                                               convert_to_point_major_store,
+                                               get_point_major_store,
+                                               _sel_nearest_point)
+
+n_glaciers = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+dataset = str(sys.argv[2]) if len(sys.argv) > 2 else 'W5E5_daily'
+var = str(sys.argv[3]) if len(sys.argv) > 3 else 'tmp'
+
+cfg.initialize(logging_level='WARNING')
+cfg.PATHS['working_dir'] = utils.gettempdir(dirname='MBsandbox_benchmark')
+
+path = get_w5e5_file(dataset, var)
+
+# random "glaciers" at the grid points of the dataset
+with xr.open_dataset(path) as ds:
+    rng = np.random.default_rng(0)
+    points = rng.choice(ds.sizes['points'], size=n_glaciers, replace=False)
+    lons = ds.longitude.values[points]
+    lats = ds.latitude.values[points]
+
+
+def extract_all(fpath):
+    """ time (in s) per glacier to extract the whole time series """
+    with xr.open_dataset(fpath) as ds:
+        # the nearest point search (KD-tree) is not part of the benchmark
+        _sel_nearest_point(ds, lons[0], lats[0])
+        t0 = time.time()
+        for lon, lat in zip(lons, lats):
+            _sel_nearest_point(ds, lon, lat).load()
+    return (time.time() - t0) / n_glaciers
+
+
+t_before = extract_all(path)
+print('original file: {:.4f} s per glacier'.format(t_before))
+
+if get_point_major_store(path) == path:
+    t0 = time.time()
+    convert_to_point_major_store(path)
+    print('conversion (only once): {:.1f} s'.format(time.time() - t0))
+store = get_point_major_store(path)
+
+t_after = extract_all(store)
+print('point-major store: {:.4f} s per glacier'.format(t_after))
+print('speed-up: {:.1f}x'.format(t_before / t_after))
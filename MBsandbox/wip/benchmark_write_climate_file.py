@@ -0,0 +1,69 @@
+# Benchmark of the write throughput of write_climate_file for daily climate
+# series (default options against the faster writing options)
+#
+# usage: python benchmark_write_climate_file.py n_files n_days
+# e.g. python benchmark_write_climate_file.py 200 15000
+
+import os
+import sys
+import time
+import numpy as np
+import pandas as pd
+
+from oggm import cfg, utils
+
+from MBsandbox.mbmod_daily_oneflowline import write_climate_file
+
+n_files = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+n_days = int(sys.argv[2]) if len(sys.argv) > 2 else 15000
+
+cfg.initialize(logging_level='WARNING')
+out_dir = utils.gettempdir(dirname='MBsandbox_benchmark_write')
+utils.mkdir(out_dir)
+
+
+class _BenchmarkGlacier(object):
+    """ only what write_climate_file needs from a glacier directory """
+    cenlon = 10.7584
+    cenlat = 46.8003
+
+    def get_filepath(self, filename, filesuffix=''):
+        return os.path.join(out_dir, filename + filesuffix + '.nc')
+
+
+gdir = _BenchmarkGlacier()
+
+# synthetic daily climate series of full years
+time_d = pd.date_range('1979-01-01', periods=n_days, freq='D')
+time_d = time_d[time_d < pd.Timestamp('{}-01-01'.format(time_d[-1].year))]
+rng = np.random.default_rng(0)
+temp = rng.normal(0, 8, len(time_d))
+prcp = rng.gamma(0.5, 6, len(time_d))
+gradient = rng.normal(-0.0065, 0.001, len(time_d))
+
+
+def write_all(**kwargs):
+    """ time (in s) per file and file size (in MB) """
+    t0 = time.time()
+    for i in range(n_files):
+        write_climate_file(gdir, time_d, prcp, temp, 2500., 10.75, 46.75,
+                           gradient=gradient, source='W5E5_daily',
+                           filesuffix='_daily_benchmark',
+                           temporal_resol='daily', **kwargs)
+    dt = (time.time() - t0) / n_files
+    size = os.path.getsize(gdir.get_filepath('climate_historical',
+                                             filesuffix='_daily_benchmark'))
+    return dt, size / 1e6
+
+
+print('{} files with {} daily time steps'.format(n_files, len(time_d)))
+t_default, _ = write_all()
+for name, kwargs in [('default', dict()),
+                     ('no compression', dict(complevel=0)),
+                     ('complevel=1', dict(complevel=1)),
+                     ('complevel=1, buffered', dict(complevel=1,
+                                                    buffered=True))]:
+    dt, size = write_all(**kwargs)
+    print('{:<25}: {:.4f} s per file ({:.0f} files/s, {:.2f} MB, '
+          'speed-up: {:.1f}x)'.format(name, dt, 1 / dt, size,
+                                      t_default / dt))
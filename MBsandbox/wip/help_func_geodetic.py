@@ -18,7 +18,9 @@ from MBsandbox.mbmod_daily_oneflowline import (process_era5_daily_data, TIModel,
 from MBsandbox.help_func import (compute_stat, minimize_bias,
                                  optimize_std_quot_brentq)
 
-from MBsandbox.help_func import minimize_bias_geodetic, optimize_std_quot_brentq_geod
+from MBsandbox.help_func import (minimize_bias_geodetic,
+                                 optimize_std_quot_brentq_geod,
+                                 calibrate_melt_f_geodetic)
 
 
 def get_opt_pf_melt_f(gd, mb_type='mb_monthly', grad_type='cte',
@@ -109,11 +111,9 @@ def get_opt_pf_melt_f(gd, mb_type='mb_monthly', grad_type='cte',
                 # except:
                 #    pf_opt = 2.5
 
-        melt_f_opt_pf = scipy.optimize.brentq(minimize_bias_geodetic, 1, 10000,
-                                              xtol=0.01, args=(gd_mb,
-                                                               mb_geodetic,
-                                                               h, w, pf_opt),
-                                              disp=True)
+        melt_f_opt_pf = calibrate_melt_f_geodetic(gd_mb, mb_geodetic, h, w,
+                                                  pf_opt, melt_f_max=10000,
+                                                  xtol=0.01)
         gd_mb.melt_f = melt_f_opt_pf
         gd_mb.prcp_fac = pf_opt
         mb_specific_optstd = gd_mb.get_specific_mb(heights=h,
@@ -263,10 +263,9 @@ def get_opt_pf_melt_f_above2000(gd, mb_type='mb_monthly', grad_type='cte',
                                            w, ys_glac[ys_glac >= 2000]),
                                        disp=True)
 
-        melt_f_opt_pf = scipy.optimize.brentq(minimize_bias_geodetic, 1, 10000,
-                                              xtol=0.01, args=(
-                gd_mb, mb_geodetic, h, w, pf_opt),
-                                              disp=True)
+        melt_f_opt_pf = calibrate_melt_f_geodetic(gd_mb, mb_geodetic, h, w,
+                                                  pf_opt, melt_f_max=10000,
+                                                  xtol=0.01)
         gd_mb.melt_f = melt_f_opt_pf
         gd_mb.prcp_fac = pf_opt
         mb_specific_optstd = gd_mb.get_specific_mb(heights=h,
@@ -0,0 +1,20 @@
+# Downloads all files of the daily climate datasets into the OGGM download
+# cache before running the tasks (see prefetch_climate_files)
+#
+# usage: python prefetch_climate_files.py [dataset ...]
+# e.g. python prefetch_climate_files.py W5E5_daily ERA5dr
+
+import sys
+
+from oggm import cfg
+
+from MBsandbox.mbmod_daily_oneflowline import prefetch_climate_files
+
+cfg.initialize(logging_level='WARNING')
+
+datasets = sys.argv[1:] if len(sys.argv) > 1 else ['ERA5_daily',
+                                                   'WFDE5_CRU_daily',
+                                                   'W5E5_daily']
+paths = prefetch_climate_files(datasets=datasets)
+for (dataset, var), path in paths.items():
+    print('{} {}: {}'.format(dataset, var, path))
@@ -20,12 +20,14 @@ import oggm
 from oggm import cfg, utils, workflow, tasks, graphics
 from oggm.core import massbalance, flowline
 from oggm import entity_task
+from oggm.utils._workflow import global_task
 
 from oggm.core.flowline import FileModel
 # import aesara.tensor as aet
 # import aesara
 
 from oggm.exceptions import InvalidParamsError, InvalidWorkflowError
+from oggm.utils import ncDataset
 from oggm.cfg import SEC_IN_YEAR, SEC_IN_MONTH, SEC_IN_DAY
 import warnings
 # from drounce_analyze_mcmc import effective_n, mcse_batchmeans
@@ -49,7 +51,8 @@ from oggm.shop.gcm_climate import process_gcm_data
 from oggm.core.flowline import flowline_model_run
 from oggm.core.massbalance import MultipleFlowlineMassBalance, MassBalanceModel
 from oggm.core import climate
-from MBsandbox.mbmod_daily_oneflowline import write_climate_file
+from MBsandbox.mbmod_daily_oneflowline import write_climate_file, \
+    append_climate_file, nearest_flat_point_index
 from MBsandbox.flowline_TIModel import run_from_climate_data_TIModel
 from MBsandbox.wip.bayes_calib_geod_direct import bayes_dummy_model_better
 
@@ -162,6 +165,147 @@ def inversion_and_run_from_climate_with_bayesian_mb_params(gdir, a_factor=1,
     print('succesfully projected: {}'.format(gdir.rgi_id))
 
 
+def _running_mean(x, n_before, n_after):
+    """ running mean along the first axis over the elements
+    -n_before ... +n_after around each element (fewer at the start and end
+    of x), NaNs are ignored. Computed with cumulative sums.
+    """
+    x = np.asarray(x, dtype=np.float64)
+    n = x.shape[0]
+    valid = np.isfinite(x)
+    csum = np.zeros((n + 1,) + x.shape[1:])
+    csum[1:] = np.cumsum(np.where(valid, x, 0), axis=0)
+    ccount = np.zeros((n + 1,) + x.shape[1:])
+    ccount[1:] = np.cumsum(valid, axis=0)
+    j = np.arange(n)
+    lo = np.clip(j - n_before, 0, n)
+    hi = np.clip(j + n_after + 1, 0, n)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return (csum[hi] - csum[lo]) / (ccount[hi] - ccount[lo])
+
+
+def running_mean_of_months(x, half_window):
+    """ centered running mean over the same month of the surrounding years
+
+    Parameters
+    ----------
+    x : np.array
+        monthly time series of full years, with shape (years, 12)
+    half_window : int
+        the mean is computed over the same month of the years
+        -half_window ... +half_window around each year. At the start and end
+        of the time series, only the available years are used. NaNs are
+        ignored (as np.nanmean)
+
+    Returns
+    -------
+    np.array with the shape of x
+
+    Computed with cumulative sums, i.e. linear in the length of the time
+    series (independent of the window size).
+    """
+    return _running_mean(x, half_window, half_window)
+
+
+def _scale_stddev_rolling(ts, std_fac, n_years_ref, validate=False):
+    """ scales the interannual variability of a monthly time series
+    (same as Zekollari 2019, eq. 2, but with a centered running mean over
+    n_years_ref + 1 years of every month instead of a constant mean)
+
+    ts is a xr.DataArray of full years, std_fac the factor of every time
+    step. If validate, the result is checked against the (much slower)
+    xarray rolling window implementation.
+    """
+    x = ts.values.reshape(-1, 12)
+    xm = running_mean_of_months(x, n_years_ref // 2)
+    out = ts.copy(data=(xm + (x - xm) * std_fac.reshape(-1, 12)).ravel())
+
+    if validate:
+        def roll_func(x, axis=None):
+            x = x[:, ::12]
+            n = len(x[0, :]) // 2
+            xm = np.nanmean(x, axis=axis)
+            return xm + (x[:, n] - xm) * std_fac
+
+        win_size = 12 * n_years_ref + 1
+        out_test = ts.rolling(time=win_size, center=True,
+                              min_periods=1).reduce(roll_func)
+        np.testing.assert_allclose(out, out_test, rtol=1e-5)
+    return out
+
+
+_doc = ('statistics of the historical climate (over a year range) that the '
+        'anomaly method of the GCM processing needs')
+cfg.BASENAMES['climate_historical_stats'] = ('climate_historical_stats.json',
+                                             _doc)
+
+
+def _get_climobs_stats(gdir, climate_historical_filesuffix='',
+                       year_range=('1979', '2014'), group='month',
+                       reset=False):
+    """ statistics of the historical climate that the anomaly method needs
+
+    The statistics are computed once and then stored in the glacier
+    directory (climate_historical_stats), i.e. later GCM processing calls
+    only read this small table instead of the whole climate_historical
+    file. They are recomputed if the climate_historical file changed.
+
+    Parameters
+    ----------
+    gdir : :py:class:`oggm.GlacierDirectory`
+        the glacier directory with the climate_historical file
+    climate_historical_filesuffix : str
+        filesuffix of the historical climate dataset
+    year_range : tuple of str
+        the year range over which the statistics are computed
+    group : str
+        'month' or 'dayofyear'
+    reset : bool
+        recompute the statistics even if they are stored
+
+    Returns
+    -------
+    pd.DataFrame indexed by the month (or day of year) with the mean
+    (`{var}_mean`) and the interannual standard deviation (`{var}_stddev`)
+    of temp, temp_std, prcp and gradient (if they are in the file), the
+    amount of time steps (`n`) and the reference height (`ref_hgt`)
+    """
+    fpath = gdir.get_filepath('climate_historical',
+                              filesuffix=climate_historical_filesuffix)
+    fs = '{}_{}_{}_{}'.format(climate_historical_filesuffix, group,
+                              *year_range)
+    # the stored statistics are only valid for the same climate file
+    stat = os.stat(fpath)
+    source = [stat.st_size, stat.st_mtime]
+    if not reset and gdir.has_file('climate_historical_stats', filesuffix=fs):
+        d = gdir.read_json('climate_historical_stats', filesuffix=fs)
+        if d['source'] == source:
+            return pd.DataFrame(d['stats'],
+                                index=pd.Index(d['index'], name=group))
+
+    with xr.open_dataset(fpath, use_cftime=True) as ds:
+        ds = ds.sel(time=slice(*year_range)).load()
+    groups = ds['time.{}'.format(group)].values
+    index = np.unique(groups)
+    stats = pd.DataFrame(index=pd.Index(index, name=group))
+    stats['n'] = [np.sum(groups == g) for g in index]
+    for var in ['temp', 'temp_std', 'prcp', 'gradient']:
+        if var not in ds:
+            continue
+        x = ds[var].values
+        # same as xarray's groupby mean and std (skipna, ddof=0)
+        stats[var + '_mean'] = [np.nanmean(x[groups == g]) for g in index]
+        stats[var + '_stddev'] = [np.nanstd(x[groups == g]) for g in index]
+    stats['ref_hgt'] = float(ds.ref_hgt)
+
+    gdir.write_json({'source': source,
+                     'index': [int(i) for i in stats.index],
+                     'stats': {col: [float(v) for v in stats[col]]
+                               for col in stats.columns}},
+                    'climate_historical_stats', filesuffix=fs)
+    return stats
+
+
 @entity_task(log, writes=['gcm_data'])
 def process_gcm_data_adv_monthly(gdir, output_filesuffix='', prcp=None,
                                  temp=None,
@@ -169,7 +313,7 @@ def process_gcm_data_adv_monthly(gdir, output_filesuffix='', prcp=None,
                                  year_range=('1979', '2014'), scale_stddev=True,
                                  time_unit=None, calendar=None, source='',
                                  climate_historical_filesuffix='',
-                                 correct=True):
+                                 correct=True, validate_stddev_scaling=False):
     """ TODO: adapt ...Applies the anomaly method to GCM climate data
 
     This function can be applied to any GCM data, if it is provided in a
@@ -216,6 +360,10 @@ def process_gcm_data_adv_monthly(gdir, output_filesuffix='', prcp=None,
     climate_historical_filesuffix : str
         filesuffix of historical climate dataset that should be used to
         apply the anomaly method
+    validate_stddev_scaling : bool
+        if True, the scaling of the standard deviation (scale_stddev) is
+        checked against the xarray rolling window implementation (slow, the
+        default is False)
     """
 
     # Standard sanity checks
@@ -245,13 +393,11 @@ def process_gcm_data_adv_monthly(gdir, output_filesuffix='', prcp=None,
     assert np.all(temp_std>=0)
     assert np.all(prcp>=0)
 
-    # Get historical_climate to apply the anomaly to
-    fpath = gdir.get_filepath('climate_historical',
-                              filesuffix=climate_historical_filesuffix)
-    ds_climobs = xr.open_dataset(fpath, use_cftime=True)
-
-    # Add climobs (or the defined climate from above...) clim
-    dsclimobs = ds_climobs.sel(time=slice(*year_range))
+    # Get the monthly statistics of historical_climate to apply the
+    # anomaly to (only computed once, see _get_climobs_stats)
+    climobs = _get_climobs_stats(
+        gdir, climate_historical_filesuffix=climate_historical_filesuffix,
+        year_range=year_range).to_xarray()
 
     # compute monthly anomalies
     # of temp
@@ -261,8 +407,7 @@ def process_gcm_data_adv_monthly(gdir, output_filesuffix='', prcp=None,
             ts_tmp_sel = temp.sel(time=slice(*year_range))
             ts_tmp_std = ts_tmp_sel.groupby('time.month').std(dim='time')
             # observed/gcm
-            std_fac = dsclimobs.temp.groupby('time.month').std(
-                dim='time') / ts_tmp_std
+            std_fac = climobs.temp_stddev / ts_tmp_std
             # if sm =1, this just changes nothing as it should
             assert np.all(std_fac == std_fac.roll(month=13 - sm,
                                                   roll_coords=True))
@@ -272,55 +417,23 @@ def process_gcm_data_adv_monthly(gdir, output_filesuffix='', prcp=None,
             if ((len(ts_tmp_sel) // 12) % 2) == 1:
                 raise InvalidParamsError('We need an even number of years '
                                          'for this to work')
-            win_size = len(ts_tmp_sel) + 1
-
-            def roll_func(x, axis=None):
-                x = x[:, ::12]
-                n = len(x[0, :]) // 2
-                # print(n)
-                xm = np.nanmean(x, axis=axis)
-                return xm + (x[:, n] - xm) * std_fac
+            # running mean of every month over the amount of years of
+            # year_range (+1, centered)
+            n_years_ref = len(ts_tmp_sel) // 12
+            temp = _scale_stddev_rolling(temp, std_fac, n_years_ref,
+                                         validate=validate_stddev_scaling)
 
-            # a little bit slower but more comprehensible
-            temp_test = temp.copy()
-            aoy_sel = len(ts_tmp_sel.groupby('time.year').mean())
-            for m in np.arange(0, 12):
-                # at the first / last years less observation over which mean is
-                # made but I guess this does not matter (otherwise it would be nan)
-                x = temp[temp.time.dt.month == m + 1].copy()
-                xm = x.rolling(time=aoy_sel, center=True, min_periods=1).mean()
-                # same as in Zekollari 2019, eq. 2, but mean over aoy_sel years
-                # instead
-                temp_test[temp.time.dt.month == m + 1] = xm + (x - xm) * \
-                                                         std_fac[m]
-
-            temp = temp.rolling(time=win_size, center=True,
-                                min_periods=1).reduce(roll_func)
-
-            np.testing.assert_allclose(temp, temp_test, rtol=1e-2)  # -3
             ### do the same for daily temp std
             ts_tmpdstd_sel = temp_std.sel(time=slice(*year_range))
             ts_tmpdstd_std = ts_tmpdstd_sel.groupby('time.month').std(
                 dim='time')
-            tmpdstd_std_fac = dsclimobs.temp_std.groupby('time.month').std(
-                dim='time') / ts_tmpdstd_std
+            tmpdstd_std_fac = climobs.temp_std_stddev / ts_tmpdstd_std
             tmpdstd_std_fac = tmpdstd_std_fac.roll(month=13 - sm,
                                                    roll_coords=True)
             tmpdstd_std_fac = np.tile(tmpdstd_std_fac.data, len(temp_std) // 12)
-            # We need an even number of years for this to work
-            if ((len(ts_tmp_sel) // 12) % 2) == 1:
-                raise InvalidParamsError('We need an even number of years '
-                                         'for this to work')
-            win_size = len(ts_tmpdstd_sel) + 1
-
-            def roll_func_std(x, axis=None):
-                x = x[:, ::12]
-                n = len(x[0, :]) // 2
-                xm = np.nanmean(x, axis=axis)
-                return xm + (x[:, n] - xm) * tmpdstd_std_fac
-
-            temp_std = temp_std.rolling(time=win_size, center=True,
-                                        min_periods=1).reduce(roll_func_std)
+            temp_std = _scale_stddev_rolling(
+                temp_std, tmpdstd_std_fac, len(ts_tmpdstd_sel) // 12,
+                validate=validate_stddev_scaling)
             # this can result in very rare cases too negative temp_std values
             # Clip them
             #TODO: think about a better solution!!!
@@ -333,7 +446,7 @@ def process_gcm_data_adv_monthly(gdir, output_filesuffix='', prcp=None,
 
 
         ts_tmp_sel = temp.sel(time=slice(*year_range))
-        assert len(ts_tmp_sel) == len(dsclimobs.time)
+        assert len(ts_tmp_sel) == int(climobs.n.sum())
         ts_tmp_avg = ts_tmp_sel.groupby('time.month').mean(dim='time')
         ts_tmp = temp.groupby('time.month') - ts_tmp_avg
         # of precip -- scaled anomalies
@@ -350,15 +463,15 @@ def process_gcm_data_adv_monthly(gdir, output_filesuffix='', prcp=None,
         ts_dstdtmp = temp_std.groupby('time.month') - ts_dstdtmp_avg
 
         # for temp
-        loc_tmp = dsclimobs.temp.groupby('time.month').mean()
+        loc_tmp = climobs.temp_mean
         ts_tmp = ts_tmp.groupby('time.month') + loc_tmp
 
         # for temp daily std
-        loc_dstdtmp = dsclimobs.temp_std.groupby('time.month').mean()
+        loc_dstdtmp = climobs.temp_std_mean
         ts_dstdtmp = ts_dstdtmp.groupby('time.month') + loc_dstdtmp
 
         # for prcp
-        loc_pre = dsclimobs.prcp.groupby('time.month').mean()
+        loc_pre = climobs.prcp_mean
         # scaled anomalies
         ts_pre = ts_pre.groupby('time.month') * loc_pre
         # standard anomalies
@@ -396,7 +509,7 @@ def process_gcm_data_adv_monthly(gdir, output_filesuffix='', prcp=None,
 
     # for gradient
     # try:
-    hist_gradient = dsclimobs.gradient.groupby('time.month').mean().values
+    hist_gradient = climobs.gradient_mean.values
     # use the same gradient for every year
     # may be this could be done differently to save data...
     # print(hist_gradient)
@@ -413,7 +526,7 @@ def process_gcm_data_adv_monthly(gdir, output_filesuffix='', prcp=None,
     # print(time_unit, calendar)
     write_climate_file(gdir, temp.time.values,
                        ts_pre.values, ts_tmp.values,
-                       float(dsclimobs.ref_hgt),
+                       float(climobs.ref_hgt[0]),
                        prcp.lon.values, prcp.lat.values,
                        time_unit=time_unit,
                        calendar=calendar,
@@ -425,7 +538,194 @@ def process_gcm_data_adv_monthly(gdir, output_filesuffix='', prcp=None,
                        temp_std=ts_dstdtmp.values,
                        temporal_resol='monthly')
 
-    ds_climobs.close()
+
+def _read_segments(segments, i0, i1=None):
+    """ values of the time steps i0:i1 (or of the time steps i0 if it is an
+    array) of a time series given as consecutive (lazily loaded) pieces """
+    out = []
+    start = 0
+    for seg in segments:
+        n = seg.sizes['time']
+        if i1 is None:
+            pos = i0[(i0 >= start) & (i0 < start + n)] - start
+            if len(pos) > 0:
+                out.append(seg.isel(time=pos).values)
+        else:
+            a, b = max(i0 - start, 0), min(i1 - start, n)
+            if a < b:
+                out.append(seg.isel(time=slice(a, b)).values)
+        start += n
+    if len(out) == 0:
+        return np.array([])
+    return np.concatenate(out).astype(np.float64)
+
+
+def _stat_of_doys(x, doys, func=np.nanmean):
+    """ statistic (func) of every day of year (1-366) of x, NaN for days
+    of year that do not exist """
+    out = np.full(366, np.NaN)
+    for d in np.unique(doys):
+        out[d - 1] = func(x[doys == d])
+    return out
+
+
+def _process_gcm_data_adv_daily_chunked(gdir, output_filesuffix='',
+                                        prcp=None, temp=None,
+                                        year_range=('1979', '2014'),
+                                        scale_stddev=True, time_unit=None,
+                                        calendar=None, source='',
+                                        climate_historical_filesuffix='',
+                                        correct=True, chunk_years=10):
+    """ process_gcm_data_adv_daily, but streamed in chunks of years
+
+    First, the correction factors of every day of year are computed, for
+    which only year_range (and the years around it that are needed for the
+    running means of the std scaling) is read. Then the time series are
+    read, corrected and appended to the gcm_data file in chunks of
+    chunk_years years (plus the years needed for the running means). The
+    memory usage is therefore set by year_range and chunk_years, not by
+    the length of the time series.
+
+    The std scaling uses, as in process_gcm_data_adv_daily, a running mean
+    over the same day of year of the surrounding aoy_sel values. The days
+    of year that not every year has (i.e. the 366th day) are few, they are
+    read and scaled at once beforehand.
+
+    prcp and temp are DataArrays or lists of consecutive DataArrays (e.g.
+    [historical, ssp]), see process_gcm_data_adv_daily for the other
+    parameters.
+    """
+    temp = list(temp) if isinstance(temp, (list, tuple)) else [temp]
+    prcp = list(prcp) if isinstance(prcp, (list, tuple)) else [prcp]
+    time = np.concatenate([seg.time.values for seg in temp])
+    assert len(time) == sum(seg.sizes['time'] for seg in prcp)
+    tda = xr.DataArray(time, dims='time')
+    months = tda.dt.month.values
+    doys = tda.dt.dayofyear.values
+    years = tda.dt.year.values
+
+    # Standard sanity checks that this is really daily
+    if months[0] != 1:
+        raise ValueError('We expect the files to start in January!')
+    if doys[0] != 1:
+        raise ValueError('We expect the files to start on first day of year!')
+    if doys[-1] < 365:
+        raise ValueError('We expect the files to end on last day of year!')
+    if months[-1] < 10:
+        raise ValueError('We expect the files to end in December!')
+    lon, lat = float(prcp[0]['lon']), float(prcp[0]['lat'])
+    if (np.abs(temp[0]['lon']) > 180) or (np.abs(lon) > 180):
+        raise ValueError('We expect the longitude coordinates to be within '
+                         '[-180, 180].')
+    sm = cfg.PARAMS['hydro_month_' + gdir.hemisphere]
+    if sm != 1:
+        raise NotImplementedError('this works at the moment only for '
+                                  'hydro_month=1')
+
+    # first (and last) time step of every year
+    uyears, ystart = np.unique(years, return_index=True)
+    n_years = len(uyears)
+    yend = np.append(ystart[1:], len(time))
+    yidx = np.searchsorted(uyears, years)
+
+    climobs = _get_climobs_stats(
+        gdir, climate_historical_filesuffix=climate_historical_filesuffix,
+        year_range=year_range, group='dayofyear')
+    ref_hgt = float(climobs['ref_hgt'].iloc[0])
+    climobs = climobs.reindex(np.arange(1, 367))
+    hist_gradient = None
+    if 'gradient_mean' in climobs:
+        # the same mean annual cycle of the gradient for every year
+        hist_gradient = climobs['gradient_mean'].values
+
+    if correct:
+        ysel = np.flatnonzero((uyears >= int(year_range[0])) &
+                              (uyears <= int(year_range[-1])))
+        i_sel0, i_sel1 = ystart[ysel[0]], yend[ysel[-1]]
+        assert i_sel1 - i_sel0 == climobs['n'].sum()
+        doys_sel = doys[i_sel0:i_sel1]
+        # amount of years of the running mean (as for the rolling window of
+        # process_gcm_data_adv_daily with center=True)
+        aoy_sel = len(ysel)
+        n_before = aoy_sel // 2
+        n_after = aoy_sel - n_before - 1
+
+        if scale_stddev:
+            ts_tmp_std = _stat_of_doys(_read_segments(temp, i_sel0, i_sel1),
+                                       doys_sel, np.nanstd)
+            # corresponds to phi_daily in Zekollari (2019, eq. 2)
+            std_fac = climobs['temp_stddev'].values / ts_tmp_std
+            # days of year that not all years have, scaled at once
+            count = np.bincount(doys, minlength=367)[1:]
+            sparse = np.flatnonzero((count > 0) & (count < n_years)) + 1
+            sparse_pos = np.flatnonzero(np.isin(doys, sparse))
+            sparse_val = np.zeros(len(sparse_pos))
+            x_sparse = _read_segments(temp, sparse_pos)
+            for d in sparse:
+                m = doys[sparse_pos] == d
+                xm = _running_mean(x_sparse[m], n_before, n_after)
+                sparse_val[m] = xm + (x_sparse[m] - xm) * std_fac[d - 1]
+
+        def get_temp(ya, yb):
+            """ (scaled) temperature of the years ya:yb """
+            if not scale_stddev:
+                return _read_segments(temp, ystart[ya], yend[yb - 1])
+            # with the years that are needed for the running mean
+            ha, hb = max(ya - n_before, 0), min(yb + n_after, n_years)
+            i0, i1 = ystart[ha], yend[hb - 1]
+            rows, cols = yidx[i0:i1] - ha, doys[i0:i1] - 1
+            x = np.full((hb - ha, 366), np.NaN)
+            x[rows, cols] = _read_segments(temp, i0, i1)
+            xm = _running_mean(x, n_before, n_after)
+            out = (xm + (x - xm) * std_fac)[rows, cols]
+            pos = np.arange(i0, i1)
+            m = np.isin(pos, sparse_pos)
+            out[m] = sparse_val[np.searchsorted(sparse_pos, pos[m])]
+            return out[ystart[ya] - i0:yend[yb - 1] - i0]
+
+        # the correction of every day of year
+        ts_tmp_avg = _stat_of_doys(get_temp(ysel[0], ysel[-1] + 1),
+                                   doys_sel)
+        ts_pre_avg = _stat_of_doys(_read_segments(prcp, i_sel0, i_sel1),
+                                   doys_sel)
+        loc_tmp = climobs['temp_mean'].values
+        loc_pre = climobs['prcp_mean'].values
+    else:
+        # do no correction at all (!!! only for testing)
+        output_filesuffix = output_filesuffix + '_no_correction'
+        source = output_filesuffix + '_no_correction'
+
+    for ya in range(0, n_years, chunk_years):
+        yb = min(ya + chunk_years, n_years)
+        i0, i1 = ystart[ya], yend[yb - 1]
+        d = doys[i0:i1] - 1
+        ts_pre = _read_segments(prcp, i0, i1)
+        if correct:
+            ts_tmp = get_temp(ya, yb) - ts_tmp_avg[d] + loc_tmp[d]
+            # scaled anomalies, standard anomalies where these are infinite
+            with np.errstate(divide='ignore', invalid='ignore'):
+                ts_pre_sc = ts_pre / ts_pre_avg[d] * loc_pre[d]
+            ts_pre = np.where(np.isfinite(ts_pre_sc), ts_pre_sc,
+                              ts_pre - ts_pre_avg[d] + loc_pre[d])
+            # The previous step might create negative values. Clip them
+            ts_pre = utils.clip_min(ts_pre, 0)
+            # check again that the correction went well
+            assert np.all(np.isfinite(ts_pre))
+            assert np.all(np.isfinite(ts_tmp))
+        else:
+            ts_tmp = _read_segments(temp, i0, i1) - 273.15
+
+        write_func = write_climate_file if ya == 0 else append_climate_file
+        kwargs = dict(time_unit=time_unit, calendar=calendar) if ya == 0 \
+            else dict()
+        write_func(gdir, time[i0:i1], ts_pre, ts_tmp, ref_hgt, lon, lat,
+                   file_name='gcm_data',
+                   source=source + '_historical{}'.format(
+                       climate_historical_filesuffix),
+                   filesuffix=output_filesuffix,
+                   gradient=None if hist_gradient is None
+                   else hist_gradient[d],
+                   temporal_resol='daily', **kwargs)
 
 
 @entity_task(log, writes=['gcm_data'])
@@ -435,7 +735,7 @@ def process_gcm_data_adv_daily(gdir, output_filesuffix='', prcp=None,
                                scale_stddev=True,
                                time_unit=None, calendar=None, source='',
                                climate_historical_filesuffix='',
-                               correct=True):
+                               correct=True, chunk_years=None):
     """ Applies the anomaly method to daily GCM climate data
 
     This function can be applied to any GCM data, if it is provided in a
@@ -479,8 +779,24 @@ def process_gcm_data_adv_daily(gdir, output_filesuffix='', prcp=None,
     climate_historical_filesuffix : str
         filesuffix of historical climate dataset that should be used to
         apply the anomaly method
+    chunk_years : int
+        if given, the time series are processed in chunks of chunk_years
+        years and every chunk is directly written into (appended to) the
+        gcm_data file, i.e. the series are never loaded as a whole (see
+        _process_gcm_data_adv_daily_chunked). prcp and temp can then also
+        be lists of consecutive (lazily loaded) pieces of the time series,
+        e.g. [historical, ssp]. The result is the same. Default is None
+        (everything is processed at once)
     """
 
+    if chunk_years is not None:
+        return _process_gcm_data_adv_daily_chunked(
+            gdir, output_filesuffix=output_filesuffix, prcp=prcp, temp=temp,
+            year_range=year_range, scale_stddev=scale_stddev,
+            time_unit=time_unit, calendar=calendar, source=source,
+            climate_historical_filesuffix=climate_historical_filesuffix,
+            correct=correct, chunk_years=chunk_years)
+
     # Standard sanity checks that this is really daily
     months = temp['time.month']
     if months[0] != 1:
@@ -512,14 +828,12 @@ def process_gcm_data_adv_daily(gdir, output_filesuffix='', prcp=None,
     # assert len(temp) // 12 == len(
     #    temp) / 12, 'Somehow we didn\'t get full years'
 
-    # Get historical_climate to apply the anomaly to
-    fpath = gdir.get_filepath('climate_historical',
-                              filesuffix=climate_historical_filesuffix)
-    ds_climobs = xr.open_dataset(fpath, use_cftime=True)
-
-    # select the time range where from where we want to apply the anomaly correction
-    # dsclimobs: historical climate dataset
-    dsclimobs = ds_climobs.sel(time=slice(*year_range))
+    # Get the statistics for each day of year of historical_climate over
+    # the time range where from where we want to apply the anomaly
+    # correction (only computed once, see _get_climobs_stats)
+    climobs = _get_climobs_stats(
+        gdir, climate_historical_filesuffix=climate_historical_filesuffix,
+        year_range=year_range, group='dayofyear').to_xarray()
 
     # compute daily anomalies
     # of temp
@@ -536,8 +850,7 @@ def process_gcm_data_adv_daily(gdir, output_filesuffix='', prcp=None,
 
             # get the std factor (observed_reanalysis / gcm ) for same time period
             # corresponds to phi_daily in Zekollari (2019, eq. 2)
-            std_fac = dsclimobs.temp.groupby('time.dayofyear').std(
-                dim='time') / ts_tmp_std
+            std_fac = climobs.temp_stddev / ts_tmp_std
             # this needs to be adapted if sm!=1
 
             # Trial to incorporate OLD METHOD of Fabien process_gcm_data to daily
@@ -586,8 +899,8 @@ def process_gcm_data_adv_daily(gdir, output_filesuffix='', prcp=None,
         # here we additionally correct to match the mean values
         # first get scaled anomalies of temperature
         ts_tmp_sel = temp.sel(time=slice(*year_range))
-        assert len(temp.sel(time=slice(*year_range)).time) == len(
-            dsclimobs.time)
+        assert len(temp.sel(time=slice(*year_range)).time) == int(
+            climobs.n.sum())
         ts_tmp_avg = ts_tmp_sel.groupby('time.dayofyear').mean(dim='time')
         ts_tmp = temp.groupby('time.dayofyear') - ts_tmp_avg
         # then of precip -- scaled anomalies
@@ -603,12 +916,12 @@ def process_gcm_data_adv_daily(gdir, output_filesuffix='', prcp=None,
         # for temperature
         # loc_tmp: mean temperature for each day of year of historical climate period
         # (from the "observed"/reanalysis climate [not GCM])
-        loc_tmp = dsclimobs.temp.groupby('time.dayofyear').mean()
+        loc_tmp = climobs.temp_mean
         # correct the scaled temperature anomalies
         ts_tmp = ts_tmp.groupby('time.dayofyear') + loc_tmp
 
         # for prcp
-        loc_pre = dsclimobs.prcp.groupby('time.dayofyear').mean()
+        loc_pre = climobs.prcp_mean
         # scaled anomalies
         # loc_tmp: what is multiplied as factor to match the mean
         ts_pre = ts_pre.groupby('time.dayofyear') * loc_pre
@@ -639,8 +952,7 @@ def process_gcm_data_adv_daily(gdir, output_filesuffix='', prcp=None,
         # amount of days for each year
         aod = temp.groupby('time.year').count()
         # aod[aod == 365].year
-        hist_gradient = dsclimobs.gradient.groupby(
-            'time.dayofyear').mean().values
+        hist_gradient = climobs.gradient_mean.values
         # use the same gradient for every year
         # may be this could be done differently to save data...
         # amount of years: len(temp.time.values) / 365
@@ -667,7 +979,7 @@ def process_gcm_data_adv_daily(gdir, output_filesuffix='', prcp=None,
     # write the data into a netCDF file
     write_climate_file(gdir, temp.time.values,
                        ts_pre.values, ts_tmp.values,
-                       float(dsclimobs.ref_hgt),
+                       float(climobs.ref_hgt[0]),
                        prcp.lon.values, prcp.lat.values,
                        time_unit=time_unit,
                        calendar=calendar,
@@ -678,7 +990,44 @@ def process_gcm_data_adv_daily(gdir, output_filesuffix='', prcp=None,
                        gradient=gradient,
                        temporal_resol='daily')
 
-    ds_climobs.close()
+
+def _get_isimip_paths(ensemble, ssp, temporal_resol='monthly', cluster=False):
+    """ paths of the flattened ISIMIP3b files of an ensemble member and ssp
+
+    (downloaded if not on the cluster)
+
+    Returns
+    -------
+    dict with the paths of 'temp', 'precip' (and 'temp_std' for monthly
+    data) and of their historical counterparts ('temp_h', ...)
+    """
+    if temporal_resol == 'monthly':
+        if cluster:
+            path = '/home/www/lschuster/isimip3b/flat/monthly/'
+        else:
+            path = 'https://cluster.klima.uni-bremen.de/~lschuster/isimip3b/flat/monthly/'
+        add = '_global_monthly_flat_glaciers.nc'
+        variables = {'temp': 'tasAdjust', 'temp_std': 'tasAdjust_std',
+                     'precip': 'prAdjust'}
+    elif temporal_resol == 'daily':
+        if cluster:
+            path = '/home/www/lschuster/isimip3b/flat/daily/'
+        else:
+            path = 'https://cluster.klima.uni-bremen.de/~lschuster/isimip3b/flat/daily/'
+        add = '_global_daily_flat_glaciers.nc'
+        variables = {'temp': 'tasAdjust', 'precip': 'prAdjust'}
+    else:
+        raise InvalidParamsError('temporal_resol has to be monthly or daily')
+
+    fpath_spec = path + '{}_w5e5_'.format(ensemble) + '{ssp}_{var}' + add
+    fpaths = {}
+    for name, var in variables.items():
+        fpaths[name] = fpath_spec.format(var=var, ssp=ssp)
+        fpaths[name + '_h'] = fpath_spec.format(var=var, ssp='historical')
+    if not cluster:
+        fpaths = {name: utils.file_downloader(fpath)
+                  for name, fpath in fpaths.items()}
+    return fpaths
 
 
 @entity_task(log, writes=['gcm_data'])
@@ -695,6 +1044,7 @@ def process_isimip_data(gdir, output_filesuffix='', fpath_temp=None,
                         temporal_resol='monthly',
                         cluster=False,
                         year_range=('1979', '2014'),
+                        regional_store=None,
                         **kwargs):
     """Read, process and store the isimip climate data for this glacier.
 
@@ -715,9 +1065,30 @@ def process_isimip_data(gdir, output_filesuffix='', fpath_temp=None,
     climate_historical_filesuffix : str
         filesuffix of historical climate dataset that should be used to
         apply the anomaly method
+    ensemble : str or list of str
+        the ensemble member(s). For several ensemble members or ssps,
+        process_isimip_data_regional is used (the historical data is then
+        only read once)
+    ssp : str or list of str
+        the ssp(s)
+    regional_store : str
+        path to a regional store of extract_isimip_regional_store that has
+        this glacier. If given, the GCM data is read from there (and not
+        from the GCM files)
     **kwargs: any kwarg to be passed to ref:`process_gcm_data`
     """
 
+    if not (isinstance(ensemble, str) and isinstance(ssp, str)):
+        return process_isimip_data_regional(
+            [gdir], output_filesuffix=output_filesuffix,
+            fpath_temp=fpath_temp, fpath_temp_std=fpath_temp_std,
+            fpath_precip=fpath_precip, fpath_temp_h=fpath_temp_h,
+            fpath_temp_std_h=fpath_temp_std_h, fpath_precip_h=fpath_precip_h,
+            climate_historical_filesuffix=climate_historical_filesuffix,
+            ensemble=ensemble, ssp=ssp, temporal_resol=temporal_resol,
+            cluster=cluster, year_range=year_range,
+            regional_store=regional_store, **kwargs)
+
     if output_filesuffix == '':
         # recognize the gcm climate file for later
         if temporal_resol == 'monthly':
@@ -739,44 +1110,40 @@ def process_isimip_data(gdir, output_filesuffix='', fpath_temp=None,
     #        raise ValueError("Need to set cfg.PATHS['isimip3b_precip_file']")
     #    fpath_precip = cfg.PATHS['isimip3b_precip_file']
 
+    if regional_store is not None:
+        # the pre-extracted series of the glacier (lookup by rgi_id)
+        series = _read_isimip_store_series(regional_store, gdir.rgi_id,
+                                           ensemble, ssp,
+                                           temporal_resol=temporal_resol)
+        if not (temporal_resol == 'daily' and
+                kwargs.get('chunk_years') is not None):
+            # merge historical with gcm together
+            series = {name: xr.concat(pieces, dim='time')
+                      for name, pieces in series.items()}
+        gcm_kwargs = dict(output_filesuffix=output_filesuffix,
+                          prcp=series['precip'], temp=series['temp'],
+                          source=output_filesuffix, year_range=year_range,
+                          climate_historical_filesuffix=climate_historical_filesuffix,
+                          **kwargs)
+        if temporal_resol == 'monthly':
+            process_gcm_data_adv_monthly(gdir, temp_std=series['temp_std'],
+                                         **gcm_kwargs)
+        else:
+            process_gcm_data_adv_daily(gdir, **gcm_kwargs)
+        return
+
     # Glacier location
     glon = gdir.cenlon
     glat = gdir.cenlat
     if None in [fpath_temp, fpath_temp_h, fpath_temp_std, fpath_temp_std_h,
                 fpath_precip, fpath_precip_h]:
-        if temporal_resol == 'monthly':
-            if cluster:
-                path = '/home/www/lschuster/isimip3b/flat/monthly/'
-            else:
-                path = 'https://cluster.klima.uni-bremen.de/~lschuster/isimip3b/flat/monthly/'
-            add = '_global_monthly_flat_glaciers.nc'
-        elif temporal_resol == 'daily':
-            if cluster:
-                path = '/home/www/lschuster/isimip3b/flat/daily/'
-            else:
-                path = 'https://cluster.klima.uni-bremen.de/~lschuster/isimip3b/flat/daily/'
-            add = '_global_daily_flat_glaciers.nc'
-
-        fpath_spec = path + '{}_w5e5_'.format(ensemble) + '{ssp}_{var}' + add
-        fpath_temp = fpath_spec.format(var='tasAdjust', ssp=ssp)
-        fpath_temp_h = fpath_spec.format(var='tasAdjust', ssp='historical')
-
-        if temporal_resol == 'monthly':
-            fpath_temp_std = fpath_spec.format(var='tasAdjust_std', ssp=ssp)
-            fpath_temp_std_h = fpath_spec.format(var='tasAdjust_std',
-                                                 ssp='historical')
-
-        fpath_precip = fpath_spec.format(var='prAdjust', ssp=ssp)
-        fpath_precip_h = fpath_spec.format(var='prAdjust', ssp='historical')
-        if not cluster:
-            fpath_temp = utils.file_downloader(fpath_temp)
-            fpath_temp_h = utils.file_downloader(fpath_temp_h)
-            if temporal_resol == 'monthly':
-                fpath_temp_std = utils.file_downloader(fpath_temp_std)
-                fpath_temp_std_h = utils.file_downloader(fpath_temp_std_h)
-
-            fpath_precip = utils.file_downloader(fpath_precip)
-            fpath_precip_h = utils.file_downloader(fpath_precip_h)
+        fpaths = _get_isimip_paths(ensemble, ssp,
+                                   temporal_resol=temporal_resol,
+                                   cluster=cluster)
+        fpath_temp, fpath_temp_h = fpaths['temp'], fpaths['temp_h']
+        fpath_temp_std = fpaths.get('temp_std')
+        fpath_temp_std_h = fpaths.get('temp_std_h')
+        fpath_precip, fpath_precip_h = fpaths['precip'], fpaths['precip_h']
     # # need to aggregate first both gcm types !!!!
     # if flat:
     #     add = '_global_monthly_flat_glaciers.nc'
@@ -798,6 +1165,42 @@ def process_isimip_data(gdir, output_filesuffix='', fpath_temp=None,
     #     fpath_prcp_gcm = fpath_precip+ '{}_w5e5_{}_prAdjust_global_monthly_2015_2100.nc'.format(ensemble, ssp)
     #     fpath_prcp_historical = fpath_precip+ '{}_w5e5_historical_prAdjust_global_monthly_1850_2014.nc'.format(ensemble)
 
+    if temporal_resol == 'daily' and kwargs.get('chunk_years') is not None:
+        # streaming: the GCM files stay open and the time series of the
+        # nearest gridpoint are only read chunk by chunk
+        with xr.open_dataset(fpath_temp_h, use_cftime=True) as tempds_hist, \
+                xr.open_dataset(fpath_temp, use_cftime=True) as tempds_gcm, \
+                xr.open_dataset(fpath_precip_h, use_cftime=True) as precipds_hist, \
+                xr.open_dataset(fpath_precip, use_cftime=True) as precipds_gcm:
+            # Check longitude conventions
+            if tempds_gcm.longitude.min() >= 0 and glon <= 0:
+                glon += 360
+            assert tempds_gcm.attrs['experiment'] == ssp
+            # for daily: precip is already converted to mm/day during
+            # flattening
+            assert 'mm/day' in precipds_gcm.tp.units
+            series = {}
+            for name, var, ds_h, ds in [('temp', 'tasAdjust', tempds_hist,
+                                         tempds_gcm),
+                                        ('prcp', 'tp', precipds_hist,
+                                         precipds_gcm)]:
+                c = int(nearest_flat_point_index(ds, glon, glat))
+                lon = float(ds.longitude[c])
+                # Back to [-180, 180] for OGGM
+                lon = lon if lon <= 180 else lon - 360
+                # historical and gcm pieces (not loaded)
+                series[name] = [d[var].isel(points=c).assign_coords(
+                    lon=lon, lat=float(ds.latitude[c])) for d in [ds_h, ds]]
+            process_gcm_data_adv_daily(gdir,
+                                       output_filesuffix=output_filesuffix,
+                                       prcp=series['prcp'],
+                                       temp=series['temp'],
+                                       source=output_filesuffix,
+                                       year_range=year_range,
+                                       climate_historical_filesuffix=climate_historical_filesuffix,
+                                       **kwargs)
+        return
+
     # Read the GCM files
     with xr.open_dataset(fpath_temp_h, use_cftime=True) as tempds_hist, \
             xr.open_dataset(fpath_temp, use_cftime=True) as tempds_gcm:
@@ -809,12 +1212,11 @@ def process_isimip_data(gdir, output_filesuffix='', fpath_temp=None,
         # Take the closest to the glacier
         # Should we consider GCM interpolation?
         # try:
-        # computing all the distances and choose the nearest gridpoint
-        c = (tempds_gcm.longitude - glon) ** 2 + (
-                    tempds_gcm.latitude - glat) ** 2
+        # choose the nearest gridpoint (KD-tree, cached on disk)
+        c = int(nearest_flat_point_index(tempds_gcm, glon, glat))
         # first select gridpoint, then merge, should be faster!!!
-        temp_a_gcm = tempds_gcm.isel(points=c.argmin())
-        temp_a_hist = tempds_hist.isel(points=c.argmin())
+        temp_a_gcm = tempds_gcm.isel(points=c)
+        temp_a_hist = tempds_hist.isel(points=c)
         # merge historical with gcm together
         # TODO: change to drop_conflicts when xarray version v0.17.0 can
         # be used with salem
@@ -840,9 +1242,9 @@ def process_isimip_data(gdir, output_filesuffix='', fpath_temp=None,
             tempds_std = xr.merge([tempds_std_gcm, tempds_std_hist],
                                   combine_attrs='override')
             try:
-                c = (tempds_std.longitude - glon) ** 2 + \
-                    (tempds_std.latitude - glat) ** 2
-                temp_std_a = tempds_std.isel(points=c.argmin())
+                # (the tree of the not merged dataset can be cached)
+                c = int(nearest_flat_point_index(tempds_std_gcm, glon, glat))
+                temp_std_a = tempds_std.isel(points=c)
                 temp_std = temp_std_a.tasAdjust_std
                 temp_std['lon'] = temp_std_a.longitude
                 temp_std['lat'] = temp_std_a.latitude
@@ -856,10 +1258,9 @@ def process_isimip_data(gdir, output_filesuffix='', fpath_temp=None,
         # precipds = xr.merge([precipds_gcm, precipds_hist],
         #                    combine_attrs='override')
         # try:
-        c = (precipds_gcm.longitude - glon) ** 2 + (
-                    precipds_gcm.latitude - glat) ** 2
-        precip_a_gcm = precipds_gcm.isel(points=c.argmin())
-        precip_a_hist = precipds_hist.isel(points=c.argmin())
+        c = int(nearest_flat_point_index(precipds_gcm, glon, glat))
+        precip_a_gcm = precipds_gcm.isel(points=c)
+        precip_a_hist = precipds_hist.isel(points=c)
         precip_a = xr.merge([precip_a_gcm, precip_a_hist],
                             combine_attrs='override')
 
@@ -920,6 +1321,745 @@ def process_isimip_data(gdir, output_filesuffix='', fpath_temp=None,
                                    **kwargs)
 
 
+def _get_climobs_stats_of_gdirs(gdirs, climate_historical_filesuffix='',
+                                year_range=('1979', '2014')):
+    """ monthly _get_climobs_stats of several glaciers, stacked
+
+    Glaciers where the historical climate can not be read (or does not
+    cover year_range) are skipped if cfg.PARAMS['continue_on_error'].
+
+    Returns
+    -------
+    (ok, obs): indices of the glaciers with statistics and a dict with the
+    statistics of these glaciers, each with the shape (glaciers, 12)
+    """
+    n_expected = 12 * (int(year_range[1]) - int(year_range[0]) + 1)
+    ok, stats = [], []
+    for k, gdir in enumerate(gdirs):
+        try:
+            st = _get_climobs_stats(
+                gdir, climate_historical_filesuffix=climate_historical_filesuffix,
+                year_range=year_range)
+            if st['n'].sum() != n_expected:
+                raise InvalidWorkflowError('the historical climate does not '
+                                           'cover year_range')
+        except Exception as err:
+            if not cfg.PARAMS['continue_on_error']:
+                raise
+            log.warning('{}: reading the historical climate failed: '
+                        '{}'.format(gdir.rgi_id, err))
+            continue
+        ok.append(k)
+        stats.append(st)
+    if len(ok) == 0:
+        return ok, None
+    obs = {col: np.stack([st[col].values for st in stats])
+           for col in stats[0].columns}
+    return ok, obs
+
+
+def _nearest_gcm_points(ds, lon, lat):
+    """ the nearest grid points of a flattened GCM dataset
+
+    Returns
+    -------
+    (points, inverse, lon, lat): the unique (sorted) points, the index of
+    every location in points and the coordinates of the grid point of
+    every location (lon in [-180, 180])
+    """
+    lon = np.asarray(lon, dtype=np.float64)
+    # Check longitude conventions
+    if ds.longitude.min() >= 0:
+        lon = np.where(lon <= 0, lon + 360, lon)
+    idx = np.atleast_1d(nearest_flat_point_index(ds, lon, lat))
+    points, inverse = np.unique(idx, return_inverse=True)
+    plon = ds.longitude.isel(points=points).values[inverse]
+    plat = ds.latitude.isel(points=points).values[inverse]
+    # Back to [-180, 180] for OGGM
+    plon = np.where(plon > 180, plon - 360, plon)
+    return points, inverse, plon, plat
+
+
+def _read_gcm_points(fpath, var, lon, lat, experiment=None):
+    """ time series of the GCM grid points nearest to the given locations
+    (every grid point is only read once)
+
+    Returns
+    -------
+    (time, data, lon, lat, units), data has the shape (locations, time),
+    lon and lat are the coordinates of the grid points (lon in [-180, 180])
+    """
+    with xr.open_dataset(fpath, use_cftime=True) as ds:
+        if experiment is not None:
+            assert ds.attrs['experiment'] == experiment
+        points, inverse, plon, plat = _nearest_gcm_points(ds, lon, lat)
+        da = ds[var].isel(points=points).load()
+        units = ds[var].attrs.get('units', '')
+    data = da.transpose('points', 'time').values[inverse]
+    return da.time.values, data, plon, plat, units
+
+
+def _merge_gcm_points(hist, gcm):
+    """ merges historical with gcm output of _read_gcm_points together """
+    time_h, data_h, lon_h, lat_h, _ = hist
+    time, data, lon, lat, units = gcm
+    if not (np.allclose(lon_h, lon) and np.allclose(lat_h, lat)):
+        raise InvalidParamsError('the historical and the gcm files have '
+                                 'different grid points')
+    assert time_h[-1] < time[0]
+    return (np.concatenate([time_h, time]),
+            np.concatenate([data_h, data], axis=1), lon, lat, units)
+
+
+def _prcp_to_mm_per_month(gcm_points):
+    """ converts the prcp output of _read_gcm_points from kg m-2 s-1 to
+    mm month-1 """
+    time, prcp, lon, lat, units = gcm_points
+    # Convert kg m-2 s-1 to mm mth-1 => 1 kg m-2 = 1 mm !!!
+    assert 'kg m-2 s-1' in units, 'Precip units not understood'
+    dimo = np.array([cfg.DAYS_IN_MONTH[t.month - 1] for t in time])
+    return time, prcp * dimo * (60 * 60 * 24), lon, lat, 'mm month-1'
+
+
+def _scale_stddev_rolling_points(x, std_fac, n_years_ref):
+    """ same as _scale_stddev_rolling for many time series at once
+
+    x and std_fac have the shape (series, time), of full years
+    """
+    n = x.shape[0]
+    # (years, series, 12), the running mean is computed along the years
+    x = x.reshape(n, -1, 12).transpose(1, 0, 2)
+    xm = running_mean_of_months(x, n_years_ref // 2)
+    out = xm + (x - xm) * std_fac.reshape(n, -1, 12).transpose(1, 0, 2)
+    return out.transpose(1, 0, 2).reshape(n, -1)
+
+
+def _select_year_range(time, year_range):
+    """ months of the time steps and the time steps within year_range """
+    months = np.array([t.month for t in time])
+    years = np.array([t.year for t in time])
+    sel = (years >= int(year_range[0])) & (years <= int(year_range[1]))
+    return months, sel
+
+
+def _clim_of_months(x, sel, func=np.nanmean):
+    """ statistic (func) of every month of the time steps sel of the time
+    series x (series, time), sel has to start in January of full years
+
+    Returns an array of shape (series, 12)
+    """
+    xs = x[:, sel]
+    return func(xs.reshape(xs.shape[0], -1, 12), axis=1)
+
+
+def _get_gcm_ref_stats_monthly(time, temp, temp_std, prcp,
+                               year_range=('1979', '2014')):
+    """ statistics of the GCM time series over year_range that do not
+    depend on the scenario
+
+    Returns
+    -------
+    dict with the interannual std of temp and temp_std and the mean prcp
+    of every month (each of shape (series, 12)), None if year_range is not
+    covered by the time series
+    """
+    months, sel = _select_year_range(time, year_range)
+    n_expected = 12 * (int(year_range[1]) - int(year_range[0]) + 1)
+    if np.sum(sel) != n_expected or months[sel][0] != 1:
+        return None
+    return {'temp_stddev': _clim_of_months(temp, sel, np.nanstd),
+            'temp_std_stddev': _clim_of_months(temp_std, sel, np.nanstd),
+            'prcp_mean': _clim_of_months(prcp, sel)}
+
+
+def _apply_anomaly_method_monthly(temp, temp_std, prcp, months, sel, obs,
+                                  gcm_ref=None, scale_stddev=True):
+    """ the anomaly method of process_gcm_data_adv_monthly, but vectorized
+    over many GCM time series
+
+    Parameters
+    ----------
+    temp, temp_std, prcp : np.array
+        GCM time series [K, K, mm month-1] of full (hydrological) years with
+        the shape (series, time)
+    months : np.array
+        month of every time step
+    sel : np.array of bool
+        time steps of year_range (full calendar years)
+    obs : dict
+        the observed statistics (as in _get_climobs_stats) of every series,
+        each with the shape (series, 12)
+    gcm_ref : dict
+        the statistics of _get_gcm_ref_stats_monthly if they are already
+        computed (e.g. from the historical GCM files), they are computed
+        from the time series otherwise
+    scale_stddev : bool
+        whether or not to scale the temperature standard deviation as well
+
+    Returns
+    -------
+    temp [degC], temp_std, prcp of the same shape as the input. temp_std is
+    not yet clipped.
+    """
+    if months[sel][0] != 1 or np.sum(sel) % 12 != 0:
+        raise InvalidParamsError('year_range has to consist of full years '
+                                 'within the GCM time series')
+    if gcm_ref is None:
+        gcm_ref = {'temp_stddev': _clim_of_months(temp, sel, np.nanstd),
+                   'temp_std_stddev': _clim_of_months(temp_std, sel,
+                                                      np.nanstd),
+                   'prcp_mean': _clim_of_months(prcp, sel)}
+    m = months - 1
+    if scale_stddev:
+        # We need an even number of years for this to work
+        n_years_ref = np.sum(sel) // 12
+        if (n_years_ref % 2) == 1:
+            raise InvalidParamsError('We need an even number of years '
+                                     'for this to work')
+        # observed/gcm
+        std_fac = obs['temp_stddev'] / gcm_ref['temp_stddev']
+        temp = _scale_stddev_rolling_points(temp, std_fac[:, m], n_years_ref)
+        std_fac = obs['temp_std_stddev'] / gcm_ref['temp_std_stddev']
+        temp_std = _scale_stddev_rolling_points(temp_std, std_fac[:, m],
+                                                n_years_ref)
+
+    ts_tmp = temp - _clim_of_months(temp, sel)[:, m] + obs['temp_mean'][:, m]
+    ts_dstdtmp = (temp_std - _clim_of_months(temp_std, sel)[:, m] +
+                  obs['temp_std_mean'][:, m])
+    # scaled anomalies for prcp, standard anomalies where these are infinite
+    ts_pre_avg = gcm_ref['prcp_mean'][:, m]
+    loc_pre = obs['prcp_mean'][:, m]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ts_pre = prcp / ts_pre_avg * loc_pre
+    ts_pre = np.where(np.isfinite(ts_pre), ts_pre, prcp - ts_pre_avg + loc_pre)
+    # The previous step might create negative values (unlikely). Clip them
+    ts_pre = utils.clip_min(ts_pre, 0)
+    return ts_tmp, ts_dstdtmp, ts_pre
+
+
+def _process_gcm_data_adv_monthly_points(gdirs, time, prcp, temp, temp_std,
+                                         lon, lat, obs, gcm_ref=None,
+                                         output_filesuffix='',
+                                         year_range=('1979', '2014'),
+                                         scale_stddev=True, time_unit=None,
+                                         calendar=None, source='',
+                                         climate_historical_filesuffix='',
+                                         correct=True):
+    """ process_gcm_data_adv_monthly for glaciers of the same hemisphere
+
+    prcp, temp, temp_std have the shape (glaciers, time), lon, lat the
+    shape (glaciers,), obs are the stacked observed statistics of the
+    glaciers (see _get_climobs_stats_of_gdirs) and gcm_ref the optional
+    reference statistics of the GCM (see _get_gcm_ref_stats_monthly).
+    """
+    # Standard sanity checks
+    months = np.array([t.month for t in time])
+    if months[0] != 1:
+        raise ValueError('We expect the files to start in January!')
+    if months[-1] < 10:
+        raise ValueError('We expect the files to end in December!')
+
+    # from normal years to hydrological years
+    sm = cfg.PARAMS['hydro_month_' + gdirs[0].hemisphere]
+    if sm != 1:
+        time = time[sm - 1:sm - 13]
+        prcp = prcp[:, sm - 1:sm - 13]
+        temp = temp[:, sm - 1:sm - 13]
+        temp_std = temp_std[:, sm - 1:sm - 13]
+    assert len(time) % 12 == 0, 'Somehow we didn\'t get full years'
+    assert np.all(temp_std >= 0)
+    assert np.all(prcp >= 0)
+
+    if correct:
+        months, sel = _select_year_range(time, year_range)
+        ts_tmp, ts_dstdtmp, ts_pre = _apply_anomaly_method_monthly(
+            temp, temp_std, prcp, months, sel, obs, gcm_ref=gcm_ref,
+            scale_stddev=scale_stddev)
+    else:
+        # do no correction at all (!!! only for testing)
+        ts_tmp = temp - 273.15
+        ts_pre = prcp
+        ts_dstdtmp = temp_std
+        output_filesuffix = output_filesuffix + '_no_correction'
+        source = output_filesuffix + '_no_correction'
+
+    n_years = int(round(len(time) / 12))
+    for k, gdir in enumerate(gdirs):
+        try:
+            dstdtmp = ts_dstdtmp[k]
+            if correct:
+                assert np.all(np.isfinite(ts_pre[k]))
+                assert np.all(np.isfinite(ts_tmp[k]))
+                assert np.all(np.isfinite(dstdtmp))
+                amount_neg_std = np.sum(dstdtmp < 0)
+                if amount_neg_std > 0:
+                    log.warning('{}: time points with negative temp std '
+                                'that are clipped to 1e-3: '
+                                '{}'.format(gdir.rgi_id, amount_neg_std))
+                assert amount_neg_std < 10
+                assert np.min(dstdtmp) > -0.5
+                dstdtmp = utils.clip_min(dstdtmp, 1e-3)
+            # use the same gradient for every year
+            gradient = np.tile(obs['gradient_mean'][k], n_years)
+            write_climate_file(gdir, time, ts_pre[k], ts_tmp[k],
+                               float(obs['ref_hgt'][k, 0]), lon[k], lat[k],
+                               time_unit=time_unit,
+                               calendar=calendar,
+                               file_name='gcm_data',
+                               source=source + '_historical{}'.format(
+                                   climate_historical_filesuffix),
+                               filesuffix=output_filesuffix,
+                               gradient=gradient,
+                               temp_std=dstdtmp,
+                               temporal_resol='monthly')
+        except Exception as err:
+            if not cfg.PARAMS['continue_on_error']:
+                raise
+            log.warning('{}: writing the gcm_data file failed: '
+                        '{}'.format(gdir.rgi_id, err))
+
+
+# names of the variables in the flattened ISIMIP3b files
+_ISIMIP_VARIABLES = {'monthly': {'temp': 'tasAdjust',
+                                 'temp_std': 'tasAdjust_std',
+                                 'precip': 'prAdjust'},
+                     'daily': {'temp': 'tasAdjust', 'precip': 'tp'}}
+
+
+def _gcm_point_series(time, values, lon, lat, units=''):
+    """ a GCM time series of one grid point as process_isimip_data has it """
+    da = xr.DataArray(np.array(values), dims='time', coords={'time': time},
+                      attrs={'units': units})
+    da['lon'] = lon
+    da['lat'] = lat
+    return da
+
+
+def _get_isimip_filesuffixes(ensembles, ssps, temporal_resol='monthly',
+                             output_filesuffix=''):
+    """ the output filesuffix of every (ensemble, ssp)
+
+    output_filesuffix can be a str (only for one ensemble and ssp) or a
+    dict with a filesuffix for every (ensemble, ssp). If it is empty, the
+    default filesuffix of process_isimip_data is used.
+    """
+    combis = [(ens, ssp) for ens in ensembles for ssp in ssps]
+    if isinstance(output_filesuffix, dict):
+        missing = set(combis) - set(output_filesuffix)
+        if len(missing) > 0:
+            raise InvalidParamsError('output_filesuffix is missing for: '
+                                     '{}'.format(sorted(missing)))
+        return {c: output_filesuffix[c] for c in combis}
+    if output_filesuffix == '':
+        return {(ens, ssp): '_{}_ISIMIP3b_{}_{}'.format(temporal_resol, ens,
+                                                        ssp)
+                for ens, ssp in combis}
+    if len(combis) > 1:
+        raise InvalidParamsError('for several ensembles or ssps, '
+                                 'output_filesuffix has to be a dict '
+                                 '{(ensemble, ssp): filesuffix} or empty')
+    return {combis[0]: output_filesuffix}
+
+
+@global_task(log)
+def process_isimip_data_regional(gdirs, output_filesuffix='',
+                                 fpath_temp=None,
+                                 fpath_temp_std=None,
+                                 fpath_precip=None,
+                                 fpath_temp_h=None,
+                                 fpath_temp_std_h=None,
+                                 fpath_precip_h=None,
+                                 climate_historical_filesuffix='',
+                                 ensemble='mri-esm2-0_r1i1p1f1',
+                                 ssp='ssp126',
+                                 temporal_resol='monthly',
+                                 cluster=False,
+                                 year_range=('1979', '2014'),
+                                 batch_size=200,
+                                 scale_stddev=True, correct=True,
+                                 time_unit=None, calendar=None,
+                                 regional_store=None,
+                                 **kwargs):
+    """Same as process_isimip_data, but for many glaciers (and scenarios)
+    at once.
+
+    process_isimip_data opens the six GCM files and applies the anomaly
+    method with xarray groupby arithmetic for every glacier. Here, the
+    files are opened once per batch of glaciers, the grid points of all
+    glaciers of the batch are read into (glaciers, time) arrays and, for
+    monthly data, the anomaly method (monthly climatologies, std scaling,
+    anomalies and clipping) is applied to all of them at once with numpy
+    reductions along the time axis. At the end, the gcm_data file of every
+    glacier is written (with the same output as process_isimip_data). For
+    daily data, only the reading is shared and process_gcm_data_adv_daily
+    is applied to every glacier.
+
+    Several ensemble members and ssps can be processed in one call: the
+    historical GCM series (and their reference statistics) are then only
+    read once per ensemble member and the observed climate statistics only
+    once for all of them.
+
+    Parameters
+    ----------
+    gdirs : list of :py:class:`oggm.GlacierDirectory` objects
+        the glacier directories to process
+    output_filesuffix : str or dict
+        for several ensembles or ssps, a dict with the filesuffix of every
+        (ensemble, ssp). The default is the filesuffix of
+        process_isimip_data
+    ensemble : str or list of str
+        the ensemble member(s)
+    ssp : str or list of str
+        the ssp(s)
+    batch_size : int
+        the grid points of batch_size glaciers are read at once
+        (to limit the memory usage), default is 200
+    scale_stddev, correct, time_unit, calendar :
+        see process_gcm_data_adv_monthly
+    regional_store : str
+        path to a regional store of extract_isimip_regional_store with the
+        grid points of the glaciers. If given, the GCM data is read from
+        there (and not from the GCM files)
+    **kwargs :
+        for daily data, any other kwarg is passed to
+        process_gcm_data_adv_daily
+    others :
+        see process_isimip_data
+    """
+    ensembles = [ensemble] if isinstance(ensemble, str) else list(ensemble)
+    ssps = [ssp] if isinstance(ssp, str) else list(ssp)
+    output_filesuffixes = _get_isimip_filesuffixes(ensembles, ssps,
+                                                   temporal_resol,
+                                                   output_filesuffix)
+    if temporal_resol not in _ISIMIP_VARIABLES:
+        raise InvalidParamsError('temporal_resol has to be monthly or daily')
+    assert temporal_resol in climate_historical_filesuffix
+    variables = _ISIMIP_VARIABLES[temporal_resol]
+    if temporal_resol == 'monthly' and len(kwargs) > 0:
+        raise InvalidParamsError('unknown kwargs for monthly data: '
+                                 '{}'.format(list(kwargs)))
+
+    fpaths = {'temp': fpath_temp, 'temp_h': fpath_temp_h,
+              'temp_std': fpath_temp_std, 'temp_std_h': fpath_temp_std_h,
+              'precip': fpath_precip, 'precip_h': fpath_precip_h}
+    if None not in fpaths.values() and len(output_filesuffixes) > 1:
+        raise InvalidParamsError('the fpath_* kwargs can only be used for '
+                                 'one ensemble and ssp')
+
+    def get_fpaths(ens, s):
+        if None not in fpaths.values():
+            return fpaths
+        return _get_isimip_paths(ens, s, temporal_resol=temporal_resol,
+                                 cluster=cluster)
+
+    def read_points(ens, experiment, name, batch):
+        """ (time, data, lon, lat, units) of the glaciers of the batch """
+        if regional_store is not None:
+            return _read_isimip_store_points(regional_store,
+                                             [gd.rgi_id for gd in batch],
+                                             ens, experiment,
+                                             variables[name],
+                                             temporal_resol=temporal_resol)
+        if experiment == 'historical':
+            fpath = get_fpaths(ens, ssps[0])[name + '_h']
+        else:
+            fpath = get_fpaths(ens, experiment)[name]
+        return _read_gcm_points(fpath, variables[name],
+                                [gd.cenlon for gd in batch],
+                                [gd.cenlat for gd in batch],
+                                experiment=experiment
+                                if experiment != 'historical' and
+                                name == 'temp' else None)
+
+    for i0 in range(0, len(gdirs), batch_size):
+        batch = gdirs[i0:i0 + batch_size]
+        if temporal_resol == 'monthly':
+            # the observed statistics are the same for all ensembles / ssps
+            ok, obs = _get_climobs_stats_of_gdirs(
+                batch,
+                climate_historical_filesuffix=climate_historical_filesuffix,
+                year_range=year_range)
+            batch = [batch[k] for k in ok]
+            if len(batch) == 0:
+                continue
+
+        for ens in ensembles:
+            # the historical series are the same for all ssps
+            hist = {name: read_points(ens, 'historical', name, batch)
+                    for name in variables}
+            gcm_ref = None
+            if temporal_resol == 'monthly':
+                hist['precip'] = _prcp_to_mm_per_month(hist['precip'])
+                if correct:
+                    gcm_ref = _get_gcm_ref_stats_monthly(
+                        hist['temp'][0], hist['temp'][1],
+                        hist['temp_std'][1], hist['precip'][1],
+                        year_range=year_range)
+
+            for s in ssps:
+                gcm = {}
+                for name in variables:
+                    points = read_points(ens, s, name, batch)
+                    if temporal_resol == 'monthly' and name == 'precip':
+                        points = _prcp_to_mm_per_month(points)
+                    gcm[name] = _merge_gcm_points(hist[name], points)
+                time, temp = gcm['temp'][:2]
+                _, precip, lon, lat, units = gcm['precip']
+                suffix = output_filesuffixes[(ens, s)]
+
+                if temporal_resol == 'monthly':
+                    assert len(time) % 12 == 0
+                    temp_std = gcm['temp_std'][1]
+                    for hemisphere in ['nh', 'sh']:
+                        ks = [k for k, gd in enumerate(batch)
+                              if gd.hemisphere == hemisphere]
+                        if len(ks) == 0:
+                            continue
+                        _process_gcm_data_adv_monthly_points(
+                            [batch[k] for k in ks], time, precip[ks],
+                            temp[ks], temp_std[ks], lon[ks], lat[ks],
+                            {col: v[ks] for col, v in obs.items()},
+                            gcm_ref=None if gcm_ref is None else
+                            {col: v[ks] for col, v in gcm_ref.items()},
+                            output_filesuffix=suffix,
+                            year_range=year_range, scale_stddev=scale_stddev,
+                            time_unit=time_unit, calendar=calendar,
+                            source=suffix,
+                            climate_historical_filesuffix=climate_historical_filesuffix,
+                            correct=correct)
+                else:
+                    # check if it is really daily: amount of days should be
+                    # either 365 or 366
+                    _, aod = np.unique([t.year for t in time],
+                                       return_counts=True)
+                    assert np.all((aod == 365) | (aod == 366))
+                    # for daily: precip is already converted to mm/day during
+                    # flattening
+                    assert 'mm/day' in units
+                    for k, gdir in enumerate(batch):
+                        process_gcm_data_adv_daily(
+                            gdir, output_filesuffix=suffix,
+                            prcp=_gcm_point_series(time, precip[k], lon[k],
+                                                   lat[k], units=units),
+                            temp=_gcm_point_series(time, temp[k], lon[k],
+                                                   lat[k]),
+                            source=suffix, year_range=year_range,
+                            scale_stddev=scale_stddev, correct=correct,
+                            time_unit=time_unit, calendar=calendar,
+                            climate_historical_filesuffix=climate_historical_filesuffix,
+                            **kwargs)
+
+
+# rgi_id -> point of the regional stores (per file version), see
+# _get_isimip_store_index
+_ISIMIP_STORE_INDEX = {}
+
+
+def _get_isimip_store_index(path):
+    """ the index of a regional store of extract_isimip_regional_store
+
+    Returns
+    -------
+    (index, temporal_resol, lon, lat): dict rgi_id -> point, the temporal
+    resolution and the coordinates of the points of the store
+    """
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_size, stat.st_mtime)
+    if key not in _ISIMIP_STORE_INDEX:
+        with xr.open_dataset(path) as ds:
+            index = dict(zip(ds.rgi_id.values.astype(str),
+                             ds.point.values.astype(int)))
+            _ISIMIP_STORE_INDEX[key] = (index, ds.attrs['temporal_resol'],
+                                        ds.longitude.values,
+                                        ds.latitude.values)
+    return _ISIMIP_STORE_INDEX[key]
+
+
+def _read_isimip_store_points(path, rgi_ids, ensemble, experiment, var,
+                              temporal_resol='monthly'):
+    """ same as _read_gcm_points, but from a regional store (the points
+    of the glaciers are looked up by their rgi_id)
+    """
+    index, resol, lon, lat = _get_isimip_store_index(path)
+    if resol != temporal_resol:
+        raise InvalidParamsError('the regional store {} has {} and not {} '
+                                 'data'.format(path, resol, temporal_resol))
+    missing = [rgi_id for rgi_id in rgi_ids if rgi_id not in index]
+    if len(missing) > 0:
+        raise InvalidWorkflowError('the regional store {} has no data for '
+                                   '{}'.format(path, missing))
+    k = np.array([index[rgi_id] for rgi_id in rgi_ids])
+    points, inverse = np.unique(k, return_inverse=True)
+    group = '{}_{}'.format(ensemble, experiment)
+    try:
+        ds = xr.open_dataset(path, group=group, use_cftime=True)
+    except OSError:
+        raise InvalidWorkflowError('the regional store {} has no data of '
+                                   '{}'.format(path, group))
+    with ds:
+        assert ds.attrs['experiment'] == experiment
+        da = ds[var].isel(points=points).load()
+        units = ds[var].attrs.get('units', '')
+    data = da.transpose('points', 'time').values[inverse]
+    return da.time.values, data, lon[k], lat[k], units
+
+
+def _read_isimip_store_series(path, rgi_id, ensemble, ssp,
+                              temporal_resol='monthly'):
+    """ the historical and ssp time series of a glacier in a regional store
+    as process_isimip_data uses them
+
+    Returns
+    -------
+    dict with a list of the [historical, ssp] DataArrays of 'temp',
+    'precip' (and 'temp_std' for monthly data), precip is in mm month-1
+    (monthly) or mm day-1 (daily)
+    """
+    series = {}
+    for name, var in _ISIMIP_VARIABLES[temporal_resol].items():
+        for experiment in ['historical', ssp]:
+            points = _read_isimip_store_points(path, [rgi_id], ensemble,
+                                               experiment, var,
+                                               temporal_resol=temporal_resol)
+            if temporal_resol == 'monthly' and name == 'precip':
+                points = _prcp_to_mm_per_month(points)
+            time, data, lon, lat, units = points
+            series.setdefault(name, []).append(
+                _gcm_point_series(time, data[0], lon[0], lat[0],
+                                  units=units))
+    return series
+
+
+@global_task(log)
+def extract_isimip_regional_store(gdirs, path, ensemble='mri-esm2-0_r1i1p1f1',
+                                  ssp='ssp126', temporal_resol='monthly',
+                                  cluster=False, batch_size=200):
+    """Extracts the ISIMIP3b data of the glaciers into a regional store.
+
+    The grid points that the glaciers need are read from the (global)
+    flattened ISIMIP3b files of all variables, ensemble members and ssps
+    (and of the historical period) and written into one compact local
+    netCDF file. It contains an rgi_id -> point index, so that
+    process_isimip_data and process_isimip_data_regional
+    (regional_store=path) can then directly read the time series of a
+    glacier, without downloading the global files or searching the nearest
+    grid point. The result is the same.
+
+    The file has the variables rgi_id and point (per glacier) and the
+    longitude and latitude of the points, the time series are in one group
+    per ensemble member and experiment (e.g. 'mri-esm2-0_r1i1p1f1_ssp126'
+    or 'mri-esm2-0_r1i1p1f1_historical'), with the shape (points, time).
+
+    Parameters
+    ----------
+    gdirs : list of :py:class:`oggm.GlacierDirectory` objects
+        the glacier directories of the store
+    path : str
+        where to write the regional store (overwritten if it exists)
+    ensemble : str or list of str
+        the ensemble member(s)
+    ssp : str or list of str
+        the ssp(s)
+    temporal_resol : str
+        'monthly' or 'daily'
+    cluster : bool
+        whether the ISIMIP3b files are read on the cluster
+    batch_size : int
+        the time series of batch_size grid points are read (and written)
+        at once, default is 200
+
+    Returns
+    -------
+    the amount of grid points in the store
+    """
+    ensembles = [ensemble] if isinstance(ensemble, str) else list(ensemble)
+    ssps = [ssp] if isinstance(ssp, str) else list(ssp)
+    if temporal_resol not in _ISIMIP_VARIABLES:
+        raise InvalidParamsError('temporal_resol has to be monthly or daily')
+    variables = _ISIMIP_VARIABLES[temporal_resol]
+    lons = [gd.cenlon for gd in gdirs]
+    lats = [gd.cenlat for gd in gdirs]
+
+    # the points of the store: the nearest grid points in the first file,
+    # all other files need to have the same grid points
+    fpaths = _get_isimip_paths(ensembles[0], ssps[0],
+                               temporal_resol=temporal_resol, cluster=cluster)
+    with xr.open_dataset(fpaths['temp_h'], use_cftime=True) as ds:
+        _, point, plon, plat = _nearest_gcm_points(ds, lons, lats)
+    # (plon, plat) of every glacier -> of every point
+    first = np.unique(point, return_index=True)[1]
+    plon, plat = plon[first], plat[first]
+
+    tmp_path = path + '.tmp'
+    ds_index = xr.Dataset({'rgi_id': ('glacier',
+                                      np.array([gd.rgi_id for gd in gdirs])),
+                           'point': ('glacier', point),
+                           'longitude': ('points', plon),
+                           'latitude': ('points', plat)},
+                          attrs={'temporal_resol': temporal_resol,
+                                 'source': 'ISIMIP3b'})
+    ds_index.to_netcdf(tmp_path, mode='w')
+
+    # the time series are read and written in batches of points, the
+    # variables of a group are created with the first batch
+    n_points = len(plon)
+    for ens in ensembles:
+        for experiment in ['historical'] + ssps:
+            fpaths = _get_isimip_paths(ens, ssps[0] if experiment ==
+                                       'historical' else experiment,
+                                       temporal_resol=temporal_resol,
+                                       cluster=cluster)
+            group = '{}_{}'.format(ens, experiment)
+            time_group = None
+            for name, var in variables.items():
+                fpath = fpaths[name + '_h' if experiment == 'historical'
+                               else name]
+                with xr.open_dataset(fpath, use_cftime=True) as ds:
+                    if experiment != 'historical':
+                        assert ds.attrs['experiment'] == experiment
+                    # the points are searched with the location of one
+                    # glacier each
+                    points, inverse, lon, lat = _nearest_gcm_points(
+                        ds, [lons[k] for k in first], [lats[k] for k in first])
+                    if not (np.allclose(lon, plon) and
+                            np.allclose(lat, plat)):
+                        raise InvalidParamsError('{} does not have the same '
+                                                 'grid points'.format(fpath))
+                    idx = points[inverse]
+                    units = ds[var].attrs.get('units', '')
+                    for i0 in range(0, n_points, batch_size):
+                        i1 = min(i0 + batch_size, n_points)
+                        da = ds[var].isel(points=idx[i0:i1]).load()
+                        data = da.transpose('points', 'time').values
+                        if time_group is None:
+                            # the time coordinate of the group
+                            time_group = da.time.values
+                            xr.Dataset(coords={'time': time_group},
+                                       attrs={'experiment': experiment,
+                                              'ensemble': ens}
+                                       ).to_netcdf(tmp_path, mode='a',
+                                                   group=group)
+                        elif len(da.time) != len(time_group):
+                            raise InvalidParamsError('{} does not have the '
+                                                     'same time steps'
+                                                     ''.format(fpath))
+                        with ncDataset(tmp_path, 'a') as nc:
+                            ncg = nc.groups[group]
+                            if 'points' not in ncg.dimensions:
+                                ncg.createDimension('points', n_points)
+                            if var not in ncg.variables:
+                                v = ncg.createVariable(
+                                    var, data.dtype, ('points', 'time'),
+                                    zlib=True,
+                                    chunksizes=(1, len(time_group)))
+                                v.units = units
+                            ncg.variables[var][i0:i1, :] = data
+    os.replace(tmp_path, path)
+    log.workflow('extract_isimip_regional_store: {} glaciers, {} grid '
+                 'points'.format(len(gdirs), len(plon)))
+    return len(plon)
+
+
 @entity_task(log)
 def bayes_mbcalibration(gd, mb_type='mb_monthly', cores=4,
                         grad_type='cte', melt_f_prior=None,
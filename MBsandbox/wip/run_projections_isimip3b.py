@@ -97,6 +97,7 @@ from MBsandbox.wip.help_func_geodetic import minimize_bias_geodetic, optimize_st
 from MBsandbox.wip.bayes_calib_geod_direct import get_TIModel_clim_model_type, get_slope_pf_melt_f, bayes_dummy_model_better, bayes_dummy_model_ref_std, bayes_dummy_model_ref
 
 from MBsandbox.wip.projections_bayescalibration import (process_isimip_data,
+                                                        process_isimip_data_regional,
                                                         inversion_and_run_from_climate_with_bayes_mb_params)
 
 
@@ -197,29 +198,31 @@ elif step == 'run_proj':
         #workflow.execute_entity_task(oggm.shop.ecmwf.process_ecmwf_data, gdirs, dataset='ERA5dr', output_filesuffix='_monthly_ERA5dr')
         #workflow.execute_entity_task(process_era5_daily_data, gdirs, output_filesuffix='_daily_ERA5dr')
 
-        workflow.execute_entity_task(process_w5e5_data, gdirs, output_filesuffix='_daily_WFDE5_CRU', temporal_resol='daily',
-                            climate_path='/home/www/lschuster/', cluster=True)
-        workflow.execute_entity_task(process_w5e5_data, gdirs, output_filesuffix='_monthly_WFDE5_CRU', temporal_resol='monthly',
-                            climate_path='/home/www/lschuster/', cluster=True)
-
-        print('start_monthly')
-        for ssp in ['ssp126', 'ssp370']: #, 'ssp585']:
-            print(ssp)
-            workflow.execute_entity_task(process_isimip_data, gdirs, 
-                                     ensemble = ensemble,
-                                     ssp = ssp,
-                                     temporal_resol ='monthly',
+        # daily and monthly climate files from one read of the daily data
+        workflow.execute_entity_task(process_w5e5_data, gdirs,
+                                     output_filesuffix={'daily': '_daily_WFDE5_CRU',
+                                                        'monthly': '_monthly_WFDE5_CRU'},
+                                     temporal_resol=['daily', 'monthly'],
+                                     cluster=True)
+
+        # all ssps in one call: the historical GCM data and the observed
+        # climate statistics are only read once
+        ssps_isimip = ['ssp126', 'ssp370']  # , 'ssp585'
+        print('start monthly')
+        process_isimip_data_regional(gdirs, ensemble=ensemble,
+                                     ssp=ssps_isimip,
+                                     temporal_resol='monthly',
                                      climate_historical_filesuffix='_monthly_WFDE5_CRU',
-                                        cluster=True);
+                                     cluster=True)
+        # for daily data, the regional task only shares the reading and
+        # does the bias correction glacier by glacier (in one process),
+        # hence it is done per glacier with multiprocessing
         print('start daily')
-        for ssp in ['ssp126', 'ssp370']: #, 'ssp585']:
-            print(ssp)
-            workflow.execute_entity_task(process_isimip_data, gdirs, 
-                                     ensemble = ensemble,
-                                     ssp = ssp,
-                                     temporal_resol ='daily',
+        workflow.execute_entity_task(process_isimip_data, gdirs,
+                                     ensemble=ensemble, ssp=ssps_isimip,
+                                     temporal_resol='daily',
                                      climate_historical_filesuffix='_daily_WFDE5_CRU',
-                                        cluster=True);
+                                     cluster=True)
     else:
         gdirs = workflow.init_glacier_directories( pd_geodetic_comp_alps.dropna().index.values[start_ind:end_ind])
     